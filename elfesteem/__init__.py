@@ -1,3 +1,4 @@
 #!/usr/bin/env python
 
 __all__ = ['pe_init', 'elf_init', 'jclass_init', 'strpatchwork']
+__version__ = '0.1'
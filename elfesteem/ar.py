@@ -0,0 +1,291 @@
+#! /usr/bin/env python
+# ar archives: static libraries, .a for ELF and Mach-O, .lib for COFF.
+#
+# The archive starts with '!<arch>\n' and is a sequence of members, each
+# one with a header of 60 bytes in ASCII and data aligned on 2 bytes.
+# Three variants are found:
+#   GNU/SysV  symbol index in a member '/' (or '/SYM64/' with 64-bit
+#             offsets), long names in a member '//' and referenced as
+#             '/123', names terminated by '/'
+#   BSD       long names '#1/len', the name being the first 'len' bytes
+#             of the data; symbol index in '__.SYMDEF' or variants
+#   Microsoft as GNU, with a second linker member '/' (little endian)
+#             and long names terminated by a null byte
+# cf. https://en.wikipedia.org/wiki/Ar_(Unix) and the PE/COFF
+# specification, "Archive (Library) File Format".
+#
+# Only the headers and the symbol index are read when the archive is
+# parsed; the members are slices of the archive, without copy, and are
+# parsed as ELF, COFF or Mach-O when used.
+
+import sys, os
+sys.path.insert(1, os.path.abspath(sys.path[0]+'/..'))
+
+import struct, array
+from elfesteem.cstruct import CStruct, data_null
+from elfesteem.cstruct import bytes_to_name, name_to_bytes
+from elfesteem.strpatchwork import buffer_view
+import logging
+log = logging.getLogger("ar")
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(logging.Formatter("%(levelname)-5s: %(message)s"))
+log.addHandler(console_handler)
+log.setLevel(logging.WARN)
+
+ARMAG  = name_to_bytes('!<arch>\n')
+ARFMAG = name_to_bytes('`\n')
+
+class ArHdr(CStruct):
+    _fields = [ ("name_data","16s"),
+                ("date_data","12s"),
+                ("uid_data","6s"),
+                ("gid_data","6s"),
+                ("mode_data","8s"),
+                ("size_data","10s"),
+                ("fmag","2s") ]
+    def _int(self, value, base=10):
+        value = value.strip(name_to_bytes(' ')+data_null)
+        try:
+            return int(value, base)
+        except ValueError:
+            return 0
+    date = property(lambda _: _._int(_.date_data))
+    uid  = property(lambda _: _._int(_.uid_data))
+    gid  = property(lambda _: _._int(_.gid_data))
+    mode = property(lambda _: _._int(_.mode_data, 8))
+    size = property(lambda _: _._int(_.size_data))
+
+class ArMember(object):
+    def __init__(self, parent, hdr, offset, name, start, size):
+        self.parent = parent
+        self.hdr = hdr
+        self.offset = offset  # offset of the header
+        self.name = name
+        self.start = start    # offset of the data
+        self.size = size
+        self._e = None
+    def view(self):
+        # The data of the member, without copy
+        return buffer_view(self.parent._raw, self.start, self.start+self.size)
+    def data(self):
+        return self.parent._raw[self.start:self.start+self.size]
+    data = property(data)
+    def e(self):
+        # The member parsed as ELF, COFF or Mach-O, None if the format
+        # is unknown (e.g. the short import objects of .lib files)
+        if self._e is None:
+            from elfesteem.binary import detect_format
+            data = self.data
+            container = detect_format(data)
+            if container is None:
+                return None
+            self._e = container(data)
+        return self._e
+    e = property(e)
+    def __repr__(self):
+        return '<%s %r offset=%#x size=%d>' % (
+            self.__class__.__name__, self.name, self.offset, self.size)
+
+class ArSymbol(object):
+    def __init__(self, parent, name, offset):
+        self.parent = parent
+        self.name = name
+        self.offset = offset  # offset of the header of the member
+    member = property(lambda _: _.parent.member_at(_.offset))
+    def __str__(self):
+        return '%-36s %s' % (self.name, getattr(self.member, 'name', '?'))
+
+class AR(object):
+    # API shared by all/most binary containers
+    entrypoint = -1
+    sections = ()
+    dynsyms = ()
+    class virt_stub(object):
+        max_addr = lambda _:-1
+    virt = virt_stub()
+    sex = '<'
+    wsize = 32
+
+    def __init__(self, raw):
+        if raw[:8] != ARMAG:
+            raise ValueError("Not an ar archive")
+        self._raw = raw
+        self.members = []
+        self._by_offset = {}
+        self._by_name = None
+        self._longnames = None
+        # Symbol index: parallel lists of names and member offsets
+        self._index_names = []
+        self._index_offsets = []
+        self._index_type = None
+        self._symbols = None
+        self._symbol_map = None
+        self.parse_content()
+
+    def parse_content(self):
+        raw = self._raw
+        of = len(ARMAG)
+        while of + 60 <= len(raw):
+            hdr = ArHdr(parent=self, content=raw, start=of)
+            if hdr.fmag != ARFMAG:
+                log.error("Invalid ar member header at %#x", of)
+                break
+            start, size = of + 60, hdr.size
+            if start + size > len(raw):
+                log.warning("Truncated ar member at %#x", of)
+                size = len(raw) - start
+            next_of = start + size + (size & 1)
+            name = hdr.name_data.rstrip(name_to_bytes(' '))
+            if name in (name_to_bytes('/'), name_to_bytes('/SYM64/')):
+                # Microsoft archives have a second linker member '/',
+                # with the same information
+                if self._index_type is None:
+                    self.parse_gnu_index(start, size,
+                                         name != name_to_bytes('/'))
+            elif name == name_to_bytes('//'):
+                self._longnames = raw[start:start+size]
+            else:
+                if name.startswith(name_to_bytes('#1/')):
+                    # BSD: name at the beginning of the data
+                    n = min(hdr._int(name[3:]), size)
+                    name = raw[start:start+n].rstrip(data_null)
+                    start, size = start + n, size - n
+                elif name[:1] == name_to_bytes('/') and name[1:].isdigit():
+                    name = self.longname(int(name[1:]))
+                elif name.endswith(name_to_bytes('/')):
+                    name = name[:-1]
+                name = bytes_to_name(name)
+                if name.startswith('__.SYMDEF'):
+                    if self._index_type is None:
+                        self.parse_bsd_index(start, size, '_64' in name)
+                else:
+                    m = ArMember(self, hdr, of, name, start, size)
+                    self.members.append(m)
+                    self._by_offset[of] = m
+            of = next_of
+
+    def longname(self, of):
+        if self._longnames is None:
+            log.error("ar long name without table of long names")
+            return name_to_bytes('/%d' % of)
+        # GNU names end with '/\n', Microsoft names with a null byte
+        end = len(self._longnames)
+        for sep in (name_to_bytes('/\n'), data_null):
+            i = self._longnames.find(sep, of)
+            if i != -1 and i < end: end = i
+        return self._longnames[of:end]
+
+    def _names(self, data, count):
+        names = data.split(data_null)[:count]
+        return [bytes_to_name(n) for n in names]
+
+    def parse_gnu_index(self, start, size, is64):
+        # Big endian: number of symbols, offsets of the members, names
+        raw = self._raw
+        w = 4
+        if is64: w = 8
+        if size < w:
+            return
+        fmt = '>' + 'IQ'[is64]
+        count, = struct.unpack(fmt, raw[start:start+w])
+        count = min(count, (size-w)//w)
+        of = start + w
+        if is64:
+            self._index_offsets = list(struct.unpack('>%dQ' % count,
+                raw[of:of+w*count]))
+        else:
+            self._index_offsets = array.array('I', raw[of:of+w*count])
+            if sys.byteorder == 'little':
+                self._index_offsets.byteswap()
+        of += w*count
+        self._index_names = self._names(raw[of:start+size], count)
+        self._index_type = 'GNU'
+
+    def parse_bsd_index(self, start, size, is64):
+        # Size of the table of ranlib (index of the name in the string
+        # table, offset of the member), table, size of the string table,
+        # string table; in the byte order of the archived objects.
+        raw = self._raw
+        w = 4
+        if is64: w = 8
+        if size < w:
+            return
+        fmt = 'IQ'[is64]
+        for sex in '<>':
+            ranlib_size, = struct.unpack(sex+fmt, raw[start:start+w])
+            if ranlib_size + w <= size and ranlib_size % (2*w) == 0:
+                break
+        else:
+            log.error("Invalid BSD symbol index")
+            return
+        count = ranlib_size // (2*w)
+        of = start + w
+        ranlib = struct.unpack(sex+fmt*(2*count), raw[of:of+ranlib_size])
+        of += ranlib_size
+        strings = raw[of+w:start+size] + data_null
+        for i in range(count):
+            strx = ranlib[2*i]
+            self._index_names.append(bytes_to_name(
+                strings[strx:strings.find(data_null, strx)]))
+        self._index_offsets = list(ranlib[1::2])
+        self._index_type = 'BSD'
+
+    def __len__(self):
+        return len(self.members)
+    def __getitem__(self, item):
+        return self.members[item]
+    def __iter__(self):
+        return iter(self.members)
+
+    def member_at(self, offset):
+        # The member whose header is at 'offset'
+        return self._by_offset.get(offset)
+    def getmember(self, name):
+        # The first member with this name
+        if self._by_name is None:
+            self._by_name = {}
+            for m in self.members:
+                self._by_name.setdefault(m.name, m)
+        return self._by_name.get(name)
+    def member_of(self, symbol):
+        # The member defining 'symbol', found with the symbol index of
+        # the archive, without parsing any member
+        if self._symbol_map is None:
+            self._symbol_map = {}
+            for name, offset in zip(self._index_names, self._index_offsets):
+                self._symbol_map.setdefault(name, offset)
+        offset = self._symbol_map.get(symbol)
+        if offset is None:
+            return None
+        return self.member_at(offset)
+
+    def symbols(self):
+        if self._symbols is None:
+            self._symbols = [ArSymbol(self, name, offset) for name, offset
+                             in zip(self._index_names, self._index_offsets)]
+        return self._symbols
+    symbols = property(symbols)
+    def architecture(self):
+        # Architecture of the first member that can be parsed
+        for m in self.members:
+            if m.e is not None:
+                return m.e.architecture
+        return 'UNKNOWN'
+    architecture = property(architecture)
+
+    def pack(self):
+        # Archives are not modified by elfesteem
+        return self._raw
+
+    def display(self):
+        res = ['<%s>' % self.__class__.__name__]
+        for m in self.members:
+            res.append('    %-32s %8d %#010x %o' % (m.name, m.size, m.offset,
+                                                     m.hdr.mode))
+        return '\n'.join(res)
+
+if __name__ == "__main__":
+    for file in sys.argv[1:]:
+        if len(sys.argv) > 2: print("File: %s"%file)
+        e = AR(open(file, 'rb').read())
+        print(e.display())
@@ -5,11 +5,14 @@
 import sys, os
 sys.path.insert(1, os.path.abspath(sys.path[0]+'/..'))
 
+import struct
 from elfesteem.elf_init import ELF
 from elfesteem.pe_init import PE, COFF
 from elfesteem.minidump_init import Minidump
 from elfesteem.macho import MACHO
 from elfesteem.rprc import RPRC
+from elfesteem.ar import AR
+from elfesteem import macho, pe, ar
 
 class UnknownFormat(object):
     def __init__(self, raw):
@@ -23,18 +26,94 @@ class UnknownFormat(object):
         max_addr = lambda _:-1
     virt = virt_stub()
 
+# Recognition of the binary type is made by looking at the magic number
+# of the file, without parsing it. Each format is described by a function
+# 'sniff' that takes the file content and returns True if it looks like
+# this format, reading only a few bytes; the first format whose sniffer
+# matches is the only one used to parse the file. Therefore, if the parsing
+# fails, the exception is not hidden by a failed attempt with another format.
+
+def sniff_ELF(raw):
+    return raw[:4] == struct.pack("4B", 0x7f,0x45,0x4c,0x46) # \x7fELF
+
+def sniff_PE(raw):
+    # MZ header, and PE\0\0 signature at the offset given by lfanew;
+    # a DOS executable without PE header is not a PE
+    if raw[:2] != struct.pack("2B", 0x4d,0x5a):
+        return False
+    # lfanew may be truncated, e.g. Ange Albertini's d_tiny.dll which is
+    # 61 bytes long; the missing bytes are null, as when parsing DOShdr
+    lfanew = raw[60:64]
+    lfanew, = struct.unpack("<I", lfanew+struct.pack("B",0)*(4-len(lfanew)))
+    return raw[lfanew:lfanew+4] == struct.pack("4B", 0x50,0x45,0,0)
+
+def sniff_Minidump(raw):
+    return raw[:4] == struct.pack("4B", 0x4d,0x44,0x4d,0x50) # MDMP
+
+def sniff_MACHO(raw):
+    if len(raw) < 4:
+        return False
+    magic, = struct.unpack("<I", raw[:4])
+    return magic in (macho.FAT_MAGIC, macho.FAT_CIGAM,
+                     macho.MH_MAGIC, macho.MH_MAGIC_64,
+                     macho.MH_CIGAM, macho.MH_CIGAM_64)
+
+def sniff_RPRC(raw):
+    return raw[:4] == struct.pack("4B", 0x52,0x50,0x52,0x43) # RPRC
+
+def sniff_AR(raw):
+    return raw[:8] == ar.ARMAG # !<arch>\n
+
+def sniff_COFF(raw):
+    # There is no magic number for COFF; the file starts with the machine
+    # type, of unknown endianess, which should be in the table of known
+    # machines.
+    if len(raw) < 20:
+        return False
+    machines = pe.constants['IMAGE_FILE_MACHINE']
+    for sex in '<>':
+        machine, = struct.unpack(sex+"H", raw[:2])
+        if machine != pe.IMAGE_FILE_MACHINE_UNKNOWN and machine in machines:
+            return True
+    return False
+
+# List of pairs (sniff, container), in the order they are tested.
+formats = [
+    (sniff_ELF,      ELF),
+    (sniff_PE,       PE),
+    (sniff_Minidump, Minidump),
+    (sniff_MACHO,    MACHO),
+    (sniff_RPRC,     RPRC),
+    (sniff_AR,       AR),
+    (sniff_COFF,     COFF),
+    ]
+
+def register_format(sniff, container, before=None):
+    # Extension point: adds a new format to the list of known formats.
+    # If 'before' is a container already known, the new format is tested
+    # before it (useful when the new sniffer is more specific), otherwise
+    # it is tested last.
+    pos = len(formats)
+    for idx, (_, c) in enumerate(formats):
+        if c is before:
+            pos = idx
+            break
+    formats.insert(pos, (sniff, container))
+
+def detect_format(raw):
+    # Returns the container class for 'raw', or None if unknown.
+    for sniff, container in formats:
+        if sniff(raw):
+            return container
+    return None
+
 class BINARY(object):
     def __init__(self, raw):
-        for container in ELF, PE, Minidump, MACHO, RPRC, COFF:
-            try:
-                self.e = container(raw)
-                break
-            except ValueError:
-                pass
-            except AssertionError:
-                pass
-        else:
+        container = detect_format(raw)
+        if container is None:
             self.e = UnknownFormat(raw)
+        else:
+            self.e = container(raw)
     container    = property(lambda _:_.e.__class__.__name__)
     architecture = property(lambda _:_.e.architecture)
     entrypoint   = property(lambda _:_.e.entrypoint)
@@ -47,7 +126,12 @@ if __name__ == "__main__":
     for file in sys.argv[1:]:
         print("File: %s"%file)
         raw = open(file, 'rb').read()
-        e = BINARY(raw)
+        try:
+            e = BINARY(raw)
+        except (ValueError, AssertionError):
+            print("  invalid %s: %s" % (detect_format(raw).__name__,
+                                        sys.exc_info()[1]))
+            continue
         print("  container    %s" % e.container)
         print("  architecture %s" % e.architecture)
         print("  entrypoint   %#x" % e.entrypoint)
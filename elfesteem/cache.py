@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+# Persistent cache of the summaries and indexes computed when parsing
+# a binary, so that parsing the same file again can be avoided.
+#
+# The cache is content-addressed: the key is the SHA-256 of the file
+# and the version of elfesteem, therefore a file renamed or copied is
+# found in the cache, and an upgrade of elfesteem invalidates the cache.
+# The records are stored in a SQLite database, compressed; when the
+# total size of the records exceeds 'max_size', the least recently
+# used records are evicted.
+
+import hashlib, json, time, zlib
+import elfesteem
+from elfesteem import elf, scanner
+
+try:
+    import sqlite3
+except ImportError:
+    # Python 2.4 and older; the cache cannot be used.
+    sqlite3 = None
+
+def symbol_index(e):
+    # Dictionary name -> value of all symbols (static and dynamic)
+    res = {}
+    for table in (e.symbols, e.dynsyms):
+        for s in table:
+            name = getattr(s, 'name', None)
+            if name:
+                res[name] = s.value
+    return res
+
+def exports_index(e):
+    # Dictionary name -> address of exported symbols
+    container = e.__class__.__name__
+    if container == 'PE':
+        res = {}
+        for name, addr in e.export_funcs().items():
+            if not isinstance(name, int):
+                res[name] = addr
+        return res
+    if container == 'ELF':
+        res = {}
+        for s in e.dynsyms:
+            if s.name and s.shndx != elf.SHN_UNDEF:
+                res[s.name] = s.value
+        return res
+    return None
+
+def address_map(summary):
+    # Sorted list of [addr, end, name] for all mapped sections
+    res = []
+    for s in summary.get('sections') or ():
+        if s.get('addr') and s.get('size'):
+            res.append([s['addr'], s['addr']+s['size'], s['name']])
+    res.sort()
+    return res
+
+def record(raw):
+    # The content of a cache entry for 'raw': the summary computed by
+    # the scanner, and some indexes
+    b = scanner.BINARY(raw)
+    res = scanner.summary(raw, b)
+    e = b.e
+    res['symbol_index'] = scanner._get(lambda: symbol_index(e),
+                                       res, 'symbol_index')
+    res['exports']      = scanner._get(lambda: exports_index(e),
+                                       res, 'exports')
+    res['address_map']  = address_map(res)
+    return res
+
+class ParseCache(object):
+    def __init__(self, path, max_size=None):
+        if sqlite3 is None:
+            raise ImportError("sqlite3 is needed for ParseCache")
+        self.path = path
+        self.max_size = max_size
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS records ("
+                        " key TEXT PRIMARY KEY,"
+                        " data BLOB,"
+                        " size INTEGER,"
+                        " atime REAL)")
+        self.db.commit()
+    def key(self, raw):
+        return '%s:%s' % (elfesteem.__version__,
+                          hashlib.sha256(raw).hexdigest())
+    def close(self):
+        self.db.close()
+
+    def __getitem__(self, key):
+        row = self.db.execute("SELECT data FROM records WHERE key=?",
+                              (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        self.db.execute("UPDATE records SET atime=? WHERE key=?",
+                        (time.time(), key))
+        self.db.commit()
+        return json.loads(zlib.decompress(row[0]).decode('utf8'))
+    def __setitem__(self, key, value):
+        data = zlib.compress(json.dumps(value, sort_keys=True).encode('utf8'))
+        self.db.execute("INSERT OR REPLACE INTO records VALUES (?,?,?,?)",
+                        (key, sqlite3.Binary(data), len(data), time.time()))
+        self.db.commit()
+        self.evict()
+    def __contains__(self, key):
+        return self.db.execute("SELECT 1 FROM records WHERE key=?",
+                               (key,)).fetchone() is not None
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size),0) FROM records"
+                               ).fetchone()[0]
+
+    def evict(self):
+        # Least recently used records are removed, until the total size
+        # is below max_size
+        if self.max_size is None:
+            return
+        total = self.size()
+        while total > self.max_size:
+            row = self.db.execute("SELECT key, size FROM records"
+                                  " ORDER BY atime LIMIT 1").fetchone()
+            if row is None:
+                break
+            self.db.execute("DELETE FROM records WHERE key=?", (row[0],))
+            total -= row[1]
+        self.db.commit()
+
+    def get(self, raw):
+        # Returns the record for 'raw', parsing it only if it was not
+        # already in the cache
+        key = self.key(raw)
+        try:
+            return self[key]
+        except KeyError:
+            pass
+        value = record(raw)
+        self[key] = value
+        return value
@@ -1,6 +1,7 @@
 from elfesteem.macho.sections import *
 from elfesteem.macho.loaders import *
-from elfesteem import intervals
+from elfesteem.macho import common
+from elfesteem import intervals, ar
 import struct
 
 constants = {}
@@ -119,24 +120,53 @@ class FarchList(CArray):
     #       self.parent.interval.delete(of+20*i,of+20*(i+1))
 
 class MachoList(CBase):
+    # The architectures of a fat file, parsed when first used. The
+    # intervals of the content of each architecture are computed only
+    # if the fat file has been created with slice_intervals=True; they
+    # are removed from the intervals of the fat file.
     def unpack(self, c, o):
-        self.macholist = []
-        for farch in self.parent.fh:
-            e = MACHO(c[farch.offset:farch.offset+farch.size],
-                      interval=intervals.Intervals().add(0,farch.size),
-                      parseSymbols=self.parent.fh.parseSymbols)
-            e.offset = farch.offset
-            self.macholist.append(e)
-            inverse = intervals.Intervals().add(0,farch.size)
-            for j in e.interval.ranges:
-                inverse.delete(j.start,j.stop)
-            if not self.parent.interval == None:
-                for j in inverse.ranges:
-                    if not self.parent.interval.contains(farch.offset+j.start,farch.offset+j.stop):
-                        raise ValueError("This part of file has already been parsed")
-                    self.parent.interval.delete(farch.offset+j.start,farch.offset+j.stop)
+        self._content = c
+        self._arch = [None] * len(self.parent.fh)
+    def parse(self, i):
+        farch = self.parent.fh[i]
+        data = self._content[farch.offset:farch.offset+farch.size]
+        interval = None
+        if self.parent.slice_intervals:
+            interval = intervals.Intervals().add(0,farch.size)
+        inverse = intervals.Intervals().add(0,farch.size)
+        if data[:8] == ar.ARMAG:
+            # Static archive library, which is entirely parsed
+            e = ar.AR(data)
+        else:
+            e = MACHO(data,
+                  interval=interval,
+                  parseSymbols=self.parent.fh.parseSymbols)
+            if interval is not None:
+                for j in e.interval.ranges:
+                    inverse.delete(j.start,j.stop)
+        e.offset = farch.offset
+        self._arch[i] = e
+        if interval is not None and self.parent.interval is not None:
+            for j in inverse.ranges:
+                if not self.parent.interval.contains(farch.offset+j.start,farch.offset+j.stop):
+                    raise ValueError("This part of file has already been parsed")
+                self.parent.interval.delete(farch.offset+j.start,farch.offset+j.stop)
+        return e
+    def is_parsed(self, i):
+        return self._arch[i] is not None
+    def __len__(self):
+        return len(self._arch)
     def __getitem__(self, item):
-        return self.macholist[item]
+        if type(item) is slice:
+            return [self[i] for i in range(*item.indices(len(self)))]
+        e = self._arch[item]
+        if e is None:
+            e = self.parse(range(len(self))[item])
+        return e
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    macholist = property(lambda _: [e for e in _])
 
 
 #### Generic elfesteem data structures
@@ -220,8 +250,13 @@ class virt(object):
 
 
 # MACHO object
+def cpu_name(cputype):
+    # The CPU types are defined in elfesteem.macho.common
+    return common.constants['CPU_TYPE'].get(cputype, 'UNKNOWN(%d)'%cputype)
+
 class MACHO(object):
-    # Either a FAT file, or a normal Mach-O file (TODO: ar archives)
+    # Either a FAT file, or a normal Mach-O file; the architectures of a
+    # FAT file can also be ar archives, parsed as elfesteem.ar.AR
     # Normal Mach-O file
     #   Mhdr     Header
     #   load     Load commands
@@ -232,10 +267,14 @@ class MACHO(object):
     #   fh       list of architectures
     #   arch     list of normal Mach-O files
     #   rawdata  Unanalyzed data
-    def __init__(self, data, interval=True, parseSymbols=True):
+    #   Each architecture of a FAT file is parsed when first used; with
+    #   slice_intervals=True, the intervals of its content are computed.
+    def __init__(self, data, interval=True, parseSymbols=True,
+                 slice_intervals=False):
         if interval is True:
             interval = intervals.Intervals().add(0,len(data))
         self.interval = interval
+        self.slice_intervals = slice_intervals
         self.datasize = len(data)
         self.content = StrPatchwork(data)
         self.parse_content(parseSymbols=parseSymbols)
@@ -259,11 +298,11 @@ class MACHO(object):
             self.rawdata = []
             self.symbols = () # or merge symbol tables of all architectures?
             self.sect    = () # or merge sections of all architectures?
-        elif  self.content[0:7] == '!<arch>':
+        elif  self.content[0:8] == ar.ARMAG:
             # a Mach-O FAT file may contain ar archives, called "Static
             # archive libraries",
             # cf. https://developer.apple.com/library/mac/documentation/DeveloperTools/Conceptual/MachOTopics/1-Articles/building_files.html
-            # elfesteem does not know how to parse ar archives
+            # they are parsed by elfesteem.ar, not as Mach-O
             raise ValueError("ar archive")
         elif  magic in (MH_MAGIC, MH_MAGIC_64,
                         MH_CIGAM, MH_CIGAM_64):
@@ -325,7 +364,15 @@ class MACHO(object):
             c[0] = fhdr
             offset = len(fhdr)
             c[offset] = self.fh.pack()
-            for e in self.arch.macholist:
+            for i, farch in enumerate(self.fh):
+                if not self.arch.is_parsed(i):
+                    # Not parsed, therefore not modified
+                    c[farch.offset] = self.content[farch.offset:farch.offset+farch.size]
+                    continue
+                e = self.arch[i]
+                if getattr(e, 'interval', False) is None:
+                    # What has not been parsed is not in e.rawdata
+                    c[e.offset] = self.content[farch.offset:farch.offset+farch.size]
                 c[e.offset] = e.pack()
             for offset, data in self.rawdata:
                 c[offset] = data
@@ -333,12 +380,29 @@ class MACHO(object):
     def __str__(self):
         raise AttributeError("Use pack() instead of str()")
     
-    cpuname = property(lambda _:constants['CPU_TYPE'].get(_.Mhdr.cputype,
-                                'UNKNOWN(%d)'%_.Mhdr.cputype))
+    cpuname = property(lambda _:cpu_name(_.Mhdr.cputype))
     def architecture(self):
         if hasattr(self, 'Mhdr'): return self.cpuname
-        else: return [ _.cpuname for _ in self.arch ]
+        else: return [ cpu_name(_.cputype) for _ in self.fh ]
     architecture = property(architecture)
+
+    def arch_for(self, cputype, cpusubtype=None):
+        # The Mach-O file (or ar archive) for this CPU type and subtype,
+        # whose feature flags are ignored; None if there is none.
+        # In a FAT file, only this architecture is parsed.
+        if hasattr(self, 'Mhdr'):
+            archs = [(self.Mhdr.cputype, self.Mhdr.cpusubtype, lambda: self)]
+        else:
+            archs = [(farch.cputype, farch.cpusubtype, lambda i=i: self.arch[i])
+                     for i, farch in enumerate(self.fh)]
+        for t, st, e in archs:
+            if t != cputype:
+                continue
+            if cpusubtype is not None and \
+                    (st ^ cpusubtype) & ~CPU_SUBTYPE_MASK:
+                continue
+            return e()
+        return None
     
     def entrypoint(self):
         if not hasattr(self, 'load'):
@@ -509,6 +573,10 @@ class MACHO(object):
     def checkParsedCompleted(self, **kargs):
         if self.interval == None :
             raise ValueError("No interval argument in macho_init call")
+        if hasattr(self, 'Fhdr'):
+            if not self.slice_intervals:
+                raise ValueError("No slice_intervals argument in macho_init call")
+            self.arch.macholist
         result = []
         for i in self.interval :
             data = self.content[i:i+1]
@@ -3,8 +3,8 @@
 from elfesteem.cstruct import Constants, CBase, CString, CStruct, CArray
 from elfesteem.cstruct import data_null, data_empty
 from elfesteem.cstruct import bytes_to_name, name_to_bytes
-from elfesteem.strpatchwork import StrPatchwork
-import struct
+from elfesteem.strpatchwork import StrPatchwork, buffer_view
+import struct, bisect, array
 import logging
 log = logging.getLogger("pe")
 console_handler = logging.StreamHandler()
@@ -137,6 +137,27 @@ IMAGE_FILE_FLAG_UP_SYSTEM_ONLY          = 0x4000,
 IMAGE_FILE_FLAG_BYTES_REVERSED_HI       = 0x8000,
 )
 
+SetConstants(
+IMAGE_DEBUG_TYPE_UNKNOWN               = 0,
+IMAGE_DEBUG_TYPE_COFF                  = 1,
+IMAGE_DEBUG_TYPE_CODEVIEW              = 2,
+IMAGE_DEBUG_TYPE_FPO                   = 3,
+IMAGE_DEBUG_TYPE_MISC                  = 4,
+IMAGE_DEBUG_TYPE_EXCEPTION             = 5,
+IMAGE_DEBUG_TYPE_FIXUP                 = 6,
+IMAGE_DEBUG_TYPE_OMAP_TO_SRC           = 7,
+IMAGE_DEBUG_TYPE_OMAP_FROM_SRC         = 8,
+IMAGE_DEBUG_TYPE_BORLAND               = 9,
+IMAGE_DEBUG_TYPE_RESERVED10            = 10,
+IMAGE_DEBUG_TYPE_CLSID                 = 11,
+IMAGE_DEBUG_TYPE_VC_FEATURE            = 12,
+IMAGE_DEBUG_TYPE_POGO                  = 13,
+IMAGE_DEBUG_TYPE_ILTCG                 = 14,
+IMAGE_DEBUG_TYPE_MPX                   = 15,
+IMAGE_DEBUG_TYPE_REPRO                 = 16,
+IMAGE_DEBUG_TYPE_EX_DLLCHARACTERISTICS = 20,
+)
+
 SetConstants(
 IMAGE_SYM_CLASS_END_OF_FUNCTION  = -1,
 IMAGE_SYM_CLASS_NULL             = 0,
@@ -297,6 +318,16 @@ IMAGE_SUBSYSTEM_WINDOWS_BOOT_APPLICATION = 16,
 
 # Relocations
 
+SetConstants(
+# Types of the base relocations, in the .reloc section
+IMAGE_REL_BASED_ABSOLUTE = 0,
+IMAGE_REL_BASED_HIGH     = 1,
+IMAGE_REL_BASED_LOW      = 2,
+IMAGE_REL_BASED_HIGHLOW  = 3,
+IMAGE_REL_BASED_HIGHADJ  = 4,
+IMAGE_REL_BASED_DIR64    = 10,
+)
+
 SetConstants(
 # The following relocation type indicators are defined for x64 and compatible processors
 IMAGE_REL_AMD64_ABSOLUTE = 0x0000, # The relocation is ignored.
@@ -781,7 +812,6 @@ class SectionData(CBase):
             filealignment = pefile.NThdr.filealignment
         else:
             filealignment = 0
-        self.data = StrPatchwork()
         if filealignment != 0:
             if self.parent.scnptr % filealignment:
                 log.warning('Section %d offset %#x not aligned to %#x',
@@ -793,7 +823,14 @@ class SectionData(CBase):
         raw_sz += self.parent.scnptr - self.parent.scn_baseoff
         if self.parent.scn_baseoff+raw_sz > len(c):
             raw_sz = len(c) - self.parent.scn_baseoff
-        self.data[0] = c[self.parent.scn_baseoff:self.parent.scn_baseoff+raw_sz]
+        start = self.parent.scn_baseoff
+        if isinstance(c, StrPatchwork):
+            # The data is shared with the file content; it is copied
+            # only when one of them is modified.
+            self.data = c.share(start, start+max(0, raw_sz))
+        else:
+            self.data = StrPatchwork()
+            self.data[0] = c[start:start+raw_sz]
         if self.parent.relptr >= len(c):
             raise ValueError("COFF invalid relptr")
         self.relocs = COFFRelocations(parent=self.parent,
@@ -859,6 +896,12 @@ class Shdr(CStruct):
                 ("nlnno","u16"),   # was named 'numberoflinenumbers'
                 ("flags","u32"),
                 ("section_data",SectionData) ]
+    def setf(self, fname, v):
+        if fname in Shdr._index_fields:
+            # The RVA and offset indexes of SHList are obsolete
+            self.parent.modified()
+        CStruct.setf(self, fname, v)
+    _index_fields = ('name_data', 'paddr', 'vaddr', 'rsize', 'scnptr')
     def name(self):
         # Offset in the string table, if more than 8 bytes long
         n = self.name_data
@@ -961,6 +1004,38 @@ class SHList(CArray):
     def shlist(self):
         return self._array
     shlist = property(shlist)
+    # Sorted indexes of the sections by RVA and by file offset, used by
+    # PE.getsectionbyrva and PE.getsectionbyoff, built when needed.
+    # They are invalidated when a section is added or when a field of
+    # a section header that is used by the index is modified; the number
+    # of sections is also checked, because some code modifies _array.
+    _index = None
+    def modified(self):
+        # Called before any modification of the sections: the directories
+        # not yet parsed are parsed with the sections of the file.
+        parse_pending = getattr(self.parent, 'parse_pending', None)
+        if parse_pending is not None:
+            parse_pending()
+        self._index = None
+    def _index_build(self):
+        # Intervals [vaddr, vaddr+size) and [scnptr, scnptr+rsize)
+        rva = [(s.vaddr, s.vaddr+s.size, s) for s in self._array]
+        off = [(s.scnptr, s.scnptr+s.rsize, s) for s in self._array]
+        self._index = (self._array, len(self._array),
+                       self.parent.isPE(),
+                       IntervalIndex(rva), IntervalIndex(off))
+        return self._index
+    def _index_get(self):
+        index = self._index
+        if index is None or index[0] is not self._array \
+                or index[1] != len(self._array) \
+                or index[2] != self.parent.isPE():
+            index = self._index_build()
+        return index
+    def getsectionbyrva(self, rva):
+        return self._index_get()[3].find(rva)
+    def getsectionbyoff(self, off):
+        return self._index_get()[4].find(off)
     def display(self):
         rep = ["#  section         offset   size   addr     flags   rawsize  "]
         for i, s in enumerate(self):
@@ -1058,6 +1133,7 @@ class SHList(CArray):
         s.paddr = max(s.paddr, s_align)
         s.section_data = SectionData(parent=s, data=data)
     
+        self.modified()
         self.append(s)
         self.parent.COFFhdr.numberofsections = len(self)
     
@@ -1072,6 +1148,7 @@ class SHList(CArray):
         if s_align == None:
             s_align = self.parent.NThdr.sectionalignment
             s_align = max(0x1000, s_align)
+        self.modified()
         addr = self[0].offset
         for s in self:
             if not s.is_in_file():
@@ -1081,6 +1158,34 @@ class SHList(CArray):
             s.rawsize = len(s.data)
             addr = raw_off + s.rawsize
 
+class IntervalIndex(object):
+    # Index of the intervals [start, end) of a list of (start, end, obj);
+    # find(value) returns the first obj in the list whose interval
+    # contains value, even if intervals overlap, or None.
+    # The bounds of all intervals are sorted, and for each elementary
+    # interval between two consecutive bounds the first obj is stored.
+    def __init__(self, intervals):
+        bounds = {}
+        for start, end, obj in intervals:
+            if start < end:
+                bounds[start] = True
+                bounds[end] = True
+        self.bounds = sorted(bounds.keys())
+        self.owner = [None] * len(self.bounds)
+        # Reverse order, the first interval of the list overwrites the
+        # next ones
+        for idx in range(len(intervals)-1, -1, -1):
+            start, end, obj = intervals[idx]
+            if start < end:
+                i = bisect.bisect_left(self.bounds, start)
+                j = bisect.bisect_left(self.bounds, end)
+                self.owner[i:j] = [obj] * (j-i)
+    def find(self, value):
+        i = bisect.bisect_right(self.bounds, value) - 1
+        if i < 0:
+            return None
+        return self.owner[i]
+
 
 ####################################################################
 # Directories
@@ -1195,7 +1300,16 @@ class ImportNamePtr(CStruct):
                 self.obj = None
                 self.name = None
             else:
-                self.obj = ImportName(parent=self, content=c, start=off)
+                # The same ImportName is usually pointed to by the IAT
+                # and the ILT; it is decoded only once.
+                memo = getattr(self.parent.parent.parent, '_memo_names', None)
+                if memo is None:
+                    self.obj = ImportName(parent=self, content=c, start=off)
+                elif off in memo:
+                    self.obj = memo[off]
+                else:
+                    self.obj = ImportName(parent=self, content=c, start=off)
+                    memo[off] = self.obj
                 self.name = str(self.obj.name)
 
 class ImportThunks(CArray):
@@ -1211,6 +1325,28 @@ class ImportDescriptor(CStruct):
               ]
     def rva2off(self, rva):
         return self.parent.parent.rva2off(rva)
+    def __getattr__(self, name):
+        # The ILT and IAT of descriptors created by write_directory are
+        # only made of objects when they are used
+        if name in ('ILT', 'IAT') and '_thunks' in self.__dict__:
+            self.make_thunks()
+            return getattr(self, name)
+        raise AttributeError(name)
+    def make_thunks(self):
+        dll_func, rvas = self.__dict__.pop('_thunks')
+        self.ILT = ImportThunks(parent=self)
+        self.IAT = ImportThunks(parent=self)
+        for n, rva in zip(dll_func, rvas):
+            t = ImportNamePtr(parent=self.ILT)
+            t.obj = ImportName(parent=t, s=n.encode('latin1'))
+            t.name = n
+            t.rva = rva
+            self.ILT.append(t)
+            u = ImportNamePtr(parent=self.IAT)
+            u.obj = t.obj
+            u.name = n
+            u.rva = rva
+            self.IAT.append(u)
     def unpack(self, c, o):
         CStruct.unpack(self, c, o)
         if self.parent.stop(self):
@@ -1227,22 +1363,22 @@ class ImportDescriptor(CStruct):
         else:
             self.name = CString(parent=self, content=c, start=of)
         # NB: it is possible for a PE to have many Import descriptors
-        # pointing to the same IAT and ILT. elfesteem will take a
-        # long time because the IAT and ILT will be parsed each time.
+        # pointing to the same IAT and ILT. The IAT and ILT are parsed
+        # only once, cf. DirImport.thunks
         # An example of such malformed file is
         # https://github.com/radare/radare2-regressions/blob/master/bins/fuzzed/file-rs-bf838568
         of = self.rva2off(self.firstthunk)
         if of is None:
             log.error('IAT')
         else:
-            self.IAT = ImportThunks(parent=self, content=c, start=of)
+            self.IAT = self.parent.thunks(self, c, of)
         # NB: http://win32assembly.programminghorizon.com/pe-tut6.html
         # says "Some linkers generate PE files with 0 in
         # OriginalFirstThunk. This is considered a bug."
         # An example is the IDA installer!
         of = self.rva2off(self.originalfirstthunk)
         if not of in (0, None):
-            self.ILT = ImportThunks(parent=self, content=c, start=of)
+            self.ILT = self.parent.thunks(self, c, of)
 
 class DirImport(CArrayDirectory):
     _cls = ImportDescriptor
@@ -1268,6 +1404,37 @@ class DirImport(CArrayDirectory):
         return res
     def pack(self):
         raise AttributeError("Cannot pack '%s': the Directory Entry data is not always contiguous"%self.__class__.__name__)
+    def unpack(self, c, o):
+        # While parsing, thunk arrays and names are memoized by offset
+        self._memo_thunks = {}
+        self._memo_names = {}
+        try:
+            CArrayDirectory.unpack(self, c, o)
+        finally:
+            del self._memo_thunks
+            del self._memo_names
+    def thunks(self, d, c, of):
+        # The ImportThunks at offset 'of' for the descriptor 'd'.
+        # If another descriptor has a thunk array at the same offset,
+        # it is not parsed again: each descriptor has its own array and
+        # its own elements, which can be modified independently, and
+        # only the ImportName they point to are shared.
+        memo = getattr(self, '_memo_thunks', None)
+        if memo is None:
+            return ImportThunks(parent=d, content=c, start=of)
+        if not of in memo:
+            memo[of] = ImportThunks(parent=d, content=c, start=of)
+            return memo[of]
+        t = ImportThunks(parent=d)
+        for p in memo[of]:
+            u = ImportNamePtr(parent=t)
+            u.rva = p.rva
+            u.name = p.name
+            if hasattr(p, 'obj'):
+                u.obj = p.obj
+            t.append(u)
+        t._off = of
+        return t
     def stop(self, elt):
         # Ange Albertini's imports_badterm.exe and imports_tinyXP.exe shows
         # that the ImportDescriptor does not need to be all zeroes to be a
@@ -1294,29 +1461,10 @@ class DirImport(CArrayDirectory):
         #             TODO: memorize this value to be used in
         #             'write_directory'
         # - dll_func: list of function names
+        # Only the names are memorized; the layout is computed by
+        # 'write_directory', for all DLL at once.
         for dll_name, dll_func in new_dll:
-            # First, an empty descriptor
-            d = ImportDescriptor(parent=self)
-            self.dll_to_add.append(d)
-            # Add the DLL name
-            d.name = CString(parent=d, s=dll_name['name'].encode('latin1'))
-            # Add the Import names; they will be located after the two thunks
-            thunk_len = (1+len(dll_func))*(self.wsize/8)
-            thunk_len *= 2
-            # Add the IAT & ILT
-            d.ILT = ImportThunks(parent=d)
-            for n in dll_func:
-                t = ImportNamePtr(parent=d.ILT)
-                t.obj = ImportName(parent=t, s=n.encode('latin1'))
-                t.name = n
-                thunk_len += t.obj.bytelen
-                if thunk_len%2: thunk_len += 1
-                d.ILT.append(t)
-            d.IAT = ImportThunks(parent=d)
-            for n in dll_func:
-                t = ImportNamePtr(parent=d.ILT)
-                t.name = n
-                d.IAT.append(t)
+            self.dll_to_add.append((dll_name['name'], list(dll_func)))
     def write_directory(self, base_rva):
         # Creates in the section starting at 'base_rva' a new Import Directory
         # with the content of self.dll_to_add
@@ -1357,39 +1505,54 @@ class DirImport(CArrayDirectory):
                 rsize=0x1000,     # should be enough
                 )
             base_rva = s_dir.vaddr
-        s_dir.section_data.data = StrPatchwork()
+        # The layout of the whole directory is computed in one pass,
+        # and its content is a list of strings, written at once in the
+        # section: for each DLL its name, ILT, IAT and the hint/name of
+        # its functions; a hint/name already written for another DLL
+        # is not duplicated.
         self._size += self._cls(parent=self).bytelen * len(self.dll_to_add)
         of = self.bytelen
-        for d in self.dll_to_add:
+        data = []
+        hintnames = {}
+        ptrsize = self.wsize//8
+        thunk_fmt = '<%d' + {4: 'I', 8: 'Q'}[ptrsize]
+        for dll_name, dll_func in self.dll_to_add:
+            d = ImportDescriptor(parent=self)
             self._array.append(d)
+            d.name = CString(parent=d, s=dll_name.encode('latin1'))
+            name = d.name.pack()
+            name += data_null*(len(name)%2)
             d.name_rva = base_rva+of
-            s_dir.section_data.data[of] = d.name.pack()
-            of += d.name.bytelen
-            if of%2: of += 1
-            thunk_len = (1+len(d.ILT))*(self.wsize//8)
-            thunk_len *= 2
-            for t in d.ILT:
-                t.rva = base_rva+of+thunk_len
-                s_dir.section_data.data[of+thunk_len] = t.obj.pack()
-                thunk_len += t.obj.bytelen
-                if thunk_len%2: thunk_len += 1
+            data.append(name)
+            of += len(name)
+            thunk_len = 2*(1+len(dll_func))*ptrsize
+            names = []
+            rvas = []
+            for n in dll_func:
+                if not n in hintnames:
+                    hintname = struct.pack('<H', 0) + n.encode('latin1') + data_null
+                    hintname += data_null*(len(hintname)%2)
+                    hintnames[n] = base_rva+of+thunk_len
+                    names.append(hintname)
+                    thunk_len += len(hintname)
+                rvas.append(hintnames[n])
+            thunks = struct.pack(thunk_fmt % (1+len(rvas)), *(rvas+[0]))
             d.originalfirstthunk = base_rva+of
-            s_dir.section_data.data[of] = d.ILT.pack()
-            of += d.ILT.bytelen
-            d.firstthunk = base_rva+of
-            for idx, t in enumerate(d.IAT):
-                t.obj = d.ILT[idx].obj
-                t.rva = d.ILT[idx].rva
-            s_dir.section_data.data[of] = d.IAT.pack()
-            of += thunk_len - d.ILT.bytelen
+            d.firstthunk = base_rva+of+len(thunks)
+            d._thunks = (dll_func, rvas)
+            data.extend([thunks, thunks])
+            data.extend(names)
+            of += thunk_len
         self.dll_to_add = []
-        # Write the descriptor list (now that all RVA have been computed)
-        s_dir.section_data.data[0] = CArray.pack(self)
+        # The descriptor list, now that all RVA have been computed
+        data.insert(0, CArray.pack(self))
+        data = data_empty.join(data)
         # Update the section sizes
-        s_dir.paddr = len(s_dir.section_data.data)
+        s_dir.paddr = len(data)
         if s_dir.rsize < s_dir.paddr:
             s_dir.rsize = s_dir.paddr
-        s_dir.section_data.data[s_dir.paddr] = data_null*(s_dir.rsize-s_dir.paddr)
+        data += data_null*(s_dir.rsize-s_dir.paddr)
+        s_dir.section_data.data = StrPatchwork(data)
         e.NThdr.optentries[self._idx].rva = base_rva
         e.NThdr.optentries[self._idx].size = s_dir.paddr # Unused by PE loaders
     def get_funcrva(self, dllname, funcname):
@@ -1532,10 +1695,10 @@ class ExportDescriptor(CStruct):
             # If self.numberofnames is invalid we prefer the smaller value!
             j = self.EOT[i].ordinal
             if j >= self.numberoffunctions:
-                print("Invalid ordinal[%d]: %d"%(i,j))
+                log.warning("Invalid ordinal[%d]: %d", i, j)
                 continue
             if self.base+j in self.exports:
-                print("Duplicate ordinal at %d"%(self.base+j))
+                log.warning("Duplicate ordinal at %d", self.base+j)
                 continue
             addr = self.EAT[j]
             name = self.ENPT[i].name
@@ -1546,6 +1709,56 @@ class ExportDescriptor(CStruct):
             if not self.base+i in self.exports:
                 addr = self.EAT[i]
                 self.exports[self.base+i] = (addr, CString(parent=self))
+        self._index = None
+    def index(self):
+        if getattr(self, '_index', None) is None:
+            self._index = ExportIndex(self)
+        return self._index
+    index = property(index)
+
+class ExportIndex(object):
+    # Index of the exports of an ExportDescriptor, built once:
+    # - ordinal -> RVA, in an array,
+    # - name -> position in the ENPT, in a dictionary,
+    # - forwarded exports, as "DLL.Func" or "DLL.#ordinal",
+    # - the list of names of the ENPT, which is sorted in a valid PE, and
+    #   used by the PE loader for a binary search.
+    def __init__(self, d):
+        self.base = d.base
+        self.rvas = array.array('I', [t.rva for t in d.EAT])
+        self.forwarders = {}
+        for j, t in enumerate(d.EAT):
+            if hasattr(t, 'name'):
+                self.forwarders[j] = str(t.name)
+        l = min(len(d.ENPT), len(d.EOT))
+        self.names = [str(d.ENPT[i].name) for i in range(l)]
+        self.ordinals = array.array('H', [d.EOT[i].ordinal for i in range(l)])
+        self.by_name = {}
+        for i in range(l-1, -1, -1):
+            self.by_name[self.names[i]] = i
+    def search(self, name):
+        # Binary search in the ENPT, as done by the PE loader; the result
+        # is meaningless if the ENPT is not sorted.
+        i = bisect.bisect_left(self.names, name)
+        if i < len(self.names) and self.names[i] == name:
+            return self.base + self.ordinals[i]
+        return None
+    def ordinal(self, name):
+        i = self.by_name.get(name)
+        if i is None: return None
+        return self.base + self.ordinals[i]
+    def get(self, func):
+        # 'func' is a name or an ordinal; returns its RVA, the name of the
+        # forwarded function, or None if not exported
+        if isinstance(func, int):
+            j = func - self.base
+        else:
+            j = self.by_name.get(func)
+            if j is None: return None
+            j = self.ordinals[j]
+        if not 0 <= j < len(self.rvas): return None
+        if j in self.forwarders: return self.forwarders[j]
+        return self.rvas[j]
 
 class DirExport(CArrayDirectory):
     _cls = ExportDescriptor
@@ -1638,10 +1851,24 @@ class DirExport(CArrayDirectory):
         # Finalize
         d.compute_exports()
     def get_funcrva(self, name):
+        # NB: returns the RVA of the name, as in previous versions
         for d in self:
-            for t in d.ENPT:
-                if str(t.name) == name: return t.rva
+            i = d.index.by_name.get(name)
+            if i is not None: return d.ENPT[i].rva
         return None
+    def get_export(self, func):
+        # RVA of the export 'func' (name or ordinal), or name of the
+        # forwarded function, e.g. 'NTDLL.RtlAllocateHeap', or None
+        for d in self:
+            return d.index.get(func)
+        return None
+    def forwarders(self):
+        # Dictionary ordinal -> forwarded function
+        res = {}
+        for d in self:
+            for j, name in d.index.forwarders.items():
+                res[d.base+j] = name
+        return res
     def get_funcvirt(self, name):
         return self.parent.rva2virt(self.get_funcrva(name))
     # For API compatibility with previous versions of elfesteem
@@ -1706,6 +1933,360 @@ class DirReloc(CArrayDirectory):
     reldesc        = property(lambda _:_)
 
 
+# Exception directory (.pdata)
+
+UNW_FLAG_NHANDLER  = 0
+UNW_FLAG_EHANDLER  = 1
+UNW_FLAG_UHANDLER  = 2
+UNW_FLAG_CHAININFO = 4
+
+class RuntimeFunction(CStruct):
+    _fields = [ ("begin","u32"),
+                ("end","u32"),
+                ("unwind","u32") ]
+
+class UnwindCode(CStruct):
+    _fields = [ ("codeoffset","u08"),
+                ("opinfo","u08") ]
+    op   = property(lambda _: _.opinfo & 0xf)
+    info = property(lambda _: _.opinfo >> 4)
+
+class UnwindCodes(CArray):
+    _cls = UnwindCode
+    count = lambda _: _.parent.countofcodes
+
+class UnwindInfo(CStruct):
+    # x64 UNWIND_INFO
+    _fields = [ ("versionflags","u08"),
+                ("sizeofprolog","u08"),
+                ("countofcodes","u08"),
+                ("frame","u08"),
+                ("codes",UnwindCodes) ]
+    version       = property(lambda _: _.versionflags & 0x7)
+    flags         = property(lambda _: _.versionflags >> 3)
+    frameregister = property(lambda _: _.frame & 0xf)
+    frameoffset   = property(lambda _: _.frame >> 4)
+    def unpack(self, c, o):
+        CStruct.unpack(self, c, o)
+        self.handler = None
+        self.chained = None
+        # The array of unwind codes has an even number of elements
+        o += 4 + 2 * ((self.countofcodes + 1) & ~1)
+        if self.flags & UNW_FLAG_CHAININFO:
+            self.chained = RuntimeFunction(parent=self, content=c, start=o)
+        elif self.flags & (UNW_FLAG_EHANDLER|UNW_FLAG_UHANDLER):
+            data = c[o:o+4]
+            if len(data) == 4:
+                self.handler, = struct.unpack('<I', data)
+    def __repr__(self):
+        return '<%s version=%d flags=%#x prolog=%d codes=%d frame=%d/%d>' % (
+            self.__class__.__name__,
+            self.version, self.flags, self.sizeofprolog, self.countofcodes,
+            self.frameregister, self.frameoffset)
+
+class DirException(CBase):
+    # Table of RUNTIME_FUNCTION, sorted by start address, which gives
+    # the boundaries of all non-leaf functions of x64, ARM and ARM64 PE.
+    # There can be hundreds of thousands of entries: they are parsed in
+    # bulk in three parallel arrays begin/end/unwind, instead of one
+    # CStruct per entry, and the unwind information is decoded when
+    # used. This directory is not modified, it is a view of the file.
+    _idx = DIRECTORY_ENTRY_EXCEPTION
+    def _initialize(self):
+        self.begin  = array.array('I')
+        self.end    = array.array('I')
+        self.unwind = array.array('I')
+        self.rva = 0
+        self._size = 0
+        self._order = None
+        self._unwind_info = {}
+    def entsize(self):
+        machine = self.parent.COFFhdr.machine
+        if machine in (IMAGE_FILE_MACHINE_AMD64, IMAGE_FILE_MACHINE_IA64):
+            return 12
+        if machine in (IMAGE_FILE_MACHINE_ARMNT, IMAGE_FILE_MACHINE_ARM64):
+            # The end of the function is in the unwind data
+            return 8
+        return None
+    entsize = property(entsize)
+    def unpack(self, c, o):
+        if self._idx >= len(self.parent.NThdr.optentries): return # No entry
+        d = self.parent.NThdr.optentries[self._idx]
+        if o is None:
+            if d.rva == 0: return # No directory
+            o = self.parent.rva2off(d.rva)
+            if o is None: return # Directory in no section
+        entsize = self.entsize
+        if entsize is None:
+            log.warning('Exception directory for machine %#x not parsed',
+                        self.parent.COFFhdr.machine)
+            return
+        self.rva = d.rva
+        n = max(0, min(d.size, len(c)-o)) // entsize
+        self._size = n*entsize
+        data = array.array('I', c[o:o+self._size])
+        if sys.byteorder == 'big':
+            data.byteswap()
+        if entsize == 12:
+            self.begin  = data[0::3]
+            self.end    = data[1::3]
+            self.unwind = data[2::3]
+        else:
+            self.begin  = data[0::2]
+            self.unwind = data[1::2]
+            self.end    = self.arm_ends()
+        if list(self.begin) != sorted(self.begin):
+            log.warning('Exception directory not sorted')
+            self._order = sorted(range(n), key=self.begin.__getitem__)
+            self._sorted = array.array('I',
+                [self.begin[i] for i in self._order])
+    def arm_ends(self):
+        # The function length is in the unwind data: 'packed' in the
+        # entry if its two lower bits are not null, else in the first
+        # word of the .xdata record. Units are 2 bytes for ARM (Thumb-2)
+        # and 4 bytes for ARM64; for ARM the start address has its low
+        # bit set (Thumb), which is removed.
+        if self.parent.COFFhdr.machine == IMAGE_FILE_MACHINE_ARMNT:
+            unit = 2
+            for i, begin in enumerate(self.begin):
+                self.begin[i] = begin & ~1
+        else:
+            unit = 4
+        end = array.array('I', self.begin)
+        for i, unwind in enumerate(self.unwind):
+            if unwind & 3:
+                end[i] += unit * ((unwind >> 2) & 0x7ff)
+                continue
+            of = self.parent.rva2off(unwind)
+            data = of is not None and self.parent.content[of:of+4]
+            if data and len(data) == 4:
+                end[i] += unit * (struct.unpack('<I', data)[0] & 0x3ffff)
+        return end
+    def __len__(self):
+        return len(self.begin)
+    def __getitem__(self, i):
+        return (self.begin[i], self.end[i], self.unwind[i])
+    def find(self, rva):
+        # Index of the entry of the function containing 'rva', or None
+        if self._order is None:
+            i = bisect.bisect_right(self.begin, rva) - 1
+        else:
+            i = bisect.bisect_right(self._sorted, rva) - 1
+            if i >= 0: i = self._order[i]
+        if i < 0 or rva >= self.end[i]:
+            return None
+        return i
+    def function_at(self, rva):
+        # (begin, end) of the function containing 'rva', or None
+        i = self.find(rva)
+        if i is None:
+            return None
+        return (self.begin[i], self.end[i])
+    def unwind_info(self, i):
+        # UNWIND_INFO of the entry i, decoded when first used; only
+        # the x64 format is decoded, None is returned for the others.
+        if self.entsize != 12:
+            return None
+        rva = self.unwind[i]
+        if rva & 1:
+            # The unwind data is the one of another RUNTIME_FUNCTION
+            of = self.parent.rva2off(rva - 1 + 8)
+            data = of is not None and self.parent.content[of:of+4]
+            if not data or len(data) != 4:
+                return None
+            rva, = struct.unpack('<I', data)
+        if not rva in self._unwind_info:
+            of = self.parent.rva2off(rva)
+            if of is None:
+                info = None
+            else:
+                info = UnwindInfo(parent=self, content=self.parent.content,
+                                  start=of)
+            self._unwind_info[rva] = info
+        return self._unwind_info[rva]
+    def display(self):
+        res = '<%s>' % self.__class__.__name__
+        for i in range(len(self)):
+            res += '\n    begin=%#x end=%#x unwind=%#x' % self[i]
+        return res
+    def __repr__(self):
+        return '<%s RVA=%#x [table of length %d]>' % (
+            self.__class__.__name__, self.rva, len(self))
+
+
+
+# Debug directory
+
+class CodeView(CBase):
+    # CodeView record, which links the PE to its PDB: 'RSDS' (PDB 7.0)
+    # with a GUID and an age, or 'NB10' (PDB 2.0) with a timestamp and
+    # an age, then the path of the PDB.
+    def _initialize(self):
+        self.signature = data_empty
+        self.guid_data = None
+        self.timestamp = None
+        self.age = 0
+        self.path = ''
+        self._size = 0
+    def unpack(self, c, o):
+        data = c[o:o+self.parent.sizeofdata]
+        self._size = len(data)
+        self.signature = data[:4]
+        if self.signature == name_to_bytes('RSDS') and len(data) >= 24:
+            self.guid_data = data[4:20]
+            self.age, = struct.unpack(self.sex+'I', data[20:24])
+            path = data[24:]
+        elif self.signature == name_to_bytes('NB10') and len(data) >= 16:
+            self.timestamp, self.age = struct.unpack(self.sex+'II', data[8:16])
+            path = data[16:]
+        else:
+            log.warning('Unknown CodeView signature %r', self.signature)
+            return
+        if data_null in path:
+            path = path[:path.index(data_null)]
+        self.path = bytes_to_name(path)
+    def guid_fields(self):
+        d1, d2, d3 = struct.unpack(self.sex+'IHH', self.guid_data[:8])
+        d4 = '%02X'*8 % struct.unpack('8B', self.guid_data[8:])
+        return d1, d2, d3, d4
+    def guid(self):
+        if self.guid_data is None:
+            return None
+        d1, d2, d3, d4 = self.guid_fields()
+        return '%08X-%04X-%04X-%s-%s' % (d1, d2, d3, d4[:4], d4[4:])
+    guid = property(guid)
+    def pdb_id(self):
+        # Key of the PDB in a symbol server, e.g. in
+        # https://msdl.microsoft.com/download/symbols/name.pdb/ID/name.pdb
+        if self.guid_data is not None:
+            return '%08X%04X%04X%s%X' % (self.guid_fields() + (self.age,))
+        if self.timestamp is not None:
+            return '%08X%X' % (self.timestamp, self.age)
+        return None
+    pdb_id = property(pdb_id)
+    def __repr__(self):
+        return '<%s %s %s age=%d %r>' % (self.__class__.__name__,
+            bytes_to_name(self.signature), self.guid or self.timestamp,
+            self.age, self.path)
+
+class DebugPOGO(CBase):
+    # Profile guided optimization: signature, then the contributions
+    # to the sections, as (rva, size, name) with names null-terminated
+    # and aligned on 4 bytes.
+    def _initialize(self):
+        self.signature = data_empty
+        self.entries = []
+        self._size = 0
+    def unpack(self, c, o):
+        data = c[o:o+self.parent.sizeofdata]
+        self._size = len(data)
+        self.signature = data[:4]
+        of = 4
+        while of + 8 < len(data):
+            rva, size = struct.unpack(self.sex+'II', data[of:of+8])
+            end = data.find(data_null, of+8)
+            if end == -1: end = len(data)
+            self.entries.append((rva, size, bytes_to_name(data[of+8:end])))
+            of = (end + 4) & ~3
+    def __repr__(self):
+        return '<%s %r [%d entries]>' % (self.__class__.__name__,
+            self.signature, len(self.entries))
+
+class DebugRepro(CBase):
+    # Reproducible build: the timestamps of the PE are a hash; if the
+    # entry has data, it is the size of the hash followed by the hash.
+    def _initialize(self):
+        self.hash = data_empty
+        self._size = 0
+    def unpack(self, c, o):
+        size = self.parent.sizeofdata
+        self._size = size
+        if size >= 4:
+            n, = struct.unpack(self.sex+'I', c[o:o+4])
+            self.hash = c[o+4:o+4+min(n, size-4)]
+    def __repr__(self):
+        return '<%s hash=%s>' % (self.__class__.__name__,
+            '%02x'*len(self.hash) % struct.unpack('%dB'%len(self.hash),
+                                                 self.hash))
+
+class DebugVCFeature(CStruct):
+    # Number of objects compiled with some options
+    _fields = [ ("prevc11","u32"),
+                ("ccpp","u32"),
+                ("gs","u32"),
+                ("sdl","u32"),
+                ("guardn","u32") ]
+
+debug_types = {
+    IMAGE_DEBUG_TYPE_CODEVIEW:   CodeView,
+    IMAGE_DEBUG_TYPE_POGO:       DebugPOGO,
+    IMAGE_DEBUG_TYPE_REPRO:      DebugRepro,
+    IMAGE_DEBUG_TYPE_VC_FEATURE: DebugVCFeature,
+    }
+
+class DebugDirectory(CStruct):
+    _fields = [ ("characteristics","u32"),
+                ("timestamp","u32"),
+                ("majorv","u16"),
+                ("minorv","u16"),
+                ("type","u32"),
+                ("sizeofdata","u32"),
+                ("addressofrawdata","u32"),
+                ("pointertorawdata","u32") ]
+    typename = property(lambda _: constants['IMAGE_DEBUG_TYPE'].get(_.type,
+                                  'UNKNOWN(%d)' % _.type))
+    def offset(self):
+        # File offset of the data, which is not always mapped in memory
+        if self.pointertorawdata:
+            return self.pointertorawdata
+        if self.addressofrawdata:
+            return self.parent.parent.rva2off(self.addressofrawdata)
+        return None
+    def view(self):
+        # The data, without copy
+        view = self.parent.parent.file_view()
+        of = self.offset()
+        if of is None:
+            return view[0:0]
+        return view[of:of+self.sizeofdata]
+    def info(self):
+        # The data decoded, for the types in 'debug_types', else None;
+        # decoded when first used
+        if not hasattr(self, '_info'):
+            self._info = None
+            cls = debug_types.get(self.type)
+            of = self.offset()
+            c = self.parent.parent.content
+            if cls is not None and of is not None \
+                    and of + self.sizeofdata <= len(c):
+                self._info = cls(parent=self, content=c, start=of)
+        return self._info
+    info = property(info)
+
+class DirDebug(CArrayDirectory):
+    # IMAGE_DEBUG_DIRECTORY entries; their data is read only when used
+    _cls = DebugDirectory
+    _idx = DIRECTORY_ENTRY_DEBUG
+    def count(self):
+        if self._idx >= len(self.parent.NThdr.optentries):
+            return 0
+        n = self.parent.NThdr.optentries[self._idx].size // 28
+        return min(n, max(0, len(self.parent.content) - self._off) // 28)
+    def getbytype(self, t):
+        return [d for d in self if d.type == t]
+    def codeview(self):
+        # The CodeView record, used to find the PDB, or None
+        for d in self.getbytype(IMAGE_DEBUG_TYPE_CODEVIEW):
+            if isinstance(d.info, CodeView) and d.info.pdb_id is not None:
+                return d.info
+        return None
+    codeview = property(codeview)
+    def display(self):
+        res = '<%s>' % self.__class__.__name__
+        for d in self:
+            res += '\n    %-10s size=%#x offset=%#x %r' % (d.typename,
+                d.sizeofdata, d.pointertorawdata, d.info)
+        return res
 
 class UStringData(CBase):
     def _initialize(self):
@@ -1731,8 +2312,25 @@ class ResourceDataDescription(CStruct):
         if of is None:
             log.error("Invalid ResourceDataDescription with RVA %#x", self.rva)
             raise ValueError
-        else:
-            self.data = c[of:of+self.size]
+        # The data is not copied: it is read from the content when needed
+        self._data = (c, of)
+    def data(self):
+        if isinstance(self._data, tuple):
+            c, of = self._data
+            return c[of:of+self.size]
+        return self._data
+    def set_data(self, value):
+        self._data = value
+    data = property(data, set_data)
+    def view(self):
+        # View of the data, without copy; it can be shorter than 'size'
+        # if the file is truncated
+        if not isinstance(self._data, tuple):
+            return buffer_view(self._data)
+        c, of = self._data
+        if isinstance(c, StrPatchwork):
+            return c.view()[of:of+self.size]
+        return buffer_view(c, of, of+self.size)
     def __repr__(self):
         return '<%s RVA=%#x size=%d codepage=%d zero=%d>' % (
             self.__class__.__name__,
@@ -1765,11 +2363,26 @@ class ResourceDirectoryEntry(CStruct):
             # resourceloop.exe
             log.warning('Resource tree too deep')
         elif self.offset & 0x80000000:
-            self.dir = ResourceDescriptor(parent=self, content=c,
-                start=self.base + (self.offset & 0x7FFFFFFF))
+            # The subdirectory is parsed when used
+            self._dir = c
         else:
             self.data = ResourceDataDescription(parent=self, content=c,
                 start=self.base + (self.offset & 0x7FFFFFFF))
+    def dir(self):
+        if not hasattr(self, '_dir'):
+            raise AttributeError('dir')
+        if not isinstance(self._dir, ResourceDescriptor):
+            self._dir = ResourceDescriptor(parent=self, content=self._dir,
+                start=self.base + (self.offset & 0x7FFFFFFF))
+        return self._dir
+    def set_dir(self, value):
+        self._dir = value
+    dir = property(dir, set_dir)
+    def key(self):
+        # Name or id of the entry, as used by DirRes.get
+        if self.id & 0x80000000: return str(self.name)
+        else:                    return self.id
+    key = property(key)
     def depth(self):
         p = self.parent.parent.parent
         if isinstance(p, DirRes): return 0
@@ -1807,10 +2420,19 @@ class ResourceDescriptor(CStruct):
                 ("entries",ResourceDirectoryEntries) ]
     base = property(lambda _:_.parent.base)
     def show_tree(self):
-        tree = []
-        for e in self.entries:
-            tree.extend(e.show_tree())
-        return tree
+        # The tree is computed once
+        if not hasattr(self, '_tree'):
+            self._tree = []
+            for e in self.entries:
+                self._tree.extend(e.show_tree())
+        return self._tree
+    def get(self, key):
+        # Entry with this name or id, or None
+        if not hasattr(self, '_keys'):
+            self._keys = {}
+            for e in reversed(self.entries._array):
+                self._keys[e.key] = e
+        return self._keys.get(key)
 
 class DirRes(CArrayDirectory):
     _cls = ResourceDescriptor
@@ -1820,6 +2442,39 @@ class DirRes(CArrayDirectory):
         _.parent.rva2off(_.parent.NThdr.optentries[_._idx].rva))
     def rva2off(self, rva):
         return self.parent.rva2off(rva)
+    def get(self, *path):
+        # Resource at 'path', made of names or ids of entries, e.g.
+        # get(RT_MANIFEST, 1, 1033); only the directories in the path are
+        # parsed. Returns a ResourceDataDescription, a ResourceDescriptor
+        # if the path is incomplete, or None if not found.
+        if len(self) == 0: return None
+        d = self[0]
+        for key in path:
+            if not isinstance(d, ResourceDescriptor): return None
+            e = d.get(key)
+            if e is None: return None
+            if   hasattr(e, '_dir'): d = e.dir
+            elif hasattr(e, 'data'): d = e.data
+            else:                    return None
+        return d
+    def resources(self, type=None, name=None, lang=None):
+        # Generator of (type, name, lang, ResourceDataDescription) for a
+        # depth 3 tree, where None means any value; only the needed
+        # directories are parsed.
+        def level(d, key):
+            if not isinstance(d, ResourceDescriptor):
+                return []
+            if key is None:
+                return d.entries
+            e = d.get(key)
+            if e is None: return []
+            return [e]
+        if len(self) == 0: return
+        for t in level(self[0], type):
+            for n in level(getattr(t, 'dir', None), name):
+                for l in level(getattr(n, 'dir', None), lang):
+                    if hasattr(l, 'data'):
+                        yield t.key, n.key, l.key, l.data
     def is_depth_3_tree(self):
         if len(self) == 0: return False
         for d, (x, y, z) in self[0].show_tree():
@@ -1977,13 +2632,82 @@ class CoffSymbols(CArray):
         if o is None:
             o = self.parent.COFFhdr.pointertosymboltable
         CArray.unpack(self, c, o)
-    def getbyindex(self, n):
-        # An aux symbol counts, too
-        for s in self._array:
-            if n == 0: return s
-            n -= 1 + len(s.aux)
-        else:
+    # Index of raw symbol table entries: _slots maps each entry, aux
+    # entries included, to the position of its symbol in _array, and
+    # _first maps each position to the entry of the symbol itself.
+    # It is built once, then extended by append(); it is rebuilt only
+    # if _array has been modified by other means.
+    _slots = None
+    def _index(self):
+        if self._slots is None or len(self._first) != len(self._array):
+            self._slots = array.array('I')
+            self._first = array.array('I')
+            for pos in range(len(self._array)):
+                self._index_add(pos)
+        return self._slots
+    def _index_add(self, pos):
+        self._first.append(len(self._slots))
+        self._slots.extend([pos]*(1+len(self._array[pos].aux)))
+        self._names = None
+        self._addresses = None
+    def append(self, obj):
+        obj = CArray.append(self, obj)
+        if self._slots is not None and len(self._first)+1 == len(self._array):
+            self._index_add(len(self._array)-1)
+        return obj
+    def getbyindex(self, n, aux=False):
+        # An aux symbol counts, too; for an aux entry, the symbol owning
+        # it is returned only if 'aux' is True
+        slots = self._index()
+        if not 0 <= n < len(slots):
+            return None
+        pos = slots[n]
+        if not aux and self._first[pos] != n:
+            return None
+        return self._array[pos]
+    def indexof(self, s):
+        # Raw index of the symbol at position 's' or of the symbol 's'
+        self._index()
+        if not isinstance(s, int):
+            s = self._array.index(s)
+        return self._first[s]
+    _names = None
+    def getbyname(self, name):
+        # List of the symbols with this name, in the order of the table
+        self._index()
+        if self._names is None:
+            self._names = {}
+            for s in self._array:
+                self._names.setdefault(s.name, []).append(s)
+        return self._names.get(name, [])
+    _addresses = None
+    def getbyaddress(self, sectionnumber, value):
+        # Symbol of the section 'sectionnumber' with the greatest value
+        # lower than or equal to 'value', for symbolization of objects.
+        # Section definitions (static symbols with an aux entry) are
+        # not used, they would hide the symbols they contain.
+        self._index()
+        if self._addresses is None:
+            self._addresses = {}
+            for pos, s in enumerate(self._array):
+                if s.sectionnumber == 0 or s.sectionnumber >= 0xfffe:
+                    continue
+                if s.storageclass == IMAGE_SYM_CLASS_STATIC and len(s.aux):
+                    continue
+                self._addresses.setdefault(s.sectionnumber, []).append(
+                    (s.value, pos))
+            for k, v in self._addresses.items():
+                v.sort()
+                self._addresses[k] = ([_[0] for _ in v],
+                                      [self._array[_[1]] for _ in v])
+        if not sectionnumber in self._addresses:
+            return None
+        values, symbols = self._addresses[sectionnumber]
+        i = bisect.bisect_right(values, value)
+        if i == 0:
             return None
+        # Among symbols with the same value, the first in the table
+        return symbols[bisect.bisect_left(values, values[i-1])]
     def display(self):
         res = '<%s>' % self.__class__.__name__
         for s in self.symbols:
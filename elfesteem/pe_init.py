@@ -1,8 +1,8 @@
 #! /usr/bin/env python
 
-import struct, array
+import struct, array, os, re, heapq
 from elfesteem import pe
-from elfesteem.strpatchwork import StrPatchwork
+from elfesteem.strpatchwork import StrPatchwork, to_bytes, buffer_view
 log = pe.log
 
 import sys
@@ -12,6 +12,94 @@ if sys.version_info[0:2] == (2, 3):
 else:
     mask32 = eval("0xffffffff") # 'eval' avoids warnings with python2.3
 
+try:
+    import hashlib
+except ImportError:
+    # Python older than 2.5: the digests of the file are not available
+    hashlib = None
+
+try:
+    import numpy
+except ImportError:
+    # The checksum of large files is computed without numpy, slower
+    numpy = None
+
+try:
+    import concurrent.futures
+except ImportError:
+    # Python 2 without the 'futures' backport: sections are hashed
+    # sequentially.
+    concurrent = None
+
+# Sum of the words of data[start:stop], where 'data' can be bytes or
+# an array of bytes (e.g. the content of a StrPatchwork), not copied.
+# 'fmt' is 'H' or 'I', native byte order as in previous versions.
+def word_sum(data, start, stop, fmt='I'):
+    if numpy is not None and stop - start >= 0x10000:
+        dtype = {'H': numpy.uint16, 'I': numpy.uint32}[fmt]
+        count = (stop - start) // struct.calcsize(fmt)
+        return int(numpy.frombuffer(data, dtype=dtype, count=count,
+                   offset=start).sum(dtype=numpy.uint64))
+    if sys.version_info >= (3, 3):
+        # memoryview.cast exists since python 3.3; memoryview does not
+        # exist before python 2.7
+        return sum(memoryview(data)[start:stop].cast(fmt))
+    data = data[start:stop]
+    if isinstance(data, array.array): data = data.tostring()
+    return sum(array.array(fmt, data))
+
+# Difference of the sum of the 16-bit words of a file, when the bytes
+# 'old' at offset 'off' are replaced by 'new', of the same length.
+def word_delta(off, old, new):
+    pad = off%2 * pe.data_null
+    old = pad + old + (len(pad+old)%2) * pe.data_null
+    new = pad + new + (len(pad+new)%2) * pe.data_null
+    return word_sum(new, 0, len(new), 'H') - word_sum(old, 0, len(old), 'H')
+
+# List of (offset, data) of the ranges where 'new' differs from 'old',
+# of the same length, at offset 'off' in the file; they are compared by
+# blocks, without copy if they are memoryviews.
+def diff_ranges(old, new, off, block=0x1000):
+    ranges = []
+    l = len(new)
+    for i in range(0, l, block):
+        j = min(i+block, l)
+        if old[i:j] == new[i:j]:
+            continue
+        if ranges and ranges[-1][1] == i:
+            ranges[-1][1] = j
+        else:
+            ranges.append([i, j])
+    res = []
+    for i, j in ranges:
+        while old[i] == new[i]: i += 1
+        while old[j-1] == new[j-1]: j -= 1
+        res.append((off+i, to_bytes(new[i:j])))
+    return res
+
+def fold_checksum(s):
+    while s>mask32:
+        s = (s>>32)+(s&mask32)
+    while s>0xFFFF:
+        s = (s&0xFFFF)+((s>>16)&0xFFFF)
+    return s
+
+def checksum(data, olds):
+    # PE checksum of 'data', where the checksum field contains 'olds'
+    l = len(data)
+    s = 0
+    start, stop = 0, l - l%2
+    if stop%4:
+        s += word_sum(data, 0, 2, 'H')
+        start = 2
+    s += word_sum(data, start, stop)
+    s = fold_checksum(s-olds)
+    if l%2:
+        end = data[l-1]
+        if not isinstance(end, int): end = ord(end)
+        s += end
+    return s+l
+
 
 class ContentRVA(object):
     def __init__(self, x):
@@ -93,15 +181,100 @@ class ContentRVA(object):
             data_slice = data.__getitem__(i)
             s.section_data.__setitem__(n_item, data_slice)
             off = i.stop
-            #XXX test patch content
+            # The file content is updated when it is next used
             file_off = self.parent.rva2off(s.vaddr+n_item.start)
-            if self.parent.content:
-                self.parent.content = self.parent.content[:file_off]+ data_slice + self.parent.content[file_off+len(data_slice):]
+            self.parent.journal_write(file_off, data_slice)
     def set(self, rva, data):
         # API used by miasm2
         self[rva] = data
 
 
+def merge_sorted(iterators):
+    # Generator of the values of sorted iterators, sorted; the same as
+    # heapq.merge, which does not exist before python 2.6
+    heap = []
+    for i, it in enumerate(iterators):
+        for value in it:
+            heap.append((value, i, it))
+            break
+    heapq.heapify(heap)
+    while heap:
+        value, i, it = heap[0]
+        yield value
+        for value in it:
+            heapq.heapreplace(heap, (value, i, it))
+            break
+        else:
+            heapq.heappop(heap)
+
+class MultiPattern(object):
+    # Search of many byte strings at once. The patterns are merged in a
+    # trie, written as a single regular expression that finds, at each
+    # position, the longest pattern; the other patterns found at this
+    # position are the prefixes of this one, computed in advance.
+    # 'patterns' is a list, or a dict, of byte strings; the matches are
+    # reported with the index (or the key) of the pattern.
+    def __init__(self, patterns):
+        if hasattr(patterns, 'items'):
+            items = list(patterns.items())
+        else:
+            items = list(enumerate(patterns))
+        self.keys = {}
+        for key, p in items:
+            if sys.version_info[0] >= 3 and type(p) == str:
+                p = p.encode(encoding="latin1")
+            if len(p) == 0:
+                raise ValueError("Empty pattern")
+            self.keys.setdefault(p, []).append(key)
+        self.maxlen = max([len(p) for p in self.keys] + [0])
+        # All patterns found when 'p' is the longest one, shortest first,
+        # as (length, key)
+        self.prefixes = {}
+        for p in self.keys:
+            keys = []
+            for i in range(1, len(p)+1):
+                keys.extend([(i, key) for key in self.keys.get(p[:i], ())])
+            self.prefixes[p] = keys
+        trie = {}
+        for p in self.keys:
+            node = trie
+            for i in range(len(p)):
+                node = node.setdefault(p[i:i+1], {})
+            node[pe.data_empty] = None
+        regex = self.trie_regex(trie)
+        if not regex:
+            # No pattern: never matches
+            regex = pe.name_to_bytes('(?!)')
+        self.regex = re.compile(pe.name_to_bytes('(?=(') + regex
+                                + pe.name_to_bytes('))'), re.DOTALL)
+    def trie_regex(self, node):
+        alt = []
+        for c in sorted(node):
+            if c == pe.data_empty:
+                continue
+            child = node[c]
+            lit = re.escape(c)
+            # A chain of nodes with one child is a literal string
+            while len(child) == 1 and not pe.data_empty in child:
+                c, child = list(child.items())[0]
+                lit += re.escape(c)
+            alt.append(lit + self.trie_regex(child))
+        if not alt:
+            return pe.data_empty
+        res = pe.name_to_bytes('|').join(alt)
+        if pe.data_empty in node:
+            return pe.name_to_bytes('(?:') + res + pe.name_to_bytes(')?')
+        if len(alt) > 1:
+            return pe.name_to_bytes('(?:') + res + pe.name_to_bytes(')')
+        return res
+    def search(self, data, pos=0):
+        # Generator of (offset, length, key) of all matches in 'data',
+        # which can be a memoryview, by increasing offset.
+        for m in self.regex.finditer(data, pos):
+            offset = m.start()
+            for length, key in self.prefixes[m.group(1)]:
+                yield offset, length, key
+
 class ContentVirtual(object):
     def __init__(self, x):
         self.parent = x
@@ -199,12 +372,64 @@ class ContentVirtual(object):
             if end == None:
                 ret = s.section_data.rfind(pattern, off)
             else:
-                ret = s.data.rfind(pattern, off, end-s.vaddr)
+                ret = s.section_data.rfind(pattern, off, end-s.vaddr)
             if ret == -1:
                 continue
             return self.parent.rva2virt(s.vaddr + ret)
         return -1
 
+    def finditer(self, patterns, start = 0, end = None, span = False):
+        # Generator of (address, key) for all occurrences of 'patterns'
+        # (a list, a dict or a MultiPattern) starting in [start, end),
+        # by increasing address; 'key' is the index (or the key) of the
+        # pattern. The data of each section is scanned once, for all
+        # patterns. With 'span', a pattern can start at the end of the
+        # data of a section and continue in the next section, if there
+        # is no gap between them.
+        if not isinstance(patterns, MultiPattern):
+            patterns = MultiPattern(patterns)
+        if start != 0:
+            start = self.parent.virt2rva(start)
+        if end != None:
+            end = self.parent.virt2rva(end)
+        sections = [ s for s in self.parent.SHList
+                     if len(s.section_data.data) > 0 ]
+        sections = sorted(sections, key=lambda _:_.vaddr)
+        matches = []
+        for i, s in enumerate(sections):
+            data = self.parent.file_view(s.section_data.data)
+            if s.vaddr + len(data) <= start:
+                continue
+            if end != None and s.vaddr >= end:
+                break
+            matches.append(self._finditer_data(patterns, s.vaddr,
+                data, max(0, start - s.vaddr)))
+            if span and i+1 < len(sections) \
+                    and sections[i+1].vaddr == s.vaddr + len(data):
+                matches.append(self._finditer_span(patterns, s.vaddr,
+                    data, sections[i+1].section_data.data, start))
+        for rva, length, key in merge_sorted(matches):
+            if end != None and rva >= end:
+                break
+            yield self.parent.rva2virt(rva), key
+
+    def _finditer_data(self, patterns, rva, data, pos):
+        for offset, length, key in patterns.search(data, pos):
+            yield rva + offset, length, key
+
+    def _finditer_span(self, patterns, rva, data, next_data, start):
+        # Matches that start in 'data' and end in 'next_data'
+        pos = max(0, len(data) - patterns.maxlen + 1)
+        tail = len(data) - pos
+        window = pe.data_empty.join([to_bytes(data[pos:]),
+                                     next_data[:patterns.maxlen-1]])
+        rva += pos
+        for offset, length, key in patterns.search(window):
+            if offset >= tail:
+                break
+            if offset + length > tail and rva + offset >= start:
+                yield rva + offset, length, key
+
     def is_addr_in(self, ad):
         return self.parent.is_in_virt_address(ad)
 
@@ -222,45 +447,100 @@ class ContentVirtual(object):
         return data_out
 
 class StrTable(object):
+    # COFF string table. The table is kept as is: names are read when
+    # needed, at any offset (including in the middle of a string, which
+    # is used by linkers to share the end of names), and the index of
+    # the names is built in a single pass only for lookups by name.
     def __init__(self, c):
-        self.res = {}
-        self.names = {}
-        self.trail = pe.data_empty
-        self.len = 0
-        while c:
-            p = c.find(pe.data_null)
-            if p < 0:
-                self.trail = c
-                break
-            self.res[self.len] = c[:p]
-            self.names[c[:p]] = self.len
-            self.len += p+1
-            c = c[p+1:]
+        p = c.rfind(pe.data_null) + 1
+        self.data = c[:p]
+        self.trail = c[p:]
+        self.len = p
+        self.added = []
+        self._names = None
+    def _data(self):
+        # The names that have been added are appended to the table
+        if self.added:
+            self.data = self.data + pe.data_empty.join(self.added)
+            self.added = []
+        return self.data
+    def _offsets(self):
+        # Generator of (offset, name) for all names of the table
+        data = self._data()
+        p = 0
+        while p < len(data):
+            e = data.find(pe.data_null, p)
+            yield p, data[p:e]
+            p = e+1
+    def names(self):
+        if self._names is None:
+            self._names = {}
+            for of, name in self._offsets():
+                self._names[name] = of
+        return self._names
+    names = property(names)
+    def res(self):
+        return dict(self._offsets())
+    res = property(res)
     def __str__(self):
         raise AttributeError("Use pack() instead of str()")
     def pack(self):
-        res = pe.data_empty
-        k = sorted(self.res.keys())
-        for s in k:
-            if len(res) != s:
-                raise ValueError("StrTable is incoherent : %r != %r"%(len(res),s))
-            res += self.res[s] + pe.data_null
-        return res + self.trail
+        return self._data() + self.trail
     def add(self, name):
-        if name in self.names:
-            return self.names[name]
-        self.res[self.len] = name
-        self.names[name] = self.len
+        # 'name' can be a list of names, to add many names at once;
+        # returns the offset(s)
+        if isinstance(name, (list, tuple)):
+            return [self.add(_) for _ in name]
+        names = self.names
+        if name in names:
+            return names[name]
+        names[name] = self.len
+        self.added.append(name + pe.data_null)
         self.len += len(name)+1
+        return names[name]
     def rem(self, name):
         TODO
     def getby_name(self, name):
         return self.names[name]
     def getby_offset(self, of):
-        return self.res.get(of, "")
+        if not 0 <= of < self.len:
+            return ""
+        data = self._data()
+        return data[of:data.find(pe.data_null, of)]
 
 # PE object
 
+def lazy_directory(name):
+    # Property 'name' of a PE object, parsed when first read; the
+    # function that parses it is stored in self._pending[name] when
+    # the file is loaded. The property is absent (AttributeError) if
+    # it is neither parsed nor pending.
+    attr = '_lazy_' + name
+    def get(self):
+        try:
+            return self.__dict__[attr]
+        except KeyError:
+            pass
+        pending = self.__dict__.get('_pending', {})
+        parse = pending.pop(name, None)
+        if parse is None:
+            raise AttributeError(name)
+        try:
+            self.__dict__[attr] = parse()
+        except:
+            # Still pending: the next access raises the same error,
+            # instead of AttributeError
+            pending[name] = parse
+            raise
+        return self.__dict__[attr]
+    def set(self, value):
+        self.__dict__.get('_pending', {}).pop(name, None)
+        self.__dict__[attr] = value
+    def delete(self):
+        if self.__dict__.get('_pending', {}).pop(name, None) is None:
+            del self.__dict__[attr]
+    return property(get, set, delete)
+
 class PE(object):
     # API shared by all/most binary containers
     architecture = property(lambda _:pe.constants['IMAGE_FILE_MACHINE'].get(_.COFFhdr.machine,'UNKNOWN(%d)'%_.COFFhdr.machine))
@@ -271,6 +551,55 @@ class PE(object):
 
     Coffhdr = property(lambda self: self.COFFhdr) # Older API
     Doshdr  = property(lambda self: self.DOShdr) # Older API
+
+    # Directories and symbols are parsed when first used: for many
+    # applications, most of them are never used.
+    DirImport     = lazy_directory('DirImport')
+    DirExport     = lazy_directory('DirExport')
+    DirDelay      = lazy_directory('DirDelay')
+    DirReloc      = lazy_directory('DirReloc')
+    DirRes        = lazy_directory('DirRes')
+    DirException  = lazy_directory('DirException')
+    DirDebug      = lazy_directory('DirDebug')
+    Symbols       = lazy_directory('Symbols')
+    SymbolStrings = lazy_directory('SymbolStrings')
+    # Writes by RVA or virtual address are done in the section data,
+    # and recorded in a journal of (offset, data) that is applied to
+    # the file content when it is used, in one pass; the content is
+    # modified in place, it is not copied for each write nor for each
+    # time the journal is applied.
+    _journal = ()
+    def content(self):
+        self.apply_journal()
+        return self._content
+    def set_content(self, content):
+        self._content = content
+        self._journal = []
+    content = property(content, set_content)
+    def journal_write(self, off, data):
+        if len(self._content):
+            self._journal.append((off, data))
+    def apply_journal(self):
+        if not self._journal:
+            return
+        content = self._content
+        if not isinstance(content, StrPatchwork):
+            content = StrPatchwork(content)
+        for off, data in self._journal:
+            content[off] = data
+        self.content = content
+    def parse_pending(self):
+        # Parses all directories that have not been parsed yet; this is
+        # needed before any modification of the sections, because the
+        # directories have to be parsed with the sections of the file.
+        for name in ('DirImport', 'DirExport', 'DirDelay', 'DirReloc',
+                     'DirRes', 'DirException', 'DirDebug', 'Symbols',
+                     'SymbolStrings'):
+            if name in self.__dict__.get('_pending', {}):
+                getattr(self, name)
+    def is_parsed(self, name):
+        # True if the directory or symbol table 'name' is parsed
+        return '_lazy_' + name in self.__dict__
     def __init__(self, pestr = None,
                  parse_resources = True,
                  parse_delay = True,
@@ -293,6 +622,8 @@ class PE(object):
             self.DirDelay = pe.DirDelay(parent=self)
             self.DirReloc = pe.DirReloc(parent=self)
             self.DirRes = pe.DirRes(parent=self)
+            self.DirException = pe.DirException(parent=self)
+            self.DirDebug = pe.DirDebug(parent=self)
 
             self.DOShdr.magic = 0x5a4d
             self.DOShdr.lfanew = 0xe0
@@ -397,28 +728,87 @@ class PE(object):
         self.SHList = pe.SHList(parent=self, content=self.content, start=of,
             wsize=32)
 
-        # Directory parsing.
+        # Directory parsing, delayed until the directory is used.
         # 'start' is None, because the offset is computed from the RVA
-        # in the NT header
-        kargs = { 'parent':self, 'content':self.content, 'start':None }
-        self.DirImport = pe.DirImport(**kargs)
-        self.DirExport = pe.DirExport(**kargs)
-        if parse_delay:     self.DirDelay = pe.DirDelay(**kargs)
-        if parse_reloc:     self.DirReloc = pe.DirReloc(**kargs)
-        if parse_resources: self.DirRes   = pe.DirRes  (**kargs)
+        # in the NT header. The directories not yet parsed use the
+        # original content, shared without copy, because the content
+        # is modified in place when writes are applied.
+        kargs = { 'parent':self, 'content':self._content.share(),
+                  'start':None }
+        self._pending = {}
+        def pending(name, cls):
+            self._pending[name] = lambda: cls(**kargs)
+        pending('DirImport', pe.DirImport)
+        pending('DirExport', pe.DirExport)
+        if parse_delay:     pending('DirDelay', pe.DirDelay)
+        if parse_reloc:     pending('DirReloc', pe.DirReloc)
+        if parse_resources: pending('DirRes',   pe.DirRes)
+        pending('DirException', pe.DirException)
+        pending('DirDebug', pe.DirDebug)
 
         if self.COFFhdr.pointertosymboltable != 0:
             if self.COFFhdr.pointertosymboltable + 18 * self.COFFhdr.numberofsymbols > len(self.content):
                 log.warning('Too many symbols: %d', self.COFFhdr.numberofsymbols)
-            self.Symbols = pe.CoffSymbols(**kargs)
-        if hasattr(self, 'Symbols'):
-            of = self.COFFhdr.pointertosymboltable + self.Symbols.bytelen
-            sz, = struct.unpack(self.sex+'I',self.content[of:of+4])
-            if len(self.content) < of+sz:
-                log.warning('File too short for StrTable %#x != %#x' % (
-                    len(self.content)-of, sz))
-                sz = len(self.content) - of
-            self.SymbolStrings = StrTable(self.content[of:of+sz])
+            pending('Symbols', pe.CoffSymbols)
+            self._pending['SymbolStrings'] = self.parse_strings
+        self.locate_overlay()
+        # The file, as parsed, for save_inplace()
+        self._file = self._content.pack()
+        self._layout = self.file_layout()
+
+    # The overlay is the data after the sections and the symbol table,
+    # e.g. the payload of an installer; it usually contains the
+    # certificate table (Authenticode signatures), which is not mapped
+    # in memory and whose "RVA" is a file offset. Both are located
+    # when the file is parsed, as ranges of the original content.
+    _overlay = None
+    _certificates = None
+    def data_end(self, c):
+        # End of the headers, sections and symbol table in the content 'c'
+        end = max(self.NThdr.sizeofheaders, self.DOShdr.lfanew
+                  + self.NTsig.bytelen + self.COFFhdr.bytelen
+                  + self.COFFhdr.sizeofoptionalheader + self.SHList.bytelen)
+        for s in self.SHList:
+            if s.rawsize:
+                end = max(end, s.scnptr+s.rawsize)
+        if self.COFFhdr.pointertosymboltable:
+            of = self.COFFhdr.pointertosymboltable \
+               + 18 * self.COFFhdr.numberofsymbols
+            if of + 4 <= len(c):
+                sz, = struct.unpack(self.sex+'I', c[of:of+4])
+                of += max(sz, 4)
+            end = max(end, of)
+        return end
+    def locate_overlay(self):
+        c = self.content
+        end = self.data_end(c)
+        if end < len(c):
+            self._overlay = (end, len(c))
+        if self.NThdr.numberofrvaandsizes > pe.DIRECTORY_ENTRY_SECURITY:
+            d = self.NThdr.optentries[pe.DIRECTORY_ENTRY_SECURITY]
+            if d.rva and d.size and d.rva < len(c):
+                self._certificates = (d.rva, min(d.rva+d.size, len(c)))
+    def view_range(self, r):
+        # The original content does not need to have the journal applied:
+        # the journal only modifies the sections.
+        view = self.file_view(self._content)
+        if r is None:
+            return view[0:0]
+        return view[r[0]:r[1]]
+    overlay_offset = property(lambda _: (_._overlay or (None,))[0])
+    overlay = property(lambda _: _.view_range(_._overlay))
+    certificates_offset = property(lambda _: (_._certificates or (None,))[0])
+    certificates = property(lambda _: _.view_range(_._certificates))
+
+    def parse_strings(self):
+        # The string table is after the symbol table
+        of = self.COFFhdr.pointertosymboltable + self.Symbols.bytelen
+        sz, = struct.unpack(self.sex+'I',self.content[of:of+4])
+        if len(self.content) < of+sz:
+            log.warning('File too short for StrTable %#x != %#x' % (
+                len(self.content)-of, sz))
+            sz = len(self.content) - of
+        return StrTable(self.content[of:of+sz])
 
     def resize(self, old, new):
         pass
@@ -430,19 +820,13 @@ class PE(object):
     def getsectionbyrva(self, rva, section = None):
         if section:
             return self.getsectionbyname(section)
-        for s in self.SHList.shlist:
-            if s.vaddr <= rva < s.vaddr+s.size:
-                return s
-        return None
+        return self.SHList.getsectionbyrva(rva)
 
     def getsectionbyvad(self, vad, section = None):
         return self.getsectionbyrva(self.virt2rva(vad), section)
 
     def getsectionbyoff(self, off):
-        for s in self.SHList.shlist:
-            if s.scnptr <= off < s.scnptr+s.rsize:
-                return s
-        return None
+        return self.SHList.getsectionbyoff(off)
 
     def getsectionbyname(self, name):
         for s in self.SHList:
@@ -493,38 +877,135 @@ class PE(object):
     def is_in_virt_address(self, ad):
         if hasattr(self, 'NThdr') and ad < self.NThdr.ImageBase:
             return False
-        ad = self.virt2rva(ad)
-        for s in self.SHList.shlist:
-            if s.vaddr <= ad < s.vaddr + s.size:
-                return True
-        return False
+        return self.getsectionbyrva(self.virt2rva(ad)) is not None
 
     drva = property(lambda _: _._rva) # Deprecated
     rva = property(lambda _: _._rva)
     virt = property(lambda _: _._virt)
 
     def patch_crc(self, c, olds):
-        s = 0
-        data = c[:]
-        l = len(data)
-        if len(c)%2:
-            end = struct.unpack('B', data[-1:])[0]
-            data = data[:-1]
-        if (len(c)&~0x1)%4:
-            s+=struct.unpack('H', data[:2])[0]
-            data = data[2:]
-        data = array.array('I', data)
-        for y in data:
-            s += y
-        s-=olds
-        while s>mask32:
-            s = (s>>32)+(s&mask32)
-        while s>0xFFFF:
-            s = (s&0xFFFF)+((s>>16)&0xFFFF)
-        if len(c)%2:
-            s+=end
-        s+=l
-        return s
+        return checksum(c, olds)
+
+    def checksum_offset(self):
+        return self.DOShdr.lfanew + self.NTsig.bytelen \
+             + self.COFFhdr.bytelen + 64
+
+    def verify_checksum(self):
+        # True if NThdr.CheckSum is the checksum of the current content
+        # of the file, where the checksum field is ignored
+        off = self.checksum_offset()
+        olds, = struct.unpack('I', self.content[off:off+4])
+        return checksum(self.file_view(), olds) == self.NThdr.CheckSum
+
+    def update_checksum(self, off, old, new):
+        # Updates NThdr.CheckSum after the bytes at 'off' in the file have
+        # been replaced: 'old' and 'new' have the same length. Only the
+        # length and the last byte of the file are read (this applies the
+        # write journal, but the file is not summed); the checksum field
+        # and the last byte of a file of odd length cannot be in the
+        # patched range.
+        if len(old) != len(new):
+            raise ValueError("Patch of %d bytes replaced by %d bytes"
+                             % (len(old), len(new)))
+        # Checksum = fold(sum of the 16-bit words, except the checksum
+        # field) + length [+ last byte], and 0x10000 == 1 after folding,
+        # therefore only the 16-bit words of the patch are needed.
+        delta = word_delta(off, old, new)
+        l = len(self.content)
+        s = self.NThdr.CheckSum - l
+        if l%2:
+            s -= struct.unpack('B', self.content[l-1:l])[0]
+        if s <= 0:
+            # Not a valid checksum, it is not updated
+            return
+        s = (s - 1 + delta) % 0xFFFF + 1
+        if l%2:
+            s += struct.unpack('B', self.content[l-1:l])[0]
+        self.NThdr.CheckSum = s + l
+
+    def file_view(self, data=None):
+        # Slices of the view do not copy the data
+        if data is None:
+            data = self.content
+        if isinstance(data, StrPatchwork):
+            return data.view()
+        return buffer_view(data)
+
+    def authenticode_ranges(self):
+        # Ranges [start, stop) of the file that are hashed by Authenticode,
+        # in canonical order: headers without the checksum and the entry
+        # of the security directory, sections by file offset, then the
+        # data after the sections, without the certificate table.
+        end = self.checksum_offset()
+        res = [(0, end)]
+        start = end + 4
+        cert_size = 0
+        if self.NThdr.numberofrvaandsizes > pe.DIRECTORY_ENTRY_SECURITY:
+            cert_size = self.NThdr.optentries[pe.DIRECTORY_ENTRY_SECURITY].size
+            end = self.DOShdr.lfanew + self.NTsig.bytelen \
+                + self.COFFhdr.bytelen + self.Opthdr.bytelen \
+                + self.NThdr.bytelen - self.NThdr.optentries.bytelen \
+                + 8 * pe.DIRECTORY_ENTRY_SECURITY
+            res.append((start, end))
+            start = end + 8
+        res.append((start, self.NThdr.sizeofheaders))
+        hashed = self.NThdr.sizeofheaders
+        for s in sorted(self.SHList, key=lambda _:_.scnptr):
+            if s.rawsize == 0:
+                continue
+            res.append((s.scnptr, s.scnptr+s.rawsize))
+            hashed += s.rawsize
+        l = len(self.content)
+        if l > hashed + cert_size:
+            res.append((hashed, l - cert_size))
+        return res
+
+    def authenticode_digest(self, algorithm='sha256'):
+        # Authenticode hash of the current content of the file
+        h = hashlib.new(algorithm)
+        view = self.file_view()
+        for start, stop in self.authenticode_ranges():
+            h.update(view[start:stop])
+        return h.hexdigest()
+
+    def section_digests(self, algorithm='sha256', jobs=None):
+        # List of (name, hash of the data) for each section; hashlib
+        # releases the GIL for large data, therefore sections are hashed
+        # in parallel threads.
+        def digest(s):
+            h = hashlib.new(algorithm)
+            h.update(self.file_view(s.section_data.data)[:s.rawsize])
+            return h.hexdigest()
+        if concurrent is None or jobs == 1:
+            digests = [digest(s) for s in self.SHList]
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs or len(self.SHList) or 1)
+            try:
+                digests = list(executor.map(digest, self.SHList))
+            finally:
+                executor.shutdown()
+        return [(s.name.strip('\0'), d) for s, d in zip(self.SHList, digests)]
+
+    def imphash(self):
+        # Hash of the list of imported functions, computed as 'imphash'
+        # by pefile, except that functions imported by ordinal are always
+        # named 'ord<number>'.
+        res = []
+        for d in getattr(self, 'DirImport', ()):
+            dll = str(d.name).lower()
+            if dll.rsplit('.', 1)[-1] in ('dll', 'ocx', 'sys'):
+                dll = dll.rsplit('.', 1)[0]
+            thunks = getattr(d, 'ILT', getattr(d, 'IAT', ()))
+            for t in thunks:
+                if t.name is None:
+                    continue
+                if isinstance(t.name, str):
+                    name = t.name.lower()
+                else:
+                    name = 'ord%d' % t.name
+                res.append('%s.%s' % (dll, name))
+        return hashlib.md5(','.join(res).encode('latin1')).hexdigest()
 
     def build_headers(self, c):
         off = self.DOShdr.lfanew
@@ -537,29 +1018,61 @@ class PE(object):
         c[off] = self.NThdr.pack()
         off += self.NThdr.bytelen
 
-    def build_content(self):
-        c = StrPatchwork()
-        c[self.NThdr.sizeofheaders-1] = pe.data_null
-        c[0] = self.DOShdr.pack()
-
-        # fix image size
+    def fix_sizeofimage(self):
         if len(self.SHList):
             s_last = self.SHList.shlist[-1]
             size = s_last.vaddr + s_last.rsize + (self.NThdr.sectionalignment-1)
             size &= ~(self.NThdr.sectionalignment-1)
             self.NThdr.sizeofimage = size
 
+    def shlist_offset(self):
+        return self.DOShdr.lfanew \
+            + self.NTsig.bytelen \
+            + self.COFFhdr.bytelen \
+            + self.COFFhdr.sizeofoptionalheader
+
+    def header_gaps(self):
+        # The parts of the headers that are not in a structure (the DOS
+        # program and the Rich header, before the NT headers; the padding
+        # or the bound imports, after the section headers) are copied
+        # from the file that has been parsed, where they were not in a
+        # structure either; else they are null bytes.
+        # Returns a list of (offset, data).
+        f = self._file
+        if f is None:
+            return []
+        lfanew, optsize, hdrsize, shsize = self._layout[:4]
+        res = []
+        start = self.DOShdr.bytelen
+        stop = min(self.DOShdr.lfanew, lfanew)
+        if start < stop:
+            res.append((start, f[start:stop]))
+        start = max(self.shlist_offset() + self.SHList.bytelen,
+                    lfanew + self.NTsig.bytelen + self.COFFhdr.bytelen
+                    + optsize + shsize)
+        stop = min(self.NThdr.sizeofheaders, hdrsize, len(f))
+        if start < stop:
+            res.append((start, f[start:stop]))
+        return res
+
+    def build_content(self):
+        self.apply_journal()
+        c = StrPatchwork()
+        c[self.NThdr.sizeofheaders-1] = pe.data_null
+        c[0] = self.DOShdr.pack()
+
+        self.fix_sizeofimage()
+
         # headers
         self.build_headers(c)
 
         # section headers
-        off = self.DOShdr.lfanew \
-            + self.NTsig.bytelen \
-            + self.COFFhdr.bytelen \
-            + self.COFFhdr.sizeofoptionalheader
+        off = self.shlist_offset()
         c[off] = self.SHList.pack()
         off += self.SHList.bytelen
         end_of_headers = off
+        for of, data in self.header_gaps():
+            c[of] = data
 
         # section data
         # note that the content of directories should have been already
@@ -575,15 +1088,34 @@ class PE(object):
                 log.warning("section %s offset %#x overlap previous section",
                     s.name, s.scnptr)
             off = s.scnptr+s.rawsize
-            c[s.scnptr:off] = s.section_data.data.pack()
+            # Unmodified sections are copied from the original file
+            # content, without intermediate copy
+            c[s.scnptr:off] = s.section_data.data
 
         # symbols and strings
         if self.COFFhdr.numberofsymbols:
+            symbols = self.unparsed_symbols()
             self.COFFhdr.pointertosymboltable = off
-            c[off] = self.Symbols.pack()
-            assert self.Symbols.bytelen == 18 * self.COFFhdr.numberofsymbols
-            off += self.Symbols.bytelen
-            c[off] = self.SymbolStrings.pack()
+            if symbols is not None:
+                # Not parsed, therefore not modified
+                c[off] = symbols
+            else:
+                c[off] = self.Symbols.pack()
+                assert self.Symbols.bytelen == 18 * self.COFFhdr.numberofsymbols
+                off += self.Symbols.bytelen
+                c[off] = self.SymbolStrings.pack()
+
+        # overlay, copied verbatim after the sections and the symbols,
+        # at its original offset if possible; else the certificate table
+        # moves with it
+        if self._overlay is not None:
+            start, stop = self._overlay
+            end = max(self.data_end(c), start)
+            if self._certificates is not None \
+                    and start <= self._certificates[0] < stop:
+                d = self.NThdr.optentries[pe.DIRECTORY_ENTRY_SECURITY]
+                d.rva = self._certificates[0] - start + end
+            c[end] = self._content.share(start, stop)
 
         # some headers may have been updated when building sections or symbols
         self.build_headers(c)
@@ -592,10 +1124,27 @@ class PE(object):
         l = self.DOShdr.lfanew + self.NTsig.bytelen + self.COFFhdr.bytelen
         if l%4:
             log.warning("non aligned coffhdr, bad crc calculation")
-        crcs = self.patch_crc(c.pack(), self.NThdr.CheckSum)
+        crcs = self.patch_crc(c.s, self.NThdr.CheckSum)
         c[l+64] = struct.pack('I', crcs)
         return c.pack()
 
+    def unparsed_symbols(self):
+        # If the symbol table and the string table have not been parsed,
+        # returns their content in the file, else None.
+        if self.is_parsed('Symbols') or self.is_parsed('SymbolStrings'):
+            return None
+        if not 'Symbols' in self.__dict__.get('_pending', {}):
+            return None
+        of = self.COFFhdr.pointertosymboltable
+        end = of + 18 * self.COFFhdr.numberofsymbols
+        if end + 4 > len(self.content):
+            # Truncated, parsing is needed
+            return None
+        sz, = struct.unpack(self.sex+'I',self.content[end:end+4])
+        if end + sz > len(self.content):
+            return None
+        return self.content[of:end+max(sz, 4)]
+
     def __str__(self):
         # For compatibility with previous versions of elftesteem
         # But it will not work with python3, because __str__ must
@@ -605,30 +1154,318 @@ class PE(object):
     def pack(self):
         return self.build_content()
 
+    # In-place save: if the layout of the file (offsets and sizes of the
+    # headers, sections, symbols and overlay) is not modified, the file
+    # built by pack() differs from the parsed file only where headers or
+    # section data have been modified, and in the checksum, which can be
+    # computed from the modified bytes only.
+    _file = None
+    _layout = None
+    def file_layout(self):
+        return (self.DOShdr.lfanew, self.COFFhdr.sizeofoptionalheader,
+                self.NThdr.sizeofheaders, self.SHList.bytelen,
+                tuple([(s.scnptr, s.rawsize) for s in self.SHList]),
+                self.COFFhdr.pointertosymboltable,
+                self.COFFhdr.numberofsymbols)
+
+    def modified_ranges(self):
+        # List of (offset, data) such that the file that has been parsed,
+        # with these ranges written, is the result of pack(); None if the
+        # layout of the file has been modified.
+        f = self._file
+        if f is None or self.file_layout() != self._layout:
+            return None
+        # headers, built as in build_content()
+        self.fix_sizeofimage()
+        c = StrPatchwork()
+        c[self.NThdr.sizeofheaders-1] = pe.data_null
+        c[0] = self.DOShdr.pack()
+        self.build_headers(c)
+        c[self.shlist_offset()] = self.SHList.pack()
+        for of, data in self.header_gaps():
+            c[of] = data
+        cs_off = self.checksum_offset()
+        c[cs_off] = f[cs_off:cs_off+4]
+        segments = [(0, c.pack())]
+        off = len(c)
+        for s in sorted(self.SHList, key=lambda _:_.scnptr):
+            if s.rawsize == 0:
+                continue
+            data = s.section_data.data
+            if s.scnptr < off or len(data) != s.rawsize:
+                # Overlapping or truncated sections
+                return None
+            segments.append((off, pe.data_null*(s.scnptr-off)))
+            off = s.scnptr+s.rawsize
+            if not data.is_slice_of(f, s.scnptr):
+                segments.append((s.scnptr, self.file_view(data)))
+        if self.COFFhdr.numberofsymbols:
+            if self.COFFhdr.pointertosymboltable != off:
+                return None
+            if self.is_parsed('Symbols') or self.is_parsed('SymbolStrings'):
+                data = self.Symbols.pack() + self.SymbolStrings.pack()
+                if off + len(data) != self.data_end(f):
+                    return None
+                segments.append((off, data))
+        if self.data_end(f) > len(f):
+            # pack() would pad the file
+            return None
+        if self._overlay is not None and self._certificates is not None \
+                and self._overlay[0] <= self._certificates[0]:
+            d = self.NThdr.optentries[pe.DIRECTORY_ENTRY_SECURITY]
+            if d.rva != self._certificates[0]:
+                # pack() writes back the offset of the certificate table
+                return None
+        view = self.file_view(f)
+        res = []
+        for off, data in segments:
+            res.extend(diff_ranges(view[off:off+len(data)], data, off))
+        # checksum
+        l = len(f)
+        delta = 0
+        for off, data in res:
+            if l%2 and off+len(data) == l:
+                # The last byte is not in a 16-bit word
+                return None
+            delta += word_delta(off, f[off:off+len(data)], data)
+        olds, = struct.unpack('I', f[cs_off:cs_off+4])
+        last = 0
+        if l%2:
+            last = struct.unpack('B', f[l-1:l])[0]
+        s = checksum(view, olds) - l - last
+        if s <= 0:
+            return None
+        s = (s - 1 + delta) % 0xFFFF + 1
+        crcs = struct.pack('I', s + l + last)
+        if crcs != f[cs_off:cs_off+4]:
+            res.append((cs_off, crcs))
+        return res
+
+    def save_inplace(self, path, verify=False):
+        # Saves the result of pack() in the file 'path', which contains
+        # the file that has been parsed: only the modified ranges are
+        # written, unless the layout of the file has been modified.
+        # With 'verify', the file is read back and compared with pack(),
+        # and written in full if it differs.
+        # Returns the list of (offset, length) written.
+        res = self.modified_ranges()
+        if res is None:
+            res = [(0, self.pack())]
+            write_ranges(path, res, truncate=True)
+        else:
+            write_ranges(path, res)
+        if verify:
+            data = self.pack()
+            if open(path, 'rb').read() != data:
+                log.error('In-place save of %s differs from pack()', path)
+                res = [(0, data)]
+                write_ranges(path, res, truncate=True)
+        return [(off, len(data)) for off, data in res]
+
     def export_funcs(self):
-        all_func = {}
-        for i, n in enumerate(self.DirExport.f_names):
-            all_func[n.name.name] = self.rva2virt(self.DirExport.f_address[self.DirExport.f_nameordinals[i].ordinal].rva)
-            all_func[self.DirExport.f_nameordinals[i].ordinal+self.DirExport.expdesc.base] = self.rva2virt(self.DirExport.f_address[self.DirExport.f_nameordinals[i].ordinal].rva)
-        #XXX todo: test if redirected export
-        return all_func
+        # Dictionary name or ordinal -> virtual address of the exports,
+        # computed once for each ImageBase; a copy of the cached
+        # dictionary is returned, which can be modified by the caller.
+        d = self.DirExport.expdesc
+        if d is None:
+            return {}
+        key = (d, d.index, self.rva2virt(0))
+        if getattr(self, '_export_funcs', (None,))[0:3] != key:
+            all_func = {}
+            idx = d.index
+            for name, j in zip(idx.names, idx.ordinals):
+                if j >= len(idx.rvas):
+                    continue
+                all_func[name] = all_func[j+idx.base] = \
+                    self.rva2virt(idx.rvas[j])
+            self._export_funcs = key + (all_func,)
+        return dict(self._export_funcs[3])
+
+    def resolve_export(self, func, resolver=None, depth=16):
+        # Finds the export 'func' (name or ordinal) and follows the
+        # forwarders, which need a 'resolver' that returns the PE object
+        # of a DLL from its name, e.g. an ExportResolver.
+        # Returns (PE, RVA), or None if not found.
+        pe_file = self
+        while depth > 0:
+            rva = pe_file.DirExport.get_export(func)
+            if not isinstance(rva, str):
+                if rva is None: return None
+                return pe_file, rva
+            if resolver is None:
+                return None
+            dll, func = rva.rsplit('.', 1)
+            if func.startswith('#'): func = int(func[1:])
+            pe_file = resolver(dll)
+            if pe_file is None:
+                return None
+            depth -= 1
+        log.warning('Too many forwarders for %r', func)
+        return None
 
     def reloc_to(self, imgbase):
-        DEPRECATED
-        offset = imgbase - self.NThdr.ImageBase
-        for rel in self.DirReloc.reldesc:
-            rva = rel.rva
-            for reloc in rel.rels:
-                t, off = reloc.rel
-                if t == 0 and off == 0:
-                    continue
-                if t != 3:
-                    raise ValueError('reloc type not impl')
-                off += rva
-                v = struct.unpack('I', self.drva[off:off+4])[0]
-                v += offset
-                self.drva[off:off+4] = struct.pack('I', v & mask32)
-        self.NThdr.ImageBase = imgbase
+        # Older API
+        self.rebase(imgbase)
+
+    def relocations(self):
+        # Base relocations, decoded block by block from the directory:
+        # list of (rva, type, arg) where 'arg' is the next slot of the
+        # block for IMAGE_REL_BASED_HIGHADJ (the low 16 bits), else None
+        if self.NThdr.numberofrvaandsizes <= pe.DIRECTORY_ENTRY_BASERELOC:
+            return []
+        d = self.NThdr.optentries[pe.DIRECTORY_ENTRY_BASERELOC]
+        if d.rva == 0 or d.size == 0:
+            return []
+        raw = self.rva[d.rva:d.rva+d.size]
+        res = []
+        pos = 0
+        while pos + 8 <= len(raw):
+            page, size = struct.unpack('<II', raw[pos:pos+8])
+            if size < 8:
+                break
+            words = array.array('H', raw[pos+8:pos+8+((size-8)&~1)])
+            if sys.byteorder == 'big': words.byteswap()
+            idx = 0
+            while idx < len(words):
+                t, off = words[idx] >> 12, words[idx] & 0xfff
+                arg = None
+                if t == pe.IMAGE_REL_BASED_HIGHADJ:
+                    idx += 1
+                    if idx < len(words): arg = words[idx]
+                    else:                arg = 0
+                if t != pe.IMAGE_REL_BASED_ABSOLUTE:
+                    res.append((page+off, t, arg))
+                idx += 1
+            pos += size
+        return res
+
+    def rebase(self, imagebase):
+        # Applies the base relocations to the section data, for a new
+        # ImageBase; the file content is updated with one write per
+        # modified section.
+        delta = imagebase - self.NThdr.ImageBase
+        relocs = {}
+        for rva, t, arg in self.relocations():
+            s = self.getsectionbyrva(rva)
+            if s is None:
+                log.warning('Relocation at RVA %#x not in a section', rva)
+                continue
+            relocs.setdefault(s, []).append((rva - s.vaddr, t, arg))
+        for s, rels in relocs.items():
+            data = s.section_data.data
+            apply_relocations(data.s, rels, delta)
+            data.s_cache = None
+            self.journal_write(s.scnptr, data[:s.rawsize])
+        self.NThdr.ImageBase = imagebase
+
+    def load_image(self, imagebase=None):
+        # Content of the image loaded in memory at 'imagebase' (default:
+        # NThdr.ImageBase), with the base relocations applied.
+        c = StrPatchwork()
+        c[self.NThdr.sizeofimage-1] = pe.data_null
+        c[0] = self.content[:self.NThdr.sizeofheaders]
+        for s in self.SHList:
+            # paddr contains the virtual size; the file content past
+            # it is not mapped (if paddr is zero, the whole raw data is)
+            size = s.rawsize
+            if s.paddr:
+                size = min(s.rawsize, s.paddr)
+            c[s.vaddr] = s.section_data[:size]
+        if imagebase is not None:
+            apply_relocations(c.s, self.relocations(),
+                              imagebase - self.NThdr.ImageBase)
+        return c.pack()
+
+# Writes the list of (offset, data) in the file 'path', with one
+# system call per range; with 'truncate', the file is created or
+# replaced by the data.
+def write_ranges(path, ranges, truncate=False):
+    flags = os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    if truncate:
+        flags |= os.O_CREAT | os.O_TRUNC
+    fd = os.open(path, flags, 438) # 0666, before the umask
+    try:
+        for off, data in ranges:
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fd, data, off)
+            else:
+                # Python older than 3.3, or Windows
+                os.lseek(fd, off, 0)
+                os.write(fd, data)
+    finally:
+        os.close(fd)
+
+# Applies the base relocations 'rels', a list of (offset, type, arg) in
+# the array of bytes 'data'; HIGHLOW and DIR64 are applied with numpy if
+# available.
+def apply_relocations(data, rels, delta):
+    todo = {}
+    for off, t, arg in rels:
+        todo.setdefault(t, []).append((off, arg))
+    for t, fmt, mask in ((pe.IMAGE_REL_BASED_HIGHLOW, '<I', mask32),
+                         (pe.IMAGE_REL_BASED_DIR64, '<Q', (1<<64)-1)):
+        if not t in todo:
+            continue
+        offsets = [off for off, arg in todo.pop(t)
+                   if off + struct.calcsize(fmt) <= len(data)]
+        if numpy is not None and len(offsets) == len(set(offsets)):
+            size = struct.calcsize(fmt)
+            buf = numpy.frombuffer(data, dtype=numpy.uint8)
+            idx = numpy.array(offsets, dtype=numpy.int64)[:,None] \
+                + numpy.arange(size)
+            dtype = numpy.dtype(fmt)
+            values = buf[idx].copy().view(dtype).ravel() \
+                   + dtype.type(delta & mask)
+            buf[idx] = values.view(numpy.uint8).reshape(-1, size)
+        else:
+            for off in offsets:
+                v, = struct.unpack_from(fmt, data, off)
+                struct.pack_into(fmt, data, off, (v + delta) & mask)
+    for t, rels in todo.items():
+        if not t in (pe.IMAGE_REL_BASED_HIGH, pe.IMAGE_REL_BASED_LOW,
+                     pe.IMAGE_REL_BASED_HIGHADJ):
+            raise ValueError('Relocation type %d not implemented' % t)
+        for off, arg in rels:
+            if off + 2 > len(data):
+                continue
+            v, = struct.unpack_from('<H', data, off)
+            if t == pe.IMAGE_REL_BASED_HIGH:
+                v += delta >> 16
+            elif t == pe.IMAGE_REL_BASED_LOW:
+                v += delta
+            else:
+                # The low 16 bits are signed, the result is rounded
+                v = (v << 16) + arg - ((arg & 0x8000) << 1) + delta
+                v = (v + 0x8000) >> 16
+            struct.pack_into('<H', data, off, v & 0xFFFF)
+
+class ExportResolver(object):
+    # Resolver of forwarded exports for PE.resolve_export: DLLs are
+    # looked for in the directories of 'path', parsed when first needed,
+    # and kept in a cache shared by all resolutions. DLLs can also be
+    # added with add().
+    def __init__(self, path=()):
+        self.path = path
+        self.dlls = {}
+    def key(self, name):
+        name = name.lower()
+        if not name.endswith('.dll'): name += '.dll'
+        return name
+    def add(self, name, pe_file):
+        self.dlls[self.key(name)] = pe_file
+    def __call__(self, name):
+        key = self.key(name)
+        if not key in self.dlls:
+            self.dlls[key] = None
+            for d in self.path:
+                for f in os.listdir(d):
+                    if f.lower() == key:
+                        raw = open(os.path.join(d, f), 'rb').read()
+                        self.dlls[key] = PE(raw, parse_resources=False)
+                        break
+                if self.dlls[key] is not None:
+                    break
+        return self.dlls[key]
 
 # The COFF file format happens to have many variants,
 # quite different from the COFF embedded in PE files...
@@ -644,6 +1481,7 @@ class COFF(PE):
         # Therefore, the usual way to know if a file is COFF is to parse
         # its content with this method. If it is not a COFF, then an
         # exception is raised, of type ValueError
+        self._pending = {}
         of = 0
         # Detect specific cases of COFF Header format, without knowing
         # the endianess
@@ -748,19 +1586,13 @@ class COFF(PE):
                                        start=self.COFFhdr.pointertosymboltable,
                                        )
         elif of != 0 and self.COFFhdr.numberofsymbols != 0:
-            self.Symbols = pe.CoffSymbols(
+            content = self.content
+            self._pending['Symbols'] = lambda: pe.CoffSymbols(
                                        parent=self,
-                                       content=self.content,
+                                       content=content,
                                        start=None,
                                        )
-        if hasattr(self, 'Symbols'):
-            of = self.COFFhdr.pointertosymboltable + self.Symbols.bytelen
-            sz, = struct.unpack(self.sex+'I',self.content[of:of+4])
-            if len(self.content) < of+sz:
-                log.warning('File too short for StrTable %#x != %#x' % (
-                    len(self.content)-of, sz))
-                sz = len(self.content) - of
-            self.SymbolStrings = StrTable(self.content[of:of+sz])
+            self._pending['SymbolStrings'] = self.parse_strings
         
         if self.Opthdr.__class__.__name__ == 'OpthdrUnknown':
             log.warning("Unknown Option Header format of size %d for machine %s:",
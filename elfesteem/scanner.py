@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+# Scanner of a corpus of binaries: all files found in the directories
+# given as arguments are parsed by binary.BINARY, in parallel, and a
+# summary of each file is written as one JSON object per line.
+
+import sys, os
+sys.path.insert(1, os.path.abspath(sys.path[0]+'/..'))
+
+import json, hashlib, struct
+from elfesteem.binary import BINARY
+from elfesteem import elf
+
+try:
+    import concurrent.futures
+except ImportError:
+    # Python 2 without the 'futures' backport: files are scanned
+    # sequentially in the current process.
+    concurrent = None
+
+def iter_files(paths):
+    # Generator of all regular files in 'paths', which can be files or
+    # directories; directories are walked recursively, in sorted order.
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                f = os.path.join(root, name)
+                if os.path.isfile(f):
+                    yield f
+
+# Errors of the parsers on invalid or truncated files
+parse_errors = (ValueError, KeyError, IndexError, AttributeError,
+                struct.error)
+
+def _get(f, res=None, key=None):
+    # Some attributes cannot be computed for some files (e.g. a
+    # directory truncated by the end of the file); this is not a
+    # scanning error: the attribute is None, and the error is recorded
+    # in res['errors'][key]. Other exceptions are not caught.
+    try:
+        return f()
+    except parse_errors:
+        if res is not None:
+            err = sys.exc_info()[1]
+            res.setdefault('errors', {})[key] = '%s: %s' % (
+                err.__class__.__name__, err)
+        return None
+
+def _str(s):
+    if isinstance(s, bytes) and not isinstance(s, str):
+        return s.decode('latin1')
+    return str(s)
+
+def section_summary(e, s):
+    container = e.__class__.__name__
+    if container in ('PE', 'COFF'):
+        return {'name': s.name.strip('\0'), 'addr': s.vaddr,
+                'offset': s.scnptr, 'size': s.rawsize}
+    if container == 'ELF':
+        return {'name': s.sh.name, 'addr': s.sh.addr,
+                'offset': s.sh.offset, 'size': s.sh.size}
+    if container == 'MACHO' and hasattr(s, 'sh'):
+        return {'name': '%s,%s' % (s.sh.segname, s.sh.sectname),
+                'addr': s.sh.addr, 'offset': s.sh.offset, 'size': s.sh.size}
+    return {'name': _str(s)}
+
+def imports_summary(e):
+    # Imported libraries (and functions, when known)
+    container = e.__class__.__name__
+    if container == 'PE':
+        imports = {}
+        for d in getattr(e, 'DirImport', ()):
+            # Functions imported by ordinal have an integer name
+            imports.setdefault(str(d.name), []).extend(
+                [t.name for t in getattr(d, 'IAT', ())])
+        return imports
+    if container == 'ELF':
+        needed = []
+        for s in e.getsectionsbytype(elf.SHT_DYNAMIC):
+            for d in getattr(s, 'dyntab', ()):
+                if d.type == elf.DT_NEEDED:
+                    needed.append(d.name)
+        return needed
+    if container == 'MACHO' and hasattr(e, 'Fhdr'):
+        # Fat file: the imports of each architecture, in the same order
+        # as 'architecture'
+        return [imports_summary(arch) for arch in e.arch]
+    if container == 'MACHO' and hasattr(e, 'load'):
+        from elfesteem.macho import LC_LOAD_DYLIB, LC_LOAD_WEAK_DYLIB, \
+            LC_REEXPORT_DYLIB, LC_LAZY_LOAD_DYLIB, LC_LOAD_UPWARD_DYLIB
+        return [lc.str_name for lc in e.load if lc.cmd in (LC_LOAD_DYLIB,
+            LC_LOAD_WEAK_DYLIB, LC_REEXPORT_DYLIB, LC_LAZY_LOAD_DYLIB,
+            LC_LOAD_UPWARD_DYLIB)]
+    return None
+
+def pdb_summary(e):
+    # PDB of a PE, from the CodeView record of the debug directory;
+    # the other directories are not parsed
+    if e.__class__.__name__ != 'PE':
+        return None
+    cv = e.DirDebug.codeview
+    if cv is None:
+        return None
+    return {'path': cv.path, 'id': cv.pdb_id}
+
+def summary(raw, b=None):
+    # Summary of the binary 'raw', as a dictionary that can be
+    # serialized with json; 'b' is 'raw' already parsed by BINARY
+    res = {
+        'size':   len(raw),
+        'md5':    hashlib.md5(raw).hexdigest(),
+        'sha1':   hashlib.sha1(raw).hexdigest(),
+        'sha256': hashlib.sha256(raw).hexdigest(),
+        }
+    if b is None:
+        b = BINARY(raw)
+    e = b.e
+    architecture = _get(lambda: b.architecture, res, 'architecture')
+    if architecture is not None and not isinstance(architecture, list):
+        architecture = _str(architecture)
+    res['container']    = b.container
+    res['architecture'] = architecture
+    res['entrypoint']   = _get(lambda: int(b.entrypoint), res, 'entrypoint')
+    res['sections']     = _get(lambda: [section_summary(e, s)
+                                        for s in b.sections], res, 'sections')
+    res['symbols']      = _get(lambda: len(b.symbols), res, 'symbols')
+    res['dynsyms']      = _get(lambda: len(b.dynsyms), res, 'dynsyms')
+    res['imports']      = _get(lambda: imports_summary(e), res, 'imports')
+    res['pdb']          = _get(lambda: pdb_summary(e), res, 'pdb')
+    return res
+
+def scan_file(path, cache=None):
+    # The file is read and parsed in the worker process; only the
+    # summary is sent back. Any error is reported in the summary.
+    # If 'cache' is a ParseCache, the file is parsed only if it is not
+    # already in the cache.
+    try:
+        raw = open(path, 'rb').read()
+        if cache is None: res = summary(raw)
+        else:             res = cache.get(raw)
+    except Exception:
+        err = sys.exc_info()[1]
+        res = {'error': '%s: %s' % (err.__class__.__name__, err)}
+    res['file'] = path
+    return res
+
+def scan_chunk(paths, cache_path=None, cache_size=None):
+    if cache_path is None:
+        return [scan_file(path) for path in paths]
+    from elfesteem.cache import ParseCache
+    cache = ParseCache(cache_path, max_size=cache_size)
+    try:
+        return [scan_file(path, cache=cache) for path in paths]
+    finally:
+        cache.close()
+
+def _chunks(files, chunksize):
+    chunk = []
+    for f in files:
+        chunk.append(f)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _wait_chunks(executor, chunks, running, limit, *args):
+    # Submits chunks until 'limit' chunks are running, then waits until
+    # at least one of them is done; returns (done, running), where
+    # 'done' is empty if all chunks have been scanned.
+    for chunk in chunks:
+        running.add(executor.submit(scan_chunk, chunk, *args))
+        if len(running) >= limit:
+            break
+    if not running:
+        return (), running
+    return concurrent.futures.wait(running,
+        return_when=concurrent.futures.FIRST_COMPLETED)
+
+def scan(paths, jobs=None, chunksize=16, pending=2,
+         cache_path=None, cache_size=None):
+    # Generator of the summaries of all files in 'paths', in no specific
+    # order when jobs > 1.
+    # With 'cache_path', the summaries are read from (or stored in) a
+    # ParseCache, and include the indexes computed by cache.record().
+    # At most jobs*pending chunks are submitted and not yet collected,
+    # which bounds the memory used, whatever the size of the corpus.
+    chunks = _chunks(iter_files(paths), chunksize)
+    if concurrent is None or jobs == 1:
+        for chunk in chunks:
+            for res in scan_chunk(chunk, cache_path, cache_size):
+                yield res
+        return
+    if jobs is None:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+    # No 'yield' in a try/finally, which is not valid before python 2.5:
+    # the executor is shut down when the generator is closed, or when
+    # an exception is raised.
+    running = set()
+    done = True
+    while done:
+        try:
+            done, running = _wait_chunks(executor, chunks, running,
+                                jobs*pending, cache_path, cache_size)
+            for future in done:
+                for res in future.result():
+                    yield res
+        except:
+            executor.shutdown()
+            raise
+    executor.shutdown()
+
+def main(argv):
+    try:
+        import argparse
+    except ImportError:
+        sys.stderr.write("argparse is needed\n")
+        return 1
+    parser = argparse.ArgumentParser(
+        description='Summarize binaries as JSON Lines')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('-c', '--chunksize', type=int, default=16,
+        help='number of files sent to a worker at once')
+    parser.add_argument('-o', '--output', default=None,
+        help='output file (default: stdout)')
+    parser.add_argument('--cache', default=None,
+        help='database of previously parsed files (created if needed)')
+    parser.add_argument('--cache-size', type=int, default=None,
+        help='maximal size of the cache, in bytes')
+    parser.add_argument('path', nargs='+', help='files or directories')
+    args = parser.parse_args(argv)
+    if args.output is None: out = sys.stdout
+    else:                   out = open(args.output, 'w')
+    try:
+        for res in scan(args.path, jobs=args.jobs, chunksize=args.chunksize,
+                        cache_path=args.cache, cache_size=args.cache_size):
+            out.write(json.dumps(res, sort_keys=True) + '\n')
+            out.flush()
+    finally:
+        if out is not sys.stdout: out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -5,25 +5,114 @@ import struct
 data_null = struct.pack("B",0)
 data_empty = struct.pack("")
 
+def to_bytes(s):
+    if isinstance(s, array):
+        if sys.version_info[0] >= 3:
+            return s.tobytes()
+        else:
+            return s.tostring()
+    if isinstance(s, bytes):
+        return s
+    if hasattr(s, 'tobytes'):
+        # memoryview
+        return s.tobytes()
+    return bytes(s)
+
+def to_array(s):
+    # Array of bytes, from a string or a buffer (e.g. a memoryview)
+    res = array("B")
+    if sys.version_info[0] >= 3:
+        try:
+            res.frombytes(s)
+        except TypeError:
+            res = array("B", s)
+    else:
+        res.fromstring(to_bytes(s))
+    return res
+
+def buffer_view(s, start=0, stop=None):
+    # Slice [start:stop] of a string or an array of bytes, without copy:
+    # a memoryview with python 3, a buffer with python 2, where arrays
+    # do not support memoryview
+    if stop is None: stop = len(s)
+    if sys.version_info[0] >= 3:
+        return memoryview(s)[start:stop]
+    return buffer(s, start, max(0, stop-start))
+
 class StrPatchwork(object):
+    # The content is the array of bytes 's', but this array is created
+    # only when the content is modified: until then, the content is the
+    # slice [_start:_stop] of the immutable string '_base', which can be
+    # shared, without copy, with other StrPatchwork made by share(), e.g.
+    # the content of a file and the data of its sections.
     def __init__(self, s=data_empty, paddingbyte=data_null):
         if s == None: s = data_empty
         if isinstance(s, StrPatchwork): s = s.pack()
-        self.s = array("B",s)
+        self._base = to_bytes(s)
+        self._start = 0
+        self._stop = len(self._base)
+        self._s = None
         # cache s to avoid rebuilding str after each find
-        self.s_cache = s
+        self.s_cache = None
         self.paddingbyte=paddingbyte
     def __str__(self):
         return self.pack() # Needed for miasm2 :-(
         raise AttributeError("Use pack() instead of str()")
     def pack(self):
+        if self._s is None:
+            if self._start == 0 and self._stop == len(self._base):
+                return self._base
+            return self._base[self._start:self._stop]
         if sys.version_info[0] >= 3:
-            return self.s.tobytes()
+            return self._s.tobytes()
+        else:
+            return self._s.tostring()
+
+    def get_s(self):
+        # The array of bytes, created when first used
+        if self._s is None:
+            self._s = to_array(buffer_view(self._base, self._start, self._stop))
+            self._base = None
+        return self._s
+    def set_s(self, s):
+        self._s = s
+        self._base = None
+        self.s_cache = None
+    s = property(get_s, set_s)
+    def is_shared(self):
+        # True if the content has not been modified since its creation
+        return self._s is None
+    def share(self, start=0, stop=None):
+        # A new StrPatchwork with the content [start:stop], which does
+        # not copy it if this StrPatchwork has not been modified; the
+        # modifications of any of them are not seen by the other one.
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        res = StrPatchwork(paddingbyte=self.paddingbyte)
+        if self._s is None:
+            res._base = self._base
+            res._start = self._start + start
+            res._stop = self._start + stop
         else:
-            return self.s.tostring()
+            res._base = to_bytes(self._s[start:stop])
+            res._stop = stop - start
+        return res
+    def is_slice_of(self, data, start):
+        # True if the content is, without modification, the slice of the
+        # string 'data' at 'start' (e.g. the data of a section, unmodified
+        # since the file has been parsed)
+        return self._s is None and self._base is data \
+            and self._start == start
+    def view(self):
+        # View of the content, without copy
+        if self._s is None:
+            return buffer_view(self._base, self._start, self._stop)
+        return buffer_view(self._s)
 
     def __getitem__(self, item):
-        s = self.s
+        if self._s is None:
+            return self._getitem_base(item)
+        s = self._s
         if type(item) is slice:
             r = s[item]
             end = item.stop
@@ -47,39 +136,85 @@ class StrPatchwork(object):
             return r.tobytes()
         else:
             return r.tostring()
+    def _getitem_base(self, item):
+        # Same as above, reading '_base' without creating the array
+        l = len(self)
+        if type(item) is not slice:
+            if item > l:
+                return self.paddingbyte
+            if item < 0:
+                item += l
+            if not 0 <= item < l:
+                raise IndexError("array index out of range")
+            return self._base[self._start+item:self._start+item+1]
+        if item.step not in (None, 1):
+            return self.pack()[item]
+        start, stop, _ = item.indices(l)
+        r = self._base[self._start+start:self._start+max(start, stop)]
+        end = item.stop
+        if end != None and l < end:
+            if len(r) > 0:
+                # We go beyond the end of 's'
+                r += self.paddingbyte*(end-l)
+            else:
+                # We are entirely after the end of 's'
+                start = item.start
+                if start is None: start = 0
+                r = self.paddingbyte*(end-start)
+        return r
     def __setitem__(self, item, val):
         if val == None:
             return
         if sys.version_info[0] >= 3 and type(val) == str:
             val = val.encode(encoding="latin1")
-        val = array("B",val)
+        if isinstance(val, StrPatchwork):
+            val = val.view()
+        val = to_array(val)
         if type(item) is not slice:
             item = slice(item, item+len(val))
         end = item.stop
-        l = len(self.s)
+        s = self.s
+        l = len(s)
         if l < end:
-            self.s.extend(array("B", self.paddingbyte*(end-l)))
-        self.s[item] = val
+            s.extend(array("B", self.paddingbyte*(end-l)))
+        s[item] = val
         self.s_cache = None
 
 
     def __repr__(self):
         return "<Patchwork %r>" % self.pack()
     def __len__(self):
-        return len(self.s)
+        if self._s is None:
+            return self._stop - self._start
+        return len(self._s)
     def __contains__(self, val):
         return val in self.pack()
     def __iadd__(self, other):
         self.s.extend(array("B", other))
+        self.s_cache = None
         return self
 
     def find(self, pattern, *args):
+        if self._s is None and (self._start, self._stop) != (0, len(self._base)):
+            return self._find_base(self._base.find, pattern, *args)
         if not self.s_cache:
             self.s_cache = self.pack()
         return self.s_cache.find(pattern, *args)
 
     def rfind(self, pattern, *args):
+        if self._s is None and (self._start, self._stop) != (0, len(self._base)):
+            return self._find_base(self._base.rfind, pattern, *args)
         if not self.s_cache:
             self.s_cache = self.pack()
         return self.s_cache.rfind(pattern, *args)
 
+    def _find_base(self, find, pattern, start=None, end=None):
+        # find or rfind in the slice of '_base'
+        l = len(self)
+        if start is not None and start > l:
+            return -1
+        start, end, _ = slice(start, end).indices(l)
+        i = find(pattern, self._start+start, self._start+max(start, end))
+        if i < 0:
+            return i
+        return i - self._start
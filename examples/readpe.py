@@ -412,6 +412,8 @@ def pe_dir_display(e):
     if hasattr(e, 'DirDelay'):  print(e.DirDelay.display())
     if hasattr(e, 'DirRes'):    print(e.DirRes.display())
     if hasattr(e, 'DirReloc'):  print(e.DirReloc.display())
+    if len(getattr(e, 'DirException', ())): print(e.DirException.display())
+    if len(getattr(e, 'DirDebug', ())):     print(e.DirDebug.display())
 
 if __name__ == '__main__':
     arg_keys = {
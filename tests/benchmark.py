@@ -0,0 +1,255 @@
+#! /usr/bin/env python
+# Benchmark of elfesteem on the files of binary_input (or on any file
+# given as argument): for each file, several phases are measured
+#   parse    binary.BINARY(raw)
+#   pack     pack() of the parsed file
+#   virt     random reads of 16 bytes in the mapped sections
+#   symbols  iteration over the static and dynamic symbols
+#   display  output of examples/readelf.py, readpe.py or otool.py
+# and for each phase, the wall time (best of 'repeat' runs), the peak
+# of memory allocated (tracemalloc) and the number of objects created
+# that are still alive at the end of the phase (gc).
+# The results are saved as JSON; two results can be compared with
+#   benchmark.py --compare old.json new.json
+# With --synthetic, large files created by synthetic.py at the given
+# scales are measured too, to see how each phase scales.
+
+import sys, os
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.dirname(__dir__))
+
+import json, gc, random
+from elfesteem import binary, scanner, elf
+import elfesteem
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python older than 3.4: the memory is not measured
+    tracemalloc = None
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
+display_tools = {
+    'ELF':   ('readelf.py', ['-h', '-S', '-r', '-s', '--dyn-syms', '-d', '-l']),
+    'PE':    ('readpe.py',  ['-H', '-S', '-D', '-r', '-s', '-l']),
+    'COFF':  ('readpe.py',  ['-H', '-S', '-r', '-s', '-l']),
+    'MACHO': ('otool.py',   ['-h', '-l', '--symbols', '-r']),
+    }
+
+class NullOutput(object):
+    def write(self, s):
+        pass
+    def flush(self):
+        pass
+
+def mapped_range(b, s):
+    # Virtual address and size of the data of the section 's' that can
+    # be read with b.e.virt, or None
+    if b.container in ('PE', 'COFF'):
+        # The address of the section is a RVA, and the section is
+        # mapped up to its virtual size
+        return b.e.rva2virt(s.vaddr), min(s.size, s.rawsize)
+    if b.container == 'ELF':
+        if not s.sh.flags & elf.SHF_ALLOC or s.sh.type == elf.SHT_NOBITS:
+            return None
+        return s.sh.addr, s.sh.size
+    if b.container == 'MACHO' and hasattr(s, 'sh') \
+            and hasattr(s, 'content'):
+        # Not the lists of symbol stubs or pointers
+        return s.sh.addr, s.sh.size
+    return None
+
+def virt_addresses(b, count=1000, seed=0):
+    ranges = []
+    for s in b.sections:
+        r = mapped_range(b, s)
+        if r is not None and r[0] and r[1] > 16:
+            ranges.append(r)
+    rnd = random.Random(seed)
+    res = []
+    for _ in range(count * (len(ranges) > 0)):
+        addr, size = ranges[rnd.randrange(len(ranges))]
+        res.append(addr + rnd.randrange(size - 16))
+    return res
+
+def phase_parse(raw, b):
+    return binary.BINARY(raw)
+
+def phase_pack(raw, b):
+    return b.e.pack()
+
+def phase_virt(raw, b, addresses=None):
+    virt = b.e.virt
+    for addr in addresses:
+        if len(virt[addr:addr+16]) != 16:
+            raise ValueError('Read of %d bytes at %#x'
+                             % (len(virt[addr:addr+16]), addr))
+
+def phase_symbols(raw, b):
+    n = 0
+    for table in (b.symbols, b.dynsyms):
+        for s in table:
+            getattr(s, 'name', None), getattr(s, 'value', None)
+            n += 1
+    return n
+
+def phase_display(raw, b, path=None):
+    import runpy
+    tool, options = display_tools[b.container]
+    argv, stdout = sys.argv, sys.stdout
+    sys.argv = [tool] + options + [path]
+    sys.stdout = NullOutput()
+    try:
+        runpy.run_path(os.path.join(os.path.dirname(__dir__),
+            'examples', tool), run_name='__main__')
+    finally:
+        sys.argv, sys.stdout = argv, stdout
+
+def measure(f, args, repeat):
+    # Wall time, without tracemalloc which slows down the allocations
+    best = None
+    for _ in range(repeat):
+        t = clock()
+        f(*args)
+        t = clock() - t
+        if best is None or t < best: best = t
+    res = {'time': best}
+    # Objects created, and still alive
+    gc.collect()
+    before = len(gc.get_objects())
+    keep = f(*args)
+    res['objects'] = len(gc.get_objects()) - before
+    del keep
+    # Memory peak
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        f(*args)
+        res['peak'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        res['peak'] = None
+    return res
+
+def bench_file(path, repeat=3, phases=None):
+    raw = open(path, 'rb').read()
+    res = {'size': len(raw)}
+    try:
+        b = binary.BINARY(raw)
+    except Exception:
+        err = sys.exc_info()[1]
+        res['error'] = '%s: %s' % (err.__class__.__name__, err)
+        return res
+    res['container'] = b.container
+    if phases is None:
+        phases = ('parse', 'pack', 'virt', 'symbols', 'display')
+    for name in phases:
+        f = globals()['phase_'+name]
+        args = (raw, b)
+        if name == 'virt':
+            args = (raw, b, scanner._get(lambda: virt_addresses(b)))
+            if not args[2]: continue
+        elif name == 'display':
+            if not b.container in display_tools: continue
+            args = (raw, b, path)
+        elif name == 'pack' and not hasattr(b.e, 'pack'):
+            continue
+        try:
+            res[name] = measure(f, args, repeat)
+        except Exception:
+            err = sys.exc_info()[1]
+            res[name] = {'error': '%s: %s' % (err.__class__.__name__, err)}
+    return res
+
+def run(paths, repeat=3, phases=None, log=None):
+    results = {}
+    for path in scanner.iter_files(paths):
+        if log is not None:
+            log.write('%s\n' % path)
+        results[os.path.relpath(path)] = bench_file(path, repeat, phases)
+    return {
+        'python':    sys.version.split()[0],
+        'elfesteem': elfesteem.__version__,
+        'repeat':    repeat,
+        'results':   results,
+        }
+
+def compare(old, new, threshold=1.1):
+    # List of (file, phase, metric, old value, new value, ratio), for
+    # all metrics that increased by more than 'threshold'
+    res = []
+    for path in sorted(new['results']):
+        if not path in old['results']: continue
+        o_file, n_file = old['results'][path], new['results'][path]
+        for phase in sorted(n_file):
+            o, n = o_file.get(phase), n_file[phase]
+            if not isinstance(o, dict) or not isinstance(n, dict): continue
+            for metric in ('time', 'peak', 'objects'):
+                if o.get(metric) is None or n.get(metric) is None: continue
+                if o[metric] <= 0: continue
+                ratio = float(n[metric]) / o[metric]
+                if ratio > threshold:
+                    res.append((path, phase, metric, o[metric], n[metric],
+                                ratio))
+    return res
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark of elfesteem')
+    parser.add_argument('-o', '--output', default=None,
+        help='JSON output file (default: stdout)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+        help='number of runs for the measure of the wall time')
+    parser.add_argument('-p', '--phase', dest='phases', action='append',
+        choices=('parse', 'pack', 'virt', 'symbols', 'display'),
+        help='phase to measure (default: all)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help='compare two JSON results')
+    parser.add_argument('--synthetic', type=int, action='append',
+        default=[], metavar='SCALE',
+        help='also measure synthetic files created at this scale')
+    parser.add_argument('--threshold', type=float, default=1.1,
+        help='minimal ratio new/old reported by --compare')
+    parser.add_argument('path', nargs='*',
+        help='files or directories (default: binary_input)')
+    args = parser.parse_args(argv)
+    if args.compare:
+        old, new = [json.load(open(_)) for _ in args.compare]
+        regressions = compare(old, new, args.threshold)
+        for path, phase, metric, o, n, ratio in regressions:
+            print("%-50s %-8s %-8s %12.6g %12.6g %6.2f" % (path, phase,
+                metric, o, n, ratio))
+        return len(regressions) > 0
+    if not args.path:
+        args.path = [os.path.join(__dir__, 'binary_input')]
+    tmp = None
+    if args.synthetic:
+        import tempfile, synthetic
+        tmp = tempfile.mkdtemp()
+        for scale in args.synthetic:
+            args.path.extend(synthetic.write_files(tmp, scale))
+    try:
+        res = run(args.path, args.repeat, args.phases, log=sys.stderr)
+    finally:
+        if tmp is not None:
+            import shutil
+            shutil.rmtree(tmp)
+    if tmp is not None:
+        # Same names for each run, to be able to compare them
+        for path in list(res['results']):
+            if os.path.abspath(path).startswith(tmp):
+                res['results']['synthetic/'+os.path.basename(path)] = \
+                    res['results'].pop(path)
+    if args.output is None: out = sys.stdout
+    else:                   out = open(args.output, 'w')
+    json.dump(res, out, sort_keys=True, indent=1)
+    out.write('\n')
+    if out is not sys.stdout: out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
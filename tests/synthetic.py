@@ -0,0 +1,272 @@
+#! /usr/bin/env python
+# Generator of synthetic binaries, much larger than the files of
+# binary_input, to measure how elfesteem scales with the size of its
+# input: number of sections, of symbols, of imported functions or of
+# relocations.
+# ELF and PE files are created with the elfesteem API; Mach-O objects
+# are created directly, because elfesteem cannot create them.
+
+import sys, os
+__dir__ = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(1, os.path.dirname(__dir__))
+
+import struct
+from elfesteem import elf, pe, macho
+from elfesteem.elf_init import ELF, elf_set_offsets
+from elfesteem.pe_init import PE
+from elfesteem.strpatchwork import StrPatchwork
+
+def code(size):
+    # Content of an executable section: nops followed by ret
+    return struct.pack("B", 0x90)*(size-1) + struct.pack("B", 0xc3)
+
+def strtab(names):
+    # String table starting with an empty name; returns the table and
+    # the index of each name
+    idx, pos = [], 1
+    for name in names:
+        idx.append(pos)
+        pos += len(name)+1
+    data = struct.pack("B", 0).join([_.encode('latin1') for _ in names])
+    return struct.pack("B", 0) + data + struct.pack("B", 0), idx
+
+def symbol_names(nsymbols):
+    return ['f%d' % i for i in range(nsymbols)]
+
+def elf_file(nsections=1, nsymbols=0, nrelocs=0, wsize=32,
+             e_type=elf.ET_REL, section_size=16):
+    # ELF relocatable (or executable, if e_type is ET_EXEC) with 'nsections'
+    # sections .text.N, 'nsymbols' global functions and 'nrelocs'
+    # relocations in the first section
+    machine = { 32: elf.EM_386, 64: elf.EM_X86_64 }[wsize]
+    sections = ['.text.%d' % i for i in range(nsections)]
+    relocs = []
+    if nrelocs: relocs = sections[:1]
+    e = ELF(e_type=elf.ET_REL, e_machine=machine, wsize=wsize,
+            sections=sections, relocs=relocs)
+    text = [s for s in e.sh if s.sh.name.startswith('.text.')
+                            or s.__class__.__name__ == 'ProgBits']
+    for s in text:
+        s.content = StrPatchwork(code(section_size))
+    # Symbols: the names are all written at once in the string table,
+    # because StrTable.add_name would be quadratic
+    symtab = e.getsectionbytype(elf.SHT_SYMTAB)
+    Sym = { 32: elf.Sym32, 64: elf.Sym64 }[wsize]
+    symtab.sh.entsize = Sym(parent=symtab).bytelen
+    symtab.sh.info = 1
+    names, name_idx = strtab(symbol_names(nsymbols))
+    symtab.linksection.content = StrPatchwork(names)
+    text_idx = [e.sh.shlist.index(s) for s in text]
+    def symbols(addr):
+        res = [struct.pack("B", 0)*symtab.sh.entsize]
+        for i in range(nsymbols):
+            shndx = text_idx[i % len(text_idx)]
+            value = addr.get(shndx, 0) + (i*4) % section_size
+            info = (elf.STB_GLOBAL<<4) | elf.STT_FUNC
+            if wsize == 32:
+                res.append(struct.pack("<IIIBBH",
+                    name_idx[i], value, 4, info, 0, shndx))
+            else:
+                res.append(struct.pack("<IBBHQQ",
+                    name_idx[i], info, 0, shndx, value, 4))
+        return StrPatchwork(struct.pack("").join(res))
+    symtab.content = symbols({})
+    # Relocations of the first section, all written at once
+    for rel in e.getsectionsbytype(elf.SHT_REL):
+        res = []
+        for i in range(nrelocs):
+            offset = (i*4) % (section_size-3)
+            sym = 1 + i % max(nsymbols, 1)
+            if wsize == 32:
+                res.append(struct.pack("<II", offset, (sym<<8)|1))
+            else:
+                res.append(struct.pack("<QQ", offset, (sym<<32)|1))
+        rel.sh.entsize = len(res[0])
+        rel.content = StrPatchwork(struct.pack("").join(res))
+    elf_set_offsets(e)
+    if e_type == elf.ET_REL:
+        return e.pack()
+    # Executable: sections are mapped at their file offset, in a unique
+    # PT_LOAD segment; the program header table is at the end of the file.
+    e = ELF(e.pack())
+    e.Ehdr.type = e_type
+    base = 0x08048000
+    addr = {}
+    for idx, s in enumerate(e.sh):
+        if s.sh.flags & elf.SHF_ALLOC:
+            s.sh.addr = base + s.sh.offset
+            addr[idx] = s.sh.addr
+    symtab = e.getsectionbytype(elf.SHT_SYMTAB)
+    symtab.content = symbols(addr)
+    e.Ehdr.entry = addr.get(text_idx[0], 0)
+    Phdr = { 32: elf.Phdr32, 64: elf.Phdr64 }[wsize]
+    e.Ehdr.phentsize = Phdr(parent=e.ph).bytelen
+    e.Ehdr.phnum = 1
+    e.Ehdr.phoff = max(e.Ehdr.shoff + e.Ehdr.shnum*e.Ehdr.shentsize,
+                       max([s.sh.offset+s.sh.size for s in e.sh]))
+    e.Ehdr.phoff = (e.Ehdr.phoff+7) & ~7
+    filesz = e.Ehdr.phoff + e.Ehdr.phentsize
+    ph = Phdr(parent=e.ph, type=elf.PT_LOAD, offset=0, vaddr=base,
+              paddr=base, filesz=filesz, memsz=filesz, flags=5, align=0x1000)
+    from elfesteem.elf_init import ProgramHeader
+    e.ph.phlist.append(ProgramHeader(e.ph, Phdr, ph.pack()))
+    return e.pack()
+
+def pe_file(nsections=1, ndlls=0, nimports=0, nexports=0, wsize=32,
+            section_size=0x200):
+    # PE with 'nsections' code sections, 'nimports' functions imported
+    # from 'ndlls' DLLs and 'nexports' exported functions
+    e = PE(wsize=wsize)
+    # Enough space in the headers for the list of all sections,
+    # including the sections created for imports and exports
+    size = (e.DOShdr.lfanew + e.NTsig.bytelen + e.COFFhdr.bytelen +
+            e.COFFhdr.sizeofoptionalheader +
+            (nsections+12)*pe.Shdr(parent=e.SHList).bytelen)
+    align = e.NThdr.filealignment
+    e.NThdr.sizeofheaders = max(e.NThdr.sizeofheaders,
+                                (size+align-1) & ~(align-1))
+    text = []
+    for i in range(nsections):
+        text.append(e.SHList.add_section(name='.t%d' % i,
+            data=code(section_size),
+            flags=pe.IMAGE_SCN_MEM_EXECUTE|pe.IMAGE_SCN_MEM_READ|
+                  pe.IMAGE_SCN_CNT_CODE))
+    if nsections:
+        e.Opthdr.AddressOfEntryPoint = text[0].addr
+    if nimports:
+        ndlls = max(ndlls, 1)
+        dlls = []
+        for d in range(ndlls):
+            funcs = ['func%d_%d' % (d, i)
+                     for i in range(d, nimports, ndlls)]
+            dlls.append(({'name': 'lib%d.dll' % d}, funcs))
+        e.DirImport.add_dlldesc(dlls)
+        e.DirImport.set_rva(None)
+    if nexports:
+        funcs = []
+        for i in range(nexports):
+            s = text[i % len(text)]
+            funcs.append(('f%08d' % i, s.addr + (i*4) % section_size))
+        e.DirExport.create(funcs)
+    return e.pack()
+
+def macho_file(nsections=1, nsymbols=0, nrelocs=0, wsize=32,
+               section_size=16):
+    # Mach-O relocatable object with 'nsections' sections in a unique
+    # segment, 'nsymbols' external symbols and 'nrelocs' relocations
+    # in the first section
+    if wsize == 32:
+        magic, cputype, lc_segment = (macho.MH_MAGIC, macho.CPU_TYPE_I386,
+                                      macho.LC_SEGMENT)
+        header_size, segment_size, section_hdr_size = 28, 56, 68
+        nlist_format = "<IBBHI"
+    else:
+        magic, cputype, lc_segment = (macho.MH_MAGIC_64,
+                                      macho.CPU_TYPE_X86_64,
+                                      macho.LC_SEGMENT_64)
+        header_size, segment_size, section_hdr_size = 32, 72, 80
+        nlist_format = "<IBBHQ"
+    cmdsize = segment_size + nsections*section_hdr_size
+    sizeofcmds = cmdsize + 24
+    data_offset = header_size + sizeofcmds
+    data_size = nsections*section_size
+    reloff = data_offset + data_size
+    symoff = reloff + nrelocs*8
+    nlist_size = struct.calcsize(nlist_format)
+    stroff = symoff + nsymbols*nlist_size
+    names, name_idx = strtab(symbol_names(nsymbols))
+    # Header
+    res = [struct.pack("<7I", magic, cputype, 3, macho.MH_OBJECT, 2,
+                       sizeofcmds, 0)]
+    if wsize == 64: res.append(struct.pack("<I", 0))
+    # Segment and its sections
+    if wsize == 32:
+        res.append(struct.pack("<II16sIIIIIIII", lc_segment, cmdsize,
+            struct.pack(""), 0, data_size, data_offset, data_size, 7, 7,
+            nsections, 0))
+    else:
+        res.append(struct.pack("<II16sQQQQIIII", lc_segment, cmdsize,
+            struct.pack(""), 0, data_size, data_offset, data_size, 7, 7,
+            nsections, 0))
+    for i in range(nsections):
+        sectname = ('__text%d' % i).encode('latin1')
+        segname = '__TEXT'.encode('latin1')
+        nreloc = 0
+        if i == 0: nreloc = nrelocs
+        flags = macho.S_ATTR_PURE_INSTRUCTIONS|macho.S_ATTR_SOME_INSTRUCTIONS
+        if wsize == 32:
+            res.append(struct.pack("<16s16sIIIIIIIII", sectname, segname,
+                i*section_size, section_size, data_offset+i*section_size,
+                0, reloff*(nreloc>0), nreloc, flags, 0, 0))
+        else:
+            res.append(struct.pack("<16s16sQQIIIIIIII", sectname, segname,
+                i*section_size, section_size, data_offset+i*section_size,
+                0, reloff*(nreloc>0), nreloc, flags, 0, 0, 0))
+    res.append(struct.pack("<6I", macho.LC_SYMTAB, 24,
+        symoff, nsymbols, stroff, len(names)))
+    # Content of the sections, relocations, symbols and strings
+    res.append(code(section_size)*nsections)
+    for i in range(nrelocs):
+        sym = i % max(nsymbols, 1)
+        # r_symbolnum, r_length = 2 (long), r_extern
+        res.append(struct.pack("<II", (i*4) % (section_size-3),
+                               sym | (2<<25) | (1<<27)))
+    n_sect = min(nsections, 255)
+    for i in range(nsymbols):
+        sect = i % n_sect
+        res.append(struct.pack(nlist_format, name_idx[i],
+            macho.N_SECT|macho.N_EXT, sect+1, 0,
+            sect*section_size + (i*4) % section_size))
+    res.append(names)
+    return struct.pack("").join(res)
+
+generators = {
+    'ELF':   elf_file,
+    'PE':    pe_file,
+    'MACHO': macho_file,
+    }
+
+def write_files(directory, scale):
+    # Writes in 'directory' some synthetic files whose size is
+    # proportional to 'scale'; returns the list of file names.
+    files = []
+    for name, f, kargs in (
+          ('elf_sections', elf_file, {'nsections': scale}),
+          ('elf_symbols',  elf_file, {'nsymbols': 10*scale}),
+          ('elf_relocs',   elf_file, {'nsymbols': scale,
+                                      'nrelocs': 100*scale}),
+          ('elf_exec',     elf_file, {'nsections': scale//10+1,
+                                      'nsymbols': scale,
+                                      'e_type': elf.ET_EXEC,
+                                      'wsize': 64}),
+          ('pe_imports',   pe_file,  {'ndlls': scale//100+1,
+                                      'nimports': scale}),
+          ('pe_exports',   pe_file,  {'nexports': scale}),
+          ('macho_sections', macho_file, {'nsections': scale}),
+          ('macho_symbols',  macho_file, {'nsymbols': 10*scale,
+                                          'nrelocs': 10*scale,
+                                          'wsize': 64}),
+          ):
+        path = os.path.join(directory, '%s_%d' % (name, scale))
+        out = open(path, 'wb')
+        out.write(f(**kargs))
+        out.close()
+        files.append(path)
+    return files
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Generator of large synthetic binaries')
+    parser.add_argument('-o', '--output', default='.',
+        help='output directory')
+    parser.add_argument('scale', type=int, nargs='+',
+        help='number of sections, symbols, imports, ... (times 1, 10 or 100)')
+    args = parser.parse_args(argv)
+    for scale in args.scale:
+        for path in write_files(args.output, scale):
+            print(path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
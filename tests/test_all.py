@@ -79,8 +79,10 @@ if __name__ == "__main__":
             'elf_manipulation',
             'macho_manipulation',
             'rprc_manipulation',
+            'ar_manipulation',
             'minidump_manipulation',
             'intervals',
+            'binary',
             ):
         module = import_by_name('test_' + name)
         print_colored.bold(name)
@@ -0,0 +1,124 @@
+#! /usr/bin/env python
+
+import os
+__dir__ = os.path.dirname(__file__)
+
+from test_all import run_tests, assertion
+from elfesteem.ar import AR, ARMAG
+from elfesteem import binary
+from elfesteem.strpatchwork import to_bytes, data_empty
+import struct
+
+def member(name, data):
+    # Header of 60 bytes and data aligned on 2 bytes
+    hdr = '%-16s%-12d%-6d%-6d%-8s%-10d`\n' % (name, 0, 0, 0, '100644',
+                                              len(data))
+    return hdr.encode('latin1') + data + '\n'.encode('latin1') * (len(data) & 1)
+
+def gnu_archive(objects, symbols):
+    # 'objects' is a list of (name, data), 'symbols' a list of (symbol,
+    # index of the object)
+    longnames = data_empty
+    names = []
+    for name, data in objects:
+        if len(name) < 16:
+            names.append(name + '/')
+        else:
+            names.append('/%d' % len(longnames))
+            longnames += name.encode('latin1') + '/\n'.encode('latin1')
+    strings = data_empty.join([(s+'\0').encode('latin1') for s, _ in symbols])
+    index_size = 4 + 4*len(symbols) + len(strings)
+    of = len(ARMAG) + 60 + index_size + (index_size & 1)
+    if longnames:
+        of += 60 + len(longnames) + (len(longnames) & 1)
+    offsets = []
+    for name, data in objects:
+        offsets.append(of)
+        of += 60 + len(data) + (len(data) & 1)
+    index = struct.pack('>I', len(symbols)) + data_empty.join(
+        [struct.pack('>I', offsets[i]) for _, i in symbols]) + strings
+    res = ARMAG + member('/', index)
+    if longnames:
+        res += member('//', longnames)
+    for (name, data), n in zip(objects, names):
+        res += member(n, data)
+    return res
+
+def test_AR_gnu(assertion):
+    obj = open(__dir__+'/binary_input/coff_mingw.obj', 'rb').read()
+    elf = open(__dir__+'/binary_input/elf_cpp.o', 'rb').read()
+    raw = gnu_archive([('coff_mingw.obj', obj),
+                       ('a_very_long_object_name.o', elf),
+                       ('README.txt', 'text'.encode('latin1'))],
+                      [('_main', 0), ('_Z3foov', 1)])
+    assertion(AR, binary.detect_format(raw), 'Detect ar archive')
+    e = AR(raw)
+    assertion(['coff_mingw.obj', 'a_very_long_object_name.o', 'README.txt'],
+              [m.name for m in e],
+              'GNU ar: member names')
+    assertion((obj, elf, 'text'.encode('latin1')),
+              (e[0].data, to_bytes(e[1].view()), e[2].data),
+              'GNU ar: member data')
+    assertion((e[0], e[1], None, ['_main', '_Z3foov']),
+              (e.member_of('_main'), e.member_of('_Z3foov'),
+               e.member_of('_foo'), [s.name for s in e.symbols]),
+              'GNU ar: symbol index')
+    assertion((None, None, None),
+              (e[0]._e, e[1]._e, e[2]._e),
+              'GNU ar: members not parsed')
+    assertion(('COFF', 'ELF', None, e[0].e),
+              (e[0].e.__class__.__name__, e[1].e.__class__.__name__,
+               e[2].e, e.getmember('coff_mingw.obj').e),
+              'GNU ar: members parsed when used')
+    b = binary.BINARY(raw)
+    assertion(('AR', 'I386', 2),
+              (b.container, b.architecture, len(b.symbols)),
+              'GNU ar: BINARY')
+
+def test_AR_microsoft(assertion):
+    # Two linker members, long names terminated by a null byte
+    obj = open(__dir__+'/binary_input/coff_mingw.obj', 'rb').read()
+    first = struct.pack('>II', 1, 0) + '_main\0'.encode('latin1')
+    second = struct.pack('<IIIH', 1, 0, 1, 1) + '_main\0'.encode('latin1')
+    longnames = 'a_long_name_for_a_lib.obj\0'.encode('latin1')
+    of = len(ARMAG + member('/', first) + member('/', second)
+             + member('//', longnames))
+    first = struct.pack('>II', 1, of) + '_main\0'.encode('latin1')
+    raw = ARMAG + member('/', first) + member('/', second) \
+        + member('//', longnames) + member('/0', obj)
+    e = AR(raw)
+    assertion((['a_long_name_for_a_lib.obj'], e[0], 'COFF'),
+              ([m.name for m in e], e.member_of('_main'),
+               e[0].e.__class__.__name__),
+              'Microsoft ar: members and symbol index')
+
+def bsd_member(name, data):
+    # Long name at the beginning of the data
+    name = name.encode('latin1')
+    name += '\0'.encode('latin1') * (-len(name) % 4)
+    return member('#1/%d' % len(name), name + data)
+
+def test_AR_bsd(assertion):
+    obj = open(__dir__+'/binary_input/macho/macho_64.o', 'rb').read()
+    strings = '_f\0_g\0'.encode('latin1')
+    symdef = lambda of: struct.pack('<IIIII', 16, 0, of, 3, of) \
+                      + struct.pack('<I', len(strings)) + strings
+    of = len(ARMAG + bsd_member('__.SYMDEF SORTED', symdef(0)))
+    raw = ARMAG + bsd_member('__.SYMDEF SORTED', symdef(of)) \
+        + bsd_member('a_long_object_name_for_bsd.o', obj)
+    e = AR(raw)
+    assertion((['a_long_object_name_for_bsd.o'], obj, of),
+              ([m.name for m in e], e[0].data, e[0].offset),
+              'BSD ar: members')
+    assertion((['_f', '_g'], e[0], 'MACHO'),
+              ([s.name for s in e.symbols], e.member_of('_g'),
+               e[0].e.__class__.__name__),
+              'BSD ar: symbol index')
+
+def run_test(assertion):
+    for name, value in dict(globals()).items():
+        if name.startswith('test_'):
+            value(assertion)
+
+if __name__ == "__main__":
+    run_tests(run_test)
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+
+import os
+__dir__ = os.path.dirname(__file__)
+
+from test_all import run_tests, assertion
+from elfesteem import binary
+try:
+    from elfesteem import scanner
+except ImportError:
+    # Python older than 2.6, without json: the scanner and the cache
+    # are not tested
+    scanner = None
+import struct, tempfile, shutil
+
+def test_BINARY_detect(assertion):
+    for name, container in (
+            ('elf_small.out',                   'ELF'),
+            ('pe_mingw.exe',                    'PE'),
+            ('Ange/d_tiny.dll',                 'PE'),
+            ('coff_mingw.obj',                  'COFF'),
+            ('cku196.clix-3.1',                 'COFF'),
+            ('cku192.irix40',                   'COFF'),
+            ('C28346_Load_Program_to_Flash.out','COFF'),
+            ('macho/macho_fat.out',             'MACHO'),
+            ('macho/macho_64.o',                'MACHO'),
+            ('minidump-i386.dmp',               'Minidump'),
+            ('README.txt',                      None),
+            ):
+        raw = open(__dir__+'/binary_input/'+name, 'rb').read()
+        c = binary.detect_format(raw)
+        if c is not None: c = c.__name__
+        assertion(container, c, 'Detect format of %s' % name)
+    e = binary.BINARY(open(__dir__+'/binary_input/README.txt', 'rb').read())
+    assertion('UnknownFormat', e.container, 'Unknown format')
+    # A DOS executable is not a PE
+    raw = struct.pack("<30HI", *([0x5a4d]+[0]*29+[0x40])) + 4*struct.pack("B",0)
+    assertion(None, binary.detect_format(raw), 'DOS executable')
+
+def test_BINARY_invalid(assertion):
+    # The format is recognized, the parsing error is not hidden
+    raw = open(__dir__+'/binary_input/coff_mingw.obj', 'rb').read()
+    raw = raw[:2] + struct.pack("<H", 0) + raw[4:]
+    try:
+        binary.BINARY(raw)
+        assertion(0,1, 'COFF cannot have no section')
+    except ValueError:
+        pass
+
+def test_BINARY_register(assertion):
+    class Dummy(object):
+        def __init__(self, raw):
+            self.raw = raw
+    sniff = lambda raw: raw[:5] == struct.pack("5B", 0x44,0x55,0x4d,0x4d,0x59)
+    binary.register_format(sniff, Dummy, before=binary.ELF)
+    assertion(Dummy, binary.formats[0][1], 'New format tested first')
+    e = binary.BINARY(struct.pack("5B", 0x44,0x55,0x4d,0x4d,0x59))
+    assertion('Dummy', e.container, 'New format is detected')
+    del binary.formats[0]
+
+def test_SCAN_summary(assertion):
+    if scanner is None:
+        return
+    d = scanner.scan_file(__dir__+'/binary_input/pe_vstudio.dll')
+    assertion(('PE', 'I386', 8, 0),
+              (d['container'], d['architecture'], len(d['sections']),
+               d['symbols']),
+              'Scanner: summary of a PE')
+    assertion(['KERNEL32.dll', 'VCRUNTIME140D.dll', 'ucrtbased.dll'],
+              sorted(d['imports'].keys()),
+              'Scanner: imported DLLs')
+    assertion('6B75C8D3D15A4688B9916E1A1CE41D3818', d['pdb']['id'],
+              'Scanner: PDB')
+    d = scanner.scan_file(__dir__+'/binary_input/elf64_small.out')
+    assertion(['libc.so.6'], d['imports'], 'Scanner: needed libraries')
+    assertion('dc21d928bb6a3a0fa59b17fafe803d50',
+              d['md5'],
+              'Scanner: hashes')
+    d = scanner.scan_file(__dir__+'/binary_input/macho/macho_fat.out')
+    assertion((['X86', 'X86_64'], [['/usr/lib/libSystem.B.dylib']]*2, False),
+              (d['architecture'], d['imports'], 'errors' in d),
+              'Scanner: imports of a Mach-O fat file')
+    d = scanner.scan_file(__dir__+'/binary_input/no_such_file')
+    assertion(['error', 'file'], sorted(d.keys()), 'Scanner: error')
+    d = {}
+    assertion((None, {'imports': "KeyError: 'DT_NEEDED'"}),
+              (scanner._get(lambda: {}['DT_NEEDED'], d, 'imports'),
+               d.get('errors')),
+              'Scanner: parse error recorded in the summary')
+
+def test_SCAN_corpus(assertion):
+    if scanner is None:
+        return
+    files = [_ for _ in scanner.iter_files([__dir__+'/binary_input/Ange'])]
+    res = [_ for _ in scanner.scan([__dir__+'/binary_input/Ange'],
+                                   jobs=1, chunksize=5)]
+    assertion(files, [_['file'] for _ in res], 'Scanner: sequential scan')
+    res = [_ for _ in scanner.scan([__dir__+'/binary_input/Ange'],
+                                   jobs=2, chunksize=3, pending=1)]
+    assertion(sorted(files), sorted([_['file'] for _ in res]),
+              'Scanner: parallel scan')
+
+def test_CACHE(assertion):
+    if scanner is None:
+        return
+    from elfesteem import cache
+    if cache.sqlite3 is None:
+        return
+    tmp = tempfile.mkdtemp()
+    try:
+        c = cache.ParseCache(os.path.join(tmp, 'cache.db'))
+        raw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
+        key = c.key(raw)
+        assertion(False, key in c, 'Cache: initially empty')
+        d = c.get(raw)
+        assertion(True, key in c, 'Cache: record stored')
+        assertion(d, c.get(raw), 'Cache: record read')
+        assertion(140, len(d['symbol_index']), 'Cache: symbol index')
+        assertion([[4096, 4096+0xa00, '.text']], d['address_map'][:1],
+                  'Cache: address map')
+        c.close()
+        # Persistent
+        c = cache.ParseCache(os.path.join(tmp, 'cache.db'), max_size=1)
+        assertion(1, len(c), 'Cache: persistent')
+        # Eviction of the least recently used record
+        c.max_size = c.size()
+        raw2 = open(__dir__+'/binary_input/elf64_small.out', 'rb').read()
+        d = c.get(raw2)
+        assertion(['libc.so.6'], d['imports'], 'Cache: ELF record')
+        assertion((False, True), (key in c, c.key(raw2) in c),
+                  'Cache: LRU eviction')
+        c.close()
+        res = [_ for _ in scanner.scan([__dir__+'/binary_input/Ange'],
+                       jobs=1, cache_path=os.path.join(tmp, 'cache.db'))]
+        assertion(len(res), len([_ for _ in res if 'address_map' in _
+                                                  or 'error' in _]),
+                  'Cache: used by the scanner')
+    finally:
+        shutil.rmtree(tmp)
+
+def test_SYNTHETIC(assertion):
+    import synthetic
+    from elfesteem import elf
+    for f, kargs, container, counts in (
+            (synthetic.elf_file, {'nsections': 20, 'nsymbols': 100,
+                                  'nrelocs': 300},
+             'ELF', (25, 101)),
+            (synthetic.elf_file, {'nsections': 3, 'nsymbols': 10,
+                                  'e_type': elf.ET_EXEC, 'wsize': 64},
+             'ELF', (7, 11)),
+            (synthetic.pe_file, {'nsections': 5, 'ndlls': 3,
+                                 'nimports': 100, 'nexports': 50},
+             'PE', (7, 0)),
+            (synthetic.macho_file, {'nsections': 20, 'nsymbols': 100,
+                                    'nrelocs': 300},
+             'MACHO', (23, 100)),
+            (synthetic.macho_file, {'nsymbols': 10, 'wsize': 64},
+             'MACHO', (3, 10)),
+            ):
+        raw = f(**kargs)
+        e = binary.BINARY(raw)
+        assertion((container, counts),
+                  (e.container, (len(e.sections), len(e.symbols))),
+                  'Synthetic %s %r' % (container, kargs))
+        assertion(raw, e.e.pack(),
+                  'Synthetic %s %r: fix point' % (container, kargs))
+    e = binary.BINARY(synthetic.pe_file(ndlls=3, nimports=100, nexports=50))
+    assertion([34, 33, 33], [len(d.IAT) for d in e.e.DirImport],
+              'Synthetic PE: imports')
+    assertion(100, len(e.e.export_funcs()), 'Synthetic PE: exports')
+
+def run_test(assertion):
+    for name, value in dict(globals()).items():
+        if name.startswith('test_'):
+            value(assertion)
+
+if __name__ == "__main__":
+    run_tests(run_test)
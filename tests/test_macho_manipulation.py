@@ -282,6 +282,24 @@ def test_MACHO_fat(assertion):
               log_history,
               'Cannot set entrypoint directly in a fat Mach-O (logs)')
     log_history = []
+    # Architectures are parsed when used
+    e = MACHO(macho_fat)
+    assertion((['X86', 'X86_64'], [False, False]),
+              (e.architecture, [e.arch.is_parsed(i) for i in range(2)]),
+              'Architectures of a fat Mach-O, not parsed')
+    a = e.arch_for(macho.CPU_TYPE_X86_64, macho.CPU_SUBTYPE_X86_64_ALL)
+    assertion((macho.CPU_TYPE_X86_64, [False, True], True),
+              (a.Mhdr.cputype, [e.arch.is_parsed(i) for i in range(2)],
+               a is e.arch[1]),
+              'Select an architecture of a fat Mach-O')
+    assertion((None, None, a),
+              (e.arch_for(macho.CPU_TYPE_ARM),
+               e.arch_for(macho.CPU_TYPE_X86_64, macho.CPU_SUBTYPE_X86_64_H),
+               a.arch_for(macho.CPU_TYPE_X86_64)),
+              'Select an architecture (not found, not fat)')
+    assertion(macho_fat_hash,
+              hashlib.md5(e.pack()).hexdigest(),
+              'Packing a fat Mach-O with architectures not parsed')
 
 def test_MACHO_virt(assertion):
     macho_32 = open(__dir__+'macho_32.out', 'rb').read()
@@ -416,7 +434,10 @@ def test_MACHO_lib_tls(assertion):
 def test_MACHO_app_OSXII(assertion):
     global log_history
     macho_app = open(__dir__+'OSXII', 'rb').read()
-    e = MACHO(macho_app)
+    e = MACHO(macho_app, slice_intervals=True)
+    assertion([], log_history,
+              'Parsing OSXII app, architectures parsed when used (logs)')
+    e.arch.macholist
     assertion([('warn', ('parse_dynamic_symbols() can only be used with x86 architectures, not %s', 18), {})],
               log_history,
               'Parsing OSXII app (logs)')
@@ -454,7 +475,10 @@ def test_MACHO_app_MTR(assertion):
 def test_MACHO_exe_SH3D(assertion):
     global log_history
     macho_app = open(__dir__+'SweetHome3D', 'rb').read()
-    e = MACHO(macho_app)
+    e = MACHO(macho_app, slice_intervals=True)
+    assertion([], log_history,
+              'Parsing SweetHome3D app, architectures parsed when used (logs)')
+    e.arch.macholist
     assertion([('warn', ('parse_dynamic_symbols() can only be used with x86 architectures, not %s', 18), {})],
               log_history,
               'Parsing SweetHome3D app (logs)')
@@ -490,7 +514,10 @@ def test_MACHO_lib_print(assertion):
 def test_MACHO_ios_decibels(assertion):
     global log_history
     macho_ios = open(__dir__+'Decibels', 'rb').read()
-    e = MACHO(macho_ios)
+    e = MACHO(macho_ios, slice_intervals=True)
+    assertion([], log_history,
+              'Parsing Decibels iOS app, architectures parsed when used (logs)')
+    e.arch.macholist
     assertion([('warn', ('Some encrypted text is not parsed with the section headers of LC_SEGMENT(__TEXT)',), {}),
                ('warn', ('parse_dynamic_symbols() can only be used with x86 architectures, not %s', 12), {}),
                ('warn', ('Part of the file was not parsed: %d bytes', 2499), {}),
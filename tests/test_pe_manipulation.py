@@ -5,9 +5,10 @@ __dir__ = os.path.dirname(__file__)
 
 from test_all import run_tests, assertion, hashlib
 from elfesteem.pe_init import log, PE, COFF, Coff
-from elfesteem.strpatchwork import StrPatchwork
+from elfesteem.strpatchwork import StrPatchwork, to_bytes
+from elfesteem.strpatchwork import data_empty, data_null
 from elfesteem import pe
-import struct
+import struct, array, sys
 
 # We want to be able to verify warnings in non-regression test
 log_history = []
@@ -52,17 +53,16 @@ def test_PE_manipulate(assertion):
     global log_history
     pe_mingw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
     e = PE(pe_mingw)
-    # Packed file is not identical :-(
-    # Are missing:
-    # - the data between the end of DOS header and the start of PE header
-    # - the padding after the list of sections, before the first section
-    # - many parts of directories
+    # Packed file is identical: the parts of the headers that are not
+    # parsed (DOS program, padding after the list of sections) are
+    # copied from the input file
     d = e.pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Packing after reading pe_mingw.exe')
+    assertion(pe_mingw, d, 'Packing after reading pe_mingw.exe; identical')
     d = PE(d).pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Packing after reading pe_mingw.exe; fix point')
     d = e.SHList.display().encode('latin1')
@@ -136,22 +136,22 @@ def test_PE_manipulate(assertion):
               'Extract chunk from mapped memory, old API')
     e[0x100:0x120] = e[0x100:0x120]
     d = e.pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Writing in raw data')
     e.rva.set(0x1100, e.virt[0x401100:0x401120])
     d = e.pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Writing at RVA')
     e.virt[0x401100:0x401120] = e.virt[0x401100:0x401120]
     d = e.pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Writing in memory (interval)')
     e.virt[0x401100] = e.virt[0x401100:0x401120]
     d = e.pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Writing in memory (address)')
     e.virt[0x400100:0x400120] = e.virt[0x400100:0x400120]
@@ -173,7 +173,7 @@ def test_PE_manipulate(assertion):
               'Find pattern (from the end)')
     e.SHList.align_sections()
     d = e.pack()
-    assertion('2f08b8315c4e0a30d51a8decf104345c',
+    assertion('9fff6165afeafd3495cc695239f2526b',
               hashlib.md5(d).hexdigest(),
               'Align sections')
     # Remove Bound Import directory
@@ -187,11 +187,11 @@ def test_PE_manipulate(assertion):
     s_test  = e.SHList.add_section(name = "test",  size = 0x1000)
     s_rel   = e.SHList.add_section(name = "rel",   size = 0x5000)
     d = e.pack()
-    assertion('439f6c698d3d5238d88c5ccef99761e2',
+    assertion('a7102b9f491e6b497eff138a86e90f6a',
               hashlib.md5(d).hexdigest(),
               'Adding sections')
     d = PE(d).pack()
-    assertion('439f6c698d3d5238d88c5ccef99761e2',
+    assertion('a7102b9f491e6b497eff138a86e90f6a',
               hashlib.md5(d).hexdigest(),
               'Adding sections; fix point')
     e = PE(pe_mingw)
@@ -231,7 +231,7 @@ def test_PE_manipulate(assertion):
               e.DirExport.get_funcvirt('SetUserGeoID'),
               'Export SetUserGeoID')
     d = e.pack()
-    assertion('8a3a1c8c9aa2db211e1d34c7efbb8473',
+    assertion('5bf5496788e4da65b45d0e9e40ea96b7',
               hashlib.md5(d).hexdigest(),
               'Adding new imports')
     d = PE(d).pack()
@@ -239,7 +239,7 @@ def test_PE_manipulate(assertion):
               log_history,
               'Adding new imports (logs)')
     log_history = []
-    assertion('8a3a1c8c9aa2db211e1d34c7efbb8473',
+    assertion('5bf5496788e4da65b45d0e9e40ea96b7',
               hashlib.md5(d).hexdigest(),
               'Adding new imports; fix point')
     # Add an export
@@ -253,7 +253,7 @@ def test_PE_manipulate(assertion):
               e.export_funcs(),
               'Export: export_funcs')
     d = e.pack()
-    assertion('47a864481296d88f908126fb822ded59',
+    assertion('8e1b5bddc5110d28a38675b8ec34ecfe',
               hashlib.md5(d).hexdigest(),
               'Adding new exports')
     d = PE(d).pack()
@@ -261,23 +261,200 @@ def test_PE_manipulate(assertion):
               log_history,
               'Adding new exports (logs)')
     log_history = []
-    assertion('47a864481296d88f908126fb822ded59',
+    assertion('8e1b5bddc5110d28a38675b8ec34ecfe',
               hashlib.md5(d).hexdigest(),
               'Adding new exports; fix point')
     # Add a new Descriptor in the Import Directory
     e.DirImport.add_dlldesc([ ({"name":"MyDLL.dll"}, ["MyFunc"]) ])
     e.DirImport.set_rva(None)
-    assertion('47a864481296d88f908126fb822ded59',
+    assertion('8e1b5bddc5110d28a38675b8ec34ecfe',
               hashlib.md5(d).hexdigest(),
               'Adding imports, no specified section')
 
+def test_PE_import_builder(assertion):
+    e = PE()
+    e.SHList.add_section(name='.text', rawsize=0x1000)
+    e.DirImport.add_dlldesc([
+        ({'name': 'a.dll'}, ['f%d' % i for i in range(100)] + ['shared']),
+        ({'name': 'b.dll'}, ['shared', 'g']),
+        ])
+    e.DirImport.set_rva(None)
+    d = e.DirImport[1]
+    assertion((False, ['shared', 'g']),
+              ('IAT' in d.__dict__, [t.name for t in d.IAT]),
+              'Import builder: thunks made when used')
+    assertion(e.DirImport[0].IAT[100].rva, d.IAT[0].rva,
+              'Import builder: hint/name shared')
+    f = PE(e.pack())
+    assertion([('a.dll', ['f%d' % i for i in range(100)] + ['shared']),
+               ('b.dll', ['shared', 'g'])],
+              [(str(d.name), [t.name for t in d.IAT]) for d in f.DirImport],
+              'Import builder: parsing of the result')
+    assertion((e.DirImport.get_funcrva('b.dll', 'g'),
+               e.DirImport[1].originalfirstthunk),
+              (f.DirImport.get_funcrva('b.dll', 'g'),
+               f.DirImport[1].originalfirstthunk),
+              'Import builder: RVA')
+
+def test_PE_shared_sections(assertion):
+    # Section data is shared with the file content until modified
+    raw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
+    e = PE(raw)
+    assertion([True]*len(e.SHList),
+              [s.section_data.data.is_shared() for s in e.SHList],
+              'Shared section data')
+    s = e.SHList[0]
+    cc = struct.pack('B', 0xcc)
+    e.rva[s.vaddr] = cc
+    assertion((False, True, True, cc, raw[s.scnptr:s.scnptr+1]),
+              (s.section_data.data.is_shared(),
+               e.SHList[1].section_data.data.is_shared(),
+               e._content.is_shared(),
+               s.section_data.data[0:1],
+               e._content[s.scnptr:s.scnptr+1]),
+              'Copy on write of section data')
+    # Same results for a shared and for a modified StrPatchwork
+    shared = StrPatchwork('--abcdefab--'.encode('latin1')).share(2, 10)
+    copied = StrPatchwork('abcdefab'.encode('latin1'))
+    copied[0] = 'a'
+    for args in ((slice(1, 3),), (slice(6, 12),), (slice(10, 12),),
+                 (slice(-3, None),), (slice(None, -6),), (9,), (-1,)):
+        assertion(copied.__getitem__(*args), shared.__getitem__(*args),
+                  'Shared StrPatchwork: getitem %r' % args)
+    ab = 'ab'.encode('latin1')
+    for args in ((ab,), (ab, 1), (ab, 1, 7), (ab, -3), (data_empty, 9)):
+        assertion((copied.find(*args), copied.rfind(*args)),
+                  (shared.find(*args), shared.rfind(*args)),
+                  'Shared StrPatchwork: find %r' % (args,))
+    assertion(('abcdefab'.encode('latin1'), 8, True),
+              (shared.pack(), len(shared), shared.is_shared()),
+              'Shared StrPatchwork: not modified')
+
+def test_PE_overlay(assertion):
+    # Data after the sections, with a certificate table
+    raw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
+    e = PE(raw)
+    assertion((None, data_empty, None, data_empty),
+              (e.overlay_offset, to_bytes(e.overlay),
+               e.certificates_offset, to_bytes(e.certificates)),
+              'No overlay')
+    of = len(raw)
+    overlay = 'OVERLAY!'.encode('latin1')
+    cert = struct.pack('<IHH', 16, 0x200, 2) + 'CERT'.encode('latin1')*2
+    e.NThdr.optentries[pe.DIRECTORY_ENTRY_SECURITY].rva = of + 8
+    e.NThdr.optentries[pe.DIRECTORY_ENTRY_SECURITY].size = len(cert)
+    # The checksum is updated when packed
+    raw = PE(e.pack() + overlay + cert).pack()
+    e = PE(raw)
+    assertion((of, overlay+cert, of+8, cert),
+              (e.overlay_offset, to_bytes(e.overlay),
+               e.certificates_offset, to_bytes(e.certificates)),
+              'Overlay and certificate table')
+    assertion(raw, e.pack(), 'Overlay kept at its offset')
+    e.SHList.add_section(name = 'new', rawsize = 0x1000)
+    d = e.pack()
+    e = PE(d)
+    assertion((overlay+cert, cert, d[-len(cert):]),
+              (to_bytes(e.overlay), to_bytes(e.certificates),
+               d[e.certificates_offset:e.certificates_offset+len(cert)]),
+              'Overlay and certificate table moved')
+
+def test_PE_finditer(assertion):
+    # Search of several patterns at once
+    e = PE(open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read())
+    patterns = [struct.pack('BB', 0xc9, 0xc3), struct.pack('B', 0xc9),
+                struct.pack('BBB', 0x55, 0x89, 0xe5),
+                struct.pack('BB', 0xc9, 0xc3)]
+    found = list(e.virt.finditer(patterns))
+    assertion((105, [(0x401000, 2), (0x401051, 1)]),
+              (len(found), found[:2]),
+              'Find several patterns')
+    assertion(e.virt.find(patterns[2]), found[0][0],
+              'Find several patterns (same result as find)')
+    assertion([(0x401294, 1), (0x401294, 0), (0x401294, 3)],
+              list(e.virt.finditer(patterns, 0x401290, 0x4012a0)),
+              'Find several patterns (prefixes, range)')
+    assertion([(0x401294, 'leave')],
+              list(e.virt.finditer({'leave': patterns[1]},
+                                   0x401290, 0x4012a0)),
+              'Find several patterns (dict)')
+    # Patterns across the end of a section
+    e = PE()
+    patterns = [_.encode('latin1') for _ in ('SPAN', 'PAN', 'SPA')]
+    e.SHList.add_section(name = 'a', data = struct.pack('B',0)*0xffd+patterns[2])
+    e.SHList.add_section(name = 'b', data = patterns[0][3:]+struct.pack('B',0)*0xfff)
+    assertion([(0x401ffd, 2)],
+              list(e.virt.finditer(patterns)),
+              'Find several patterns (in sections)')
+    assertion([(0x401ffd, 2), (0x401ffd, 0), (0x401ffe, 1)],
+              list(e.virt.finditer(patterns, span=True)),
+              'Find several patterns (across sections)')
+
+def test_PE_save_inplace(assertion):
+    # Only the modified bytes are written
+    import tempfile, shutil
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'pe_vstudio.dll')
+        shutil.copy(__dir__+'/binary_input/pe_vstudio.dll', path)
+        e = PE(open(path, 'rb').read())
+        s = e.getsectionbyname('.text')
+        e.rva[s.vaddr+0x10] = struct.pack('BB', 0xcc, 0xcc)
+        e.NThdr.majoroperatingsystemversion = 6
+        res = e.save_inplace(path, verify=True)
+        d = open(path, 'rb').read()
+        assertion(e.pack(), d, 'In-place save: same as pack')
+        off = e.checksum_offset()
+        assertion([(s.scnptr+0x10, 2), (off, 4)], res,
+                  'In-place save: modified ranges')
+        assertion(True, PE(d).verify_checksum(),
+                  'In-place save: checksum')
+        assertion([], PE(d).save_inplace(path, verify=True),
+                  'In-place save: nothing written if not modified')
+        # A new section modifies the layout: the whole file is written
+        e = PE(d)
+        e.SHList.add_section(name = 'new', rawsize = 0x1000)
+        res = e.save_inplace(path)
+        d = open(path, 'rb').read()
+        assertion(([(0, len(d))], e.pack()), (res, d),
+                  'In-place save: new layout')
+    finally:
+        shutil.rmtree(tmp)
+
+def test_PE_debug(assertion):
+    e = PE(open(__dir__+'/binary_input/pe_vstudio.dll', 'rb').read())
+    assertion(False, e.is_parsed('DirDebug'), 'Debug directory not parsed')
+    cv = e.DirDebug.codeview
+    assertion(('6B75C8D3-D15A-4688-B991-6E1A1CE41D38', 24,
+               '6B75C8D3D15A4688B9916E1A1CE41D3818'),
+              (cv.guid, cv.age, cv.pdb_id),
+              'CodeView RSDS')
+    assertion('MyLib.pdb', cv.path.split('\\')[-1], 'CodeView PDB path')
+    assertion((False, False, False),
+              (e.is_parsed('DirImport'), e.is_parsed('DirExport'),
+               e.is_parsed('DirRes')),
+              'Debug directory parsed alone')
+    assertion(['CODEVIEW', 'VC_FEATURE'],
+              [d.typename for d in e.DirDebug],
+              'Debug directory entries')
+    d = e.DirDebug.getbytype(pe.IMAGE_DEBUG_TYPE_VC_FEATURE)[0]
+    assertion((0, 31, 31, 3, 28),
+              (d.info.prevc11, d.info.ccpp, d.info.gs, d.info.sdl,
+               d.info.guardn),
+              'Debug VC_FEATURE')
+    assertion('RSDS'.encode('latin1'), to_bytes(e.DirDebug[0].view()[:4]),
+              'Debug data view')
+    e = PE(open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read())
+    assertion((0, None), (len(e.DirDebug), e.DirDebug.codeview),
+              'No debug directory')
+
 def test_PE_dll(assertion):
     global log_history
     # Small DLL created with Visual Studio
     dll_vstudio = open(__dir__+'/binary_input/pe_vstudio.dll', 'rb').read()
     e = PE(dll_vstudio)
     d = e.pack()
-    assertion('19028e1a1bde785fb4a58aeacf56007b',
+    assertion('05c2641141b5c06a3e97defbeadfbcb1',
               hashlib.md5(d).hexdigest(),
               'Packing after reading pe_vstudio.dll')
     # Test the display() functions
@@ -303,10 +480,409 @@ def test_PE_dll(assertion):
               hashlib.md5(d).hexdigest(),
               'Display all relocations')
 
+def test_PE_section_index(assertion):
+    def linear_rva(e, rva):
+        for s in e.SHList.shlist:
+            if s.vaddr <= rva < s.vaddr+s.size:
+                return s
+        return None
+    def linear_off(e, off):
+        for s in e.SHList.shlist:
+            if s.scnptr <= off < s.scnptr+s.rsize:
+                return s
+        return None
+    for name in ('pe_mingw.exe', 'pe_vstudio.dll', 'coff_mingw.obj'):
+        raw = open(__dir__+'/binary_input/'+name, 'rb').read()
+        if name.endswith('.obj'): e = Coff(raw)
+        else:                     e = PE(raw)
+        points = [0, 0x1000, len(raw), 0x100000]
+        for s in e.SHList:
+            for v in (s.vaddr, s.scnptr):
+                points.extend([v-1, v, v+0x10])
+            points.extend([s.vaddr+s.size-1, s.vaddr+s.size,
+                           s.scnptr+s.rsize-1, s.scnptr+s.rsize])
+        assertion([linear_rva(e, _) for _ in points],
+                  [e.getsectionbyrva(_) for _ in points],
+                  'Section index by RVA for %s' % name)
+        assertion([linear_off(e, _) for _ in points],
+                  [e.getsectionbyoff(_) for _ in points],
+                  'Section index by offset for %s' % name)
+    # The index is updated when sections are modified
+    e = PE(open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read())
+    s = e.SHList[1]
+    assertion(s, e.getsectionbyrva(s.vaddr), 'Section index before update')
+    s.vaddr += 0x100000
+    assertion((None, s), (e.getsectionbyrva(s.vaddr-0x100000),
+                          e.getsectionbyrva(s.vaddr)),
+              'Section index after update of vaddr')
+    e = PE()
+    assertion(None, e.getsectionbyrva(0x1000), 'Section index, no section')
+    s = e.SHList.add_section(name = 'new', rawsize = 0x1000)
+    assertion(s, e.getsectionbyrva(0x1000), 'Section index, new section')
+    del e.SHList._array[-1]
+    assertion(None, e.getsectionbyrva(0x1000), 'Section index, deletion')
+
+def test_PE_shared_imports(assertion):
+    global log_history
+    # Many import descriptors pointing to the same IAT and ILT, as in
+    # some fuzzed files; the thunks are parsed only once.
+    import synthetic
+    e = PE(synthetic.pe_file(ndlls=1, nimports=50))
+    d = e.NThdr.optentries[pe.DIRECTORY_ENTRY_IMPORT]
+    off = e.rva2off(d.rva)
+    desc = e.content[off:off+20]
+    s = e.SHList.add_section(name='dup', data=desc*100+struct.pack("20x"))
+    d.rva = s.vaddr
+    e = PE(e.pack())
+    log_history = []
+    assertion((100, [50]*100),
+              (len(e.DirImport), [len(_.IAT) for _ in e.DirImport]),
+              'Shared import thunks')
+    d0, d1 = e.DirImport[0], e.DirImport[1]
+    assertion((False, True, False, d1.IAT),
+              (d0.IAT[7] is d1.IAT[7], d0.IAT[7].obj is d1.ILT[7].obj,
+               d0.IAT is d1.IAT, d1.IAT[7].parent),
+              'Shared import thunks: names are shared, not thunks')
+    rva = d1.IAT[0].rva
+    d0.IAT[0].rva = 0x1234
+    assertion((0x1234, rva), (d0.IAT[0].rva, d1.IAT[0].rva),
+              'Shared import thunks: modified independently')
+    assertion(('func0_7', d0.IAT[7].obj),
+              (d1.ILT[7].name, d0.ILT[7].obj),
+              'Shared import names')
+
+def test_PE_lazy_directories(assertion):
+    # Directories are parsed when first used
+    raw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
+    e = PE(raw)
+    assertion((False, False, False),
+              (e.is_parsed('DirImport'), e.is_parsed('DirRes'),
+               e.is_parsed('Symbols')),
+              'Lazy directories: not parsed')
+    assertion(['KERNEL32.dll', 'msvcrt.dll'],
+              [str(_.name) for _ in e.DirImport],
+              'Lazy directories: DirImport')
+    assertion((True, False),
+              (e.is_parsed('DirImport'), e.is_parsed('DirExport')),
+              'Lazy directories: only DirImport is parsed')
+    # Pending directories are parsed before the sections are modified
+    e = PE(raw)
+    imports = PE(raw).DirImport.display()
+    e.SHList[4].vaddr += 0x1000
+    assertion(True, e.is_parsed('DirImport'),
+              'Lazy directories: parsed before modification of sections')
+    assertion(imports, e.DirImport.display(),
+              'Lazy directories: parsed with the original sections')
+    # Unused symbol tables are copied verbatim
+    e = PE(raw)
+    d = e.pack()
+    assertion(False, e.is_parsed('Symbols'),
+              'Lazy symbols: not parsed by pack')
+    e = PE(raw)
+    e.parse_pending()
+    assertion(e.pack(), d, 'Lazy symbols: same output')
+    # A parsing error is raised again by the next access
+    e = PE(raw)
+    def parse():
+        raise ValueError('Invalid directory')
+    e._pending['DirImport'] = parse
+    errors = []
+    for _ in range(2):
+        try:
+            e.DirImport
+        except ValueError:
+            errors.append(str(sys.exc_info()[1]))
+    assertion(['Invalid directory']*2, errors,
+              'Lazy directories: parsing error raised at each access')
+
+def test_PE_write_journal(assertion):
+    # Writes by virtual address are recorded, and applied to the file
+    # content when it is used
+    e = PE(open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read())
+    text = e.getsectionbyname('.text')
+    abcd, efgh = [_.encode('latin1') for _ in ('ABCD', 'EFGH')]
+    for i in range(100):
+        e.virt[e.rva2virt(text.vaddr+0x10+i)] = struct.pack('B', i)
+    e.virt[e.rva2virt(text.vaddr+0x20)] = abcd
+    assertion(101, len(e._journal), 'Write journal: writes are recorded')
+    data = struct.pack('16B', *range(16)) + abcd + \
+           struct.pack('80B', *range(20, 100))
+    assertion(data, e.virt[e.rva2virt(text.vaddr+0x10):
+                           e.rva2virt(text.vaddr+0x74)],
+              'Write journal: section data')
+    content = e.content
+    assertion((data, True), (e[text.scnptr+0x10:text.scnptr+0x74],
+                             isinstance(content, StrPatchwork)),
+              'Write journal: file content')
+    assertion(0, len(e._journal), 'Write journal: applied')
+    e.virt[e.rva2virt(text.vaddr+0x10)] = efgh
+    d = e.pack()
+    assertion((efgh, efgh, True),
+              (d[text.scnptr+0x10:text.scnptr+0x14],
+               e[text.scnptr+0x10:text.scnptr+0x14], e.content is content),
+              'Write journal: applied by pack, in place')
+
+def test_PE_checksum(assertion):
+    e = PE(open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read())
+    assertion(True, e.verify_checksum(), 'Checksum of the input file')
+    e.NThdr.CheckSum += 1
+    assertion(False, e.verify_checksum(), 'Checksum not verified')
+    e = PE(e.pack())
+    assertion(True, e.verify_checksum(), 'Checksum computed by pack')
+    # Incremental update, for patches at odd or even offsets, of odd
+    # or even length
+    for off, data in ((0x401, struct.pack('B', 0x12)),
+                      (0x402, struct.pack('BB', 0x12, 0x34)),
+                      (0x403, struct.pack('BB', 0x12, 0x34)),
+                      (0x410, struct.pack('B', 0xff)*7),
+                      (0x1000, struct.pack('<I', 0))):
+        old = e[off:off+len(data)]
+        e[off] = data
+        e.update_checksum(off, old, data)
+        assertion(True, e.verify_checksum(),
+                  'Checksum updated for %d bytes at %#x' % (len(data), off))
+    e[e.checksum_offset()] = struct.pack('<I', e.NThdr.CheckSum)
+    assertion(True, PE(e.content.pack()).verify_checksum(),
+              'Checksum updated as computed on the whole file')
+
+def test_PE_digests(assertion):
+    from elfesteem import pe_init
+    if pe_init.hashlib is None:
+        # Python older than 2.5
+        return
+    raw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
+    e = PE(raw)
+    assertion('990fa6b86d52aa1482b21e0f0766f228', e.imphash(),
+              'Imphash (same value as pefile)')
+    assertion([('.text', hashlib.md5(raw[0x400:0xe00]).hexdigest()),
+               ('.data', hashlib.md5(raw[0xe00:0x1000]).hexdigest())],
+              e.section_digests('md5')[:2],
+              'Section digests')
+    assertion(e.section_digests(jobs=1), e.section_digests(jobs=4),
+              'Section digests, sequential and threaded')
+    # Without certificates, Authenticode hashes all the file except the
+    # checksum and the security directory entry
+    cs = e.checksum_offset()
+    sd = cs - 64 + 0x60 + 8 * pe.DIRECTORY_ENTRY_SECURITY
+    digest = hashlib.sha256(raw[:cs]+raw[cs+4:sd]+raw[sd+8:]).hexdigest()
+    assertion(digest, e.authenticode_digest(), 'Authenticode digest')
+    # With a certificate table, which is not hashed, at the end of file
+    cert = struct.pack('<IHH', 16, 0x200, 2) + struct.pack('8B', *[1]*8)
+    signed = StrPatchwork(raw)
+    signed[len(raw)] = struct.pack('%dx' % (-len(raw) % 8))
+    padded = signed.pack()
+    signed[sd] = struct.pack('<II', len(padded), len(cert))
+    signed[cs] = struct.pack('<I', 0x1234)
+    signed[len(padded)] = cert
+    e = PE(signed.pack())
+    digest = hashlib.sha256(padded[:cs]+padded[cs+4:sd]+padded[sd+8:]).hexdigest()
+    assertion(digest, e.authenticode_digest(),
+              'Authenticode digest, with a certificate table')
+
+def test_PE_resources(assertion):
+    e = PE(open(__dir__+'/binary_input/pe_vstudio.dll', 'rb').read())
+    entry = e.DirRes[0].entries[0]
+    assertion(False, isinstance(entry._dir, pe.ResourceDescriptor),
+              'Resources: subdirectories are parsed when used')
+    assertion([(pe.RT_MANIFEST, 2, 1033, 381)],
+              [(t, n, l, d.size) for t, n, l, d in e.DirRes.resources()],
+              'Resources: list')
+    d = e.DirRes.get(pe.RT_MANIFEST, 2, 1033)
+    assertion((381, '<?xml version'.encode('latin1'), True),
+              (len(d.view()), to_bytes(d.view()[:13]),
+               d.data == to_bytes(d.view())),
+              'Resources: data of the manifest')
+    assertion((None, None, [], 1),
+              (e.DirRes.get(pe.RT_VERSION), e.DirRes.get(pe.RT_MANIFEST, 3),
+               list(e.DirRes.resources(type=pe.RT_VERSION)),
+               len(list(e.DirRes.resources(lang=1033)))),
+              'Resources: not found')
+    e = PE(open(__dir__+'/binary_input/Ange/namedresource.exe', 'rb').read())
+    assertion([('TYPE', 'RES', 0, 45)],
+              [(t, n, l, d.size) for t, n, l, d in e.DirRes.resources()],
+              'Resources: named resources')
+
+def test_PE_rebase(assertion):
+    raw = open(__dir__+'/binary_input/pe_vstudio.dll', 'rb').read()
+    e = PE(raw)
+    relocs = e.relocations()
+    assertion((385, (0x11ae1, pe.IMAGE_REL_BASED_HIGHLOW, None)),
+              (len(relocs), relocs[0]),
+              'Base relocations')
+    values = [struct.unpack('<I', e.rva[rva:rva+4])[0]
+              for rva, t, arg in relocs]
+    e.rebase(0x20000000)
+    assertion([(v + 0x10000000) & 0xffffffff for v in values],
+              [struct.unpack('<I', e.rva[rva:rva+4])[0]
+               for rva, t, arg in relocs],
+              'Rebase: relocated values')
+    off = e.rva2off(relocs[0][0])
+    assertion((0x20000000, e.rva[relocs[0][0]:relocs[0][0]+4]),
+              (e.NThdr.ImageBase, e[off:off+4]),
+              'Rebase: ImageBase and file content')
+    image = PE(raw).load_image(0x20000000)
+    assertion(e.load_image()[0x1000:], image[0x1000:],
+              'Rebase: loaded image')
+    # Only the first paddr bytes of a section are loaded
+    raw = open(__dir__+'/binary_input/pe_mingw.exe', 'rb').read()
+    s = PE(raw).SHList[0]
+    off = s.scnptr + s.paddr
+    raw = raw[:off] + struct.pack('B', 0xcc)*(s.rawsize-s.paddr) \
+        + raw[off+s.rawsize-s.paddr:]
+    e = PE(raw)
+    s = e.SHList[0]
+    image = e.load_image()
+    assertion((0x854, 0xa00), (s.paddr, s.rawsize),
+              'Load image: section with paddr smaller than rawsize')
+    assertion((s.section_data[:s.paddr], struct.pack('B', 0)*0x1ac),
+              (image[s.vaddr:s.vaddr+s.paddr],
+               image[s.vaddr+s.paddr:s.vaddr+s.rawsize]),
+              'Load image: content past paddr is not loaded')
+    # All types of relocations
+    from elfesteem.pe_init import apply_relocations
+    data = array.array('B', struct.pack('<IQHHHH', 0x10001234,
+        0x140001000, 0x1000, 0x1234, 0x1000, 0xffff))
+    apply_relocations(data, [(0, pe.IMAGE_REL_BASED_HIGHLOW, None),
+                             (4, pe.IMAGE_REL_BASED_DIR64, None),
+                             (12, pe.IMAGE_REL_BASED_HIGH, None),
+                             (14, pe.IMAGE_REL_BASED_LOW, None),
+                             (16, pe.IMAGE_REL_BASED_HIGHADJ, 0x8000),
+                             (18, pe.IMAGE_REL_BASED_HIGHADJ, 0x7fff)],
+                      0x12348000)
+    assertion((0x22349234, 0x152349000, 0x2234, 0x9234, 0x2234, 0x1234),
+              struct.unpack('<IQHHHH', to_bytes(data)),
+              'Relocation types')
+
+def test_PE_exports(assertion):
+    from elfesteem.pe_init import ExportResolver
+    e = PE(open(__dir__+'/binary_input/pe_vstudio.dll', 'rb').read())
+    idx = e.DirExport.expdesc.index
+    assertion((True, idx.ordinal('??0CMyLib@@QAE@XZ')),
+              (idx.names == sorted(idx.names),
+               idx.search('??0CMyLib@@QAE@XZ')),
+              'Exports: binary search in the ENPT')
+    funcs = e.export_funcs()
+    cached = e._export_funcs[3]
+    funcs['??0CMyLib@@QAE@XZ'] = 0
+    assertion((True, cached['??0CMyLib@@QAE@XZ']),
+              (e.export_funcs() == cached and e._export_funcs[3] is cached,
+               e.rva2virt(e.DirExport.get_export('??0CMyLib@@QAE@XZ'))),
+              'Exports: export_funcs is cached, and returns a copy')
+    e.rebase(0x20000000)
+    assertion(e.rva2virt(e.DirExport.get_export('??0CMyLib@@QAE@XZ')),
+              e.export_funcs()['??0CMyLib@@QAE@XZ'],
+              'Exports: export_funcs after rebase')
+    # Forwarders
+    dllfw = PE(open(__dir__+'/binary_input/Ange/dllfw.dll', 'rb').read())
+    assertion(({0: 'msvcrt.printf'}, 'msvcrt.printf', None),
+              (dllfw.DirExport.forwarders(),
+               dllfw.DirExport.get_export('ExitProcess'),
+               dllfw.resolve_export('ExitProcess')),
+              'Exports: forwarder')
+    msvcrt = PE()
+    msvcrt.DirExport.create([('printf', 0x1234)], name='msvcrt.dll')
+    resolver = ExportResolver()
+    resolver.add('MSVCRT.DLL', msvcrt)
+    assertion((msvcrt, 0x1234),
+              dllfw.resolve_export('ExitProcess', resolver),
+              'Exports: forwarder resolved')
+    resolver = ExportResolver([__dir__+'/binary_input/Ange'])
+    assertion((True, None, True),
+              (isinstance(resolver('DLLFW'), PE), resolver('msvcrt'),
+               resolver('dllfw.dll') is resolver('DLLFW')),
+              'Exports: DLLs found in a directory, and cached')
+
+def test_PE_strtable(assertion):
+    from elfesteem.pe_init import StrTable
+    names = [_.encode('latin1') for _ in ('first', 'second_name', 'name',
+                                          'abc', 'defg', 'xy')]
+    t = StrTable(struct.pack('<I', 25) + data_null.join(names[:2]+names[5:]))
+    assertion((names[0], names[1], names[2], ''),
+              (t.getby_offset(4), t.getby_offset(10), t.getby_offset(17),
+               t.getby_offset(100)),
+              'String table: names at any offset')
+    assertion((10, [10, 22, 26]),
+              (t.getby_name(names[1]), t.add([names[1], names[3], names[4]])),
+              'String table: add names')
+    assertion((struct.pack('<I', 25) + data_null.join(names[:2]+names[3:]),
+               names[4]),
+              (t.pack(), t.getby_offset(26)),
+              'String table: pack')
+
+def test_PE_exception(assertion):
+    # x64: RUNTIME_FUNCTION with begin, end and UNWIND_INFO
+    e = PE(wsize=64)
+    e.SHList.add_section(name='.text', rawsize=0x1000)
+    s = e.SHList.add_section(name='.xdata', data=struct.pack('<4B2BHI',
+        1|(pe.UNW_FLAG_EHANDLER<<3), 4, 1, 0, 4, 0x42, 0, 0x1234))
+    pdata = struct.pack('<9I', 0x1000, 0x1010, s.vaddr,
+                               0x1020, 0x1080, s.vaddr,
+                               0x1080, 0x1100, s.vaddr)
+    s = e.SHList.add_section(name='.pdata', data=pdata)
+    e.NThdr.optentries[pe.DIRECTORY_ENTRY_EXCEPTION].rva = s.vaddr
+    e.NThdr.optentries[pe.DIRECTORY_ENTRY_EXCEPTION].size = len(pdata)
+    e = PE(e.pack())
+    assertion((3, (0x1020, 0x1080, 0x2000)),
+              (len(e.DirException), e.DirException[1]),
+              'Exception directory: parsing')
+    assertion([None, (0x1000, 0x1010), None, (0x1020, 0x1080),
+               (0x1080, 0x1100), None],
+              [e.DirException.function_at(rva)
+               for rva in (0xfff, 0x1000, 0x1010, 0x1020, 0x10ff, 0x1100)],
+              'Exception directory: function_at')
+    u = e.DirException.unwind_info(0)
+    assertion((1, pe.UNW_FLAG_EHANDLER, 4, [(4, 2, 4)], 0x1234, True),
+              (u.version, u.flags, u.sizeofprolog,
+               [(c.codeoffset, c.op, c.info) for c in u.codes], u.handler,
+               u is e.DirException.unwind_info(2)),
+              'Exception directory: UNWIND_INFO')
+    # ARM64: the length of the function is in the unwind data
+    e = PE(wsize=64)
+    e.COFFhdr.machine = pe.IMAGE_FILE_MACHINE_ARM64
+    e.SHList.add_section(name='.text', rawsize=0x1000)
+    s = e.SHList.add_section(name='.xdata', data=struct.pack('<I', 0x20))
+    pdata = struct.pack('<4I', 0x1040, s.vaddr, 0x1000, (0x10<<2)|1)
+    s = e.SHList.add_section(name='.pdata', data=pdata)
+    e.NThdr.optentries[pe.DIRECTORY_ENTRY_EXCEPTION].rva = s.vaddr
+    e.NThdr.optentries[pe.DIRECTORY_ENTRY_EXCEPTION].size = len(pdata)
+    e = PE(e.pack())
+    global log_history
+    log_history = []
+    assertion(([(0x1040, 0x10c0), (0x1000, 0x1040), None],
+               [('warn', ('Exception directory not sorted',), {})]),
+              ([e.DirException.function_at(rva)
+                for rva in (0x1040, 0x103f, 0x10c0)], log_history),
+              'Exception directory: ARM64')
+    log_history = []
+
+def test_COFF_symbol_index(assertion):
+    obj_mingw = open(__dir__+'/binary_input/coff_mingw.obj', 'rb').read()
+    e = COFF(obj_mingw)
+    s = e.Symbols
+    assertion(['.file', None, '_main', '.text', None, '.data', None],
+              [getattr(s.getbyindex(i), 'name', None) for i in range(7)],
+              'COFF symbols: by raw index')
+    assertion(('.file', '.text', None),
+              (s.getbyindex(1, aux=True).name, s.getbyindex(4, aux=True).name,
+               s.getbyindex(12)),
+              'COFF symbols: aux entries and out of range')
+    assertion((['_main'], [], '_main', None),
+              ([_.name for _ in s.getbyname('_main')], s.getbyname('_foo'),
+               s.getbyaddress(1, 0x10).name, s.getbyaddress(4, 0)),
+              'COFF symbols: by name and by address')
+    # The index is extended when a symbol is appended
+    sym = s.getbyindex(2)
+    new = sym.__class__(parent=s, content=sym.pack(), start=0)
+    s.append(new)
+    assertion((new, 12, [sym, new]),
+              (s.getbyindex(12), s.indexof(new), s.getbyname('_main')),
+              'COFF symbols: index after append')
+
 def test_PE_ange(assertion):
     global log_history
     # Parse some ill-formed PE made by Ange Albertini
     e = PE(open(__dir__+'/binary_input/Ange/resourceloop.exe', 'rb').read())
+    e.DirRes[0].show_tree() # The resource tree is parsed when used
     assertion([('warn', ('Resource tree too deep',), {})]*212,
               log_history,
               'Ange/resourceloop.exe (logs)')
@@ -351,6 +927,7 @@ def test_PE_ange(assertion):
               log_history,
               'Ange/dllbound-ld.exe (logs)')
     e = PE(open(__dir__+'/binary_input/Ange/d_tiny.dll', 'rb').read())
+    e.parse_pending()
     assertion([('warn', ('Opthdr magic %#x', 31074), {}),
                ('warn', ('Number of rva %d does not match sizeofoptionalheader %d', 0, 13864), {}),
                ('warn', ('Windows 8 needs at least 13 directories, %d found', 0), {}),
@@ -364,6 +941,7 @@ def test_PE_ange(assertion):
               log_history,
               'Ange/dllfw.dll (logs)')
     e = PE(open(__dir__+'/binary_input/Ange/tinydllXP.dll', 'rb').read())
+    e.parse_pending()
     assertion([('warn', ('Number of rva %d does not match sizeofoptionalheader %d', 0, 0), {}),
                ('warn', ('Windows 8 needs at least 13 directories, %d found', 0), {}),
                ('warn', ('File too short for StrTable 0x55 != 0xc258016a',), {})],
@@ -371,6 +949,7 @@ def test_PE_ange(assertion):
               'Ange/tinydllXP.dll (logs)')
     log_history = []
     e = PE(open(__dir__+'/binary_input/Ange/resourceloop.exe', 'rb').read())
+    e.DirRes[0].show_tree()
     log_history = []
     d = e.DirRes.display().encode('latin1')
     assertion('98701be30b09759a64340e5245e48195',
@@ -480,6 +1059,7 @@ def test_COFF_invalidity(assertion):
     obj_mingw[8] = struct.pack("<I", 220)
     obj_mingw[436] = struct.pack("<I", 10000)
     e = COFF(obj_mingw)
+    e.parse_pending()
     assertion([('warn', ('File too short for StrTable 0x4 != 0x2710',), {})],
               log_history,
               'File too short for StrTable (logs)')